@@ -0,0 +1,37 @@
+"""
+Caches behind get_current_user.
+
+Verified token claims are cached by token, so a token seen before is not
+decoded and its signature not checked again until the entry expires (never
+later than the token's own `exp`). Resolved users are cached by username,
+so steady-state authentication is two dictionary lookups instead of a JWT
+decode and a users query.
+
+Only active users are cached. Updating or disabling a user drops their entry
+(invalidate_user); the caches are per process, so with several workers the
+TTL bounds how long another worker can still see the old record.
+"""
+import os
+import time
+
+from cache import TTLCache
+
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", 60))
+
+token_claims_cache = TTLCache(maxsize=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 4096)), ttl=AUTH_CACHE_TTL_SECONDS)
+auth_user_cache = TTLCache(maxsize=int(os.getenv("AUTH_USER_CACHE_SIZE", 1024)), ttl=AUTH_CACHE_TTL_SECONDS)
+
+def cache_claims(token: str, claims: dict):
+    """Remember verified claims for `token`, no longer than it stays valid"""
+    ttl = token_claims_cache.ttl
+    if claims.get("exp") is not None:
+        ttl = min(ttl, claims["exp"] - time.time())
+    if ttl > 0:
+        token_claims_cache.set(token, claims, ttl=ttl)
+
+def invalidate_user(username: str):
+    """Drop a user's cached record after it was updated or disabled"""
+    return auth_user_cache.pop(username) is not None
+
+def stats():
+    return {"token_claims": token_claims_cache.stats(), "users": auth_user_cache.stats()}
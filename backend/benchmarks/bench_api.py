@@ -0,0 +1,301 @@
+"""
+Throughput and latency of the main API endpoints, with a baseline to compare against.
+
+Drives the real app in-process through httpx's ASGI transport, with the LLM
+stubbed out (a canned completion after --llm-latency-ms). Each endpoint is
+run in turn: --warmup untimed requests, then --requests timed ones with at
+most --concurrency in flight. For each endpoint it reports requests/s and
+p50/p95/p99 latency.
+
+--backend memory (the default) needs nothing else. --backend mongo uses the
+database configured by MONGODB_URI / DATABASE_NAME; use a scratch database,
+because the benchmark's users and their documents are deleted at the end.
+Payloads come from a seeded random generator, so repeated runs send the same
+requests.
+
+--save writes the results as a JSON baseline. --compare reads a baseline and
+flags every endpoint whose throughput dropped, or whose p95/p99 rose, by more
+than --tolerance, or that failed more requests. It exits with status 1 when
+anything regressed.
+
+Usage (from the backend directory):
+    python benchmarks/bench_api.py --concurrency 32 --requests 1000 --save baseline.json
+    python benchmarks/bench_api.py --concurrency 32 --requests 1000 --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+ENDPOINTS = (
+    "create_symptom",
+    "list_symptoms",
+    "list_medications",
+    "increment_medication_adherence",
+    "login",
+    "generate_report",
+)
+# Compared with the baseline; throughput regresses downwards, latencies upwards
+HIGHER_IS_BETTER = ("throughput_rps",)
+LOWER_IS_BETTER = ("p95_ms", "p99_ms")
+
+SYMPTOM_NAMES = ("Headache", "Cough", "Fatigue", "Nausea", "Dizziness", "Back pain", "Insomnia")
+MEDICATIONS = (("Ibuprofen", 3), ("Paracetamol", 4), ("Vitamin D", 1), ("Metformin", 2), ("Loratadine", 1))
+PASSWORD = "bench-password"
+
+
+class FakeGroq:
+    """Stands in for groq.AsyncGroq: every completion is the same short report"""
+
+    latency = 0.0
+
+    def __init__(self, *args, **kwargs):
+        self.chat = self
+        self.completions = self
+
+    async def create(self, messages, model, stream=False):
+        await asyncio.sleep(self.latency)
+        usage = type("Usage", (), {"prompt_tokens": 900, "completion_tokens": 250})()
+        message = type("Message", (), {"content": "### HEALTH SUMMARY\nBenchmark report."})()
+        return type("Completion", (), {"choices": [type("Choice", (), {"message": message})()], "usage": usage})()
+
+    async def close(self):
+        pass
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    return sorted_values[max(0, int(round(len(sorted_values) * fraction)) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+class Workload:
+    """Deterministic requests for each endpoint, spread over the benchmark users"""
+
+    def __init__(self, users, seed):
+        self.users = users
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.started = datetime.now().replace(microsecond=0) + timedelta(days=1)
+
+    def next_user(self):
+        self.calls += 1
+        return self.users[self.calls % len(self.users)]
+
+    def request(self, endpoint):
+        """(method, url, keyword arguments for httpx) of the next `endpoint` request"""
+        user = self.next_user()
+        if endpoint == "create_symptom":
+            return "POST", f"/api/symptoms?user_id={user['_id']}", {"json": {
+                "name": self.random.choice(SYMPTOM_NAMES),
+                "details": f"Benchmark entry {self.calls}",
+                "severity": self.random.randint(1, 10),
+            }}
+        if endpoint == "list_symptoms":
+            return "GET", f"/api/symptoms/{user['_id']}?limit=100", {}
+        if endpoint == "list_medications":
+            return "GET", f"/api/medications/{user['_id']}", {}
+        if endpoint == "increment_medication_adherence":
+            medication_id = self.random.choice(user["medications"])
+            return "POST", f"/api/medications/increment-adherence?medication_id={medication_id}&user_id={user['_id']}", {}
+        if endpoint == "login":
+            return "POST", "/api/auth/login", {"data": {"username": user["username"], "password": PASSWORD}}
+        if endpoint == "generate_report":
+            # A different period each time, so the report cache and singleflight do not absorb the load
+            end = self.started + timedelta(minutes=self.calls)
+            params = {"start_date": (end - timedelta(days=90)).isoformat(), "end_date": end.isoformat()}
+            return "GET", f"/api/reports/{user['_id']}", {"params": params}
+        raise ValueError(f"Unknown endpoint {endpoint}")
+
+
+async def drive(http, workload, endpoint, total, concurrency):
+    """Send `total` requests to `endpoint` with at most `concurrency` in flight"""
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        method, url, kwargs = workload.request(endpoint)
+        async with semaphore:
+            started = time.perf_counter()
+            response = await http.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return latencies, errors, time.perf_counter() - started
+
+
+async def create_users(http, count, seed):
+    """Register `count` users, each with a few medications; their ids and medication ids"""
+    rng = random.Random(seed)
+    users = []
+    for index in range(count):
+        username = f"bench_{seed}_{index}"
+        response = await http.post("/api/auth/register", json={
+            "username": username, "email": f"{username}@example.com", "hashed_password": PASSWORD,
+        })
+        response.raise_for_status()
+        token = (await http.post("/api/auth/login", data={"username": username, "password": PASSWORD})).json()["access_token"]
+        user_id = (await http.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})).json()["_id"]
+        medications = []
+        for name, frequency in rng.sample(MEDICATIONS, 3):
+            response = await http.post(f"/api/medications/?user_id={user_id}", json={
+                "name": name, "frequency": frequency, "times": [f"{8 + 4 * slot:02d}:00" for slot in range(frequency)],
+            })
+            medications.append(response.json()["_id"])
+        # Something to report on, even when create_symptom is not benchmarked
+        for _ in range(10):
+            await http.post(f"/api/symptoms?user_id={user_id}", json={
+                "name": rng.choice(SYMPTOM_NAMES), "details": "Seeded entry", "severity": rng.randint(1, 10),
+            })
+        users.append({"_id": user_id, "username": username, "medications": medications})
+    return users
+
+
+async def delete_users(app, users):
+    if app.database is None:
+        return
+    user_ids = [user["_id"] for user in users]
+    for collection in ("symptoms", "medications", "symptom_daily_rollups", "deletions", "report_jobs"):
+        await app.database[collection].delete_many({"user_id": {"$in": user_ids}})
+    await app.database["data_versions"].delete_many({"_id": {"$in": user_ids}})
+    await app.database["users"].delete_many({"username": {"$in": [user["username"] for user in users]}})
+
+
+async def run(args):
+    import httpx
+    from llm import reset_llm_client
+    from main import app
+
+    FakeGroq.latency = args.llm_latency_ms / 1000
+    reset_llm_client()
+    results = {}
+    with patch("llm.AsyncGroq", FakeGroq):
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as http:
+                users = await create_users(http, args.users, args.seed)
+                try:
+                    workload = Workload(users, args.seed)
+                    for endpoint in args.endpoints:
+                        await drive(http, workload, endpoint, args.warmup, args.concurrency)
+                        latencies, errors, elapsed = await drive(http, workload, endpoint, args.requests, args.concurrency)
+                        results[endpoint] = summarize(latencies, errors, elapsed)
+                        print_result(endpoint, results[endpoint])
+                finally:
+                    await delete_users(app, users)
+        reset_llm_client()
+    return results
+
+
+def print_result(endpoint, result):
+    errors = f"   {result['errors']} errors" if result["errors"] else ""
+    print(f"{endpoint:<32} {result['throughput_rps']:>9.1f} req/s   p50 {result['p50_ms']:>8.2f} ms"
+          f"   p95 {result['p95_ms']:>8.2f} ms   p99 {result['p99_ms']:>8.2f} ms{errors}")
+
+
+def compare(results, baseline, tolerance):
+    """Print each metric against the baseline; the list of regressions"""
+    regressions = []
+    print(f"\ncompared with the baseline (tolerance {tolerance:.0%}):")
+    for endpoint, result in results.items():
+        before = baseline["endpoints"].get(endpoint)
+        if before is None:
+            print(f"{endpoint:<32} not in the baseline")
+            continue
+        for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            change = (result[metric] - before[metric]) / before[metric] if before[metric] else 0.0
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = "REGRESSION" if worse > tolerance else ""
+            if flag:
+                regressions.append((endpoint, metric, before[metric], result[metric]))
+            print(f"{endpoint:<32} {metric:<15} {before[metric]:>10.2f} -> {result[metric]:>10.2f}   {change:>+7.1%}   {flag}")
+        if result["errors"] > before["errors"]:
+            regressions.append((endpoint, "errors", before["errors"], result["errors"]))
+            print(f"{endpoint:<32} {'errors':<15} {before['errors']:>10} -> {result['errors']:>10}              REGRESSION")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=("memory", "mongo"), default="memory")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=1000, help="timed requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=50, help="untimed requests per endpoint first")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--llm-latency-ms", type=float, default=0, help="simulated LLM response time")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", metavar="PATH", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="flag regressions against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative change (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    # Read by main at import time
+    os.environ["DATABASE_BACKEND"] = args.backend
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    # Keep per-request log events out of the timings and the output
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    print(f"backend={args.backend} concurrency={args.concurrency} requests={args.requests} "
+          f"users={args.users} llm latency={args.llm_latency_ms} ms")
+    results = asyncio.run(run(args))
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "backend": args.backend,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "users": args.users,
+            "llm_latency_ms": args.llm_latency_ms,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "endpoints": results,
+    }
+    if args.save:
+        with open(args.save, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"\nbaseline written to {args.save}")
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if {key: baseline["meta"].get(key) for key in ("backend", "concurrency", "llm_latency_ms")} != \
+                {key: report["meta"][key] for key in ("backend", "concurrency", "llm_latency_ms")}:
+            print("warning: the baseline was recorded with different settings")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s)")
+            sys.exit(1)
+        print("\nno regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Concurrent throughput of list_symptoms / create_symptom, sync vs async data layer.
+
+"before" is a minimal app with the previous handlers: sync `def` routes on a
+blocking MongoClient, so every request occupies one of Starlette's threadpool
+slots. "after" is the real app running its async handlers on the shared
+AsyncMongoClient, with the pool settings from database.get_client_options().
+Both are driven in-process through httpx's ASGI transport against the database
+configured by MONGODB_URI / DATABASE_NAME (use a scratch database, the
+benchmark user's documents are deleted at the end).
+
+Usage (from the backend directory):
+    python benchmarks/bench_async_db.py --concurrency 64 --requests 2000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import httpx
+from bson import ObjectId
+from dotenv import load_dotenv
+from fastapi import Body, FastAPI, Request
+from pymongo import MongoClient
+
+from database import create_client
+from repositories import create_repositories
+from models import SymptomCreate
+from main import app as async_app
+
+load_dotenv()
+
+MONGODB_URI = os.getenv("MONGODB_URI")
+DATABASE_NAME = os.getenv("DATABASE_NAME")
+
+
+def build_sync_app(database):
+    """The pre-async handlers, kept here only as the benchmark baseline"""
+    sync_app = FastAPI()
+    sync_app.database = database
+
+    @sync_app.post("/api/symptoms")
+    def create_symptom(request: Request, user_id: str, symptom: SymptomCreate = Body(...)):
+        symptom_data = symptom.dict()
+        symptom_data["user_id"] = user_id
+        symptom_data["timestamp"] = datetime.now(timezone.utc) + timedelta(hours=4)
+        symptoms_collection = request.app.database.get_collection("symptoms")
+        new_symptom = symptoms_collection.insert_one(symptom_data)
+        created_symptom = symptoms_collection.find_one({"_id": new_symptom.inserted_id})
+        created_symptom["_id"] = str(created_symptom["_id"])
+        return created_symptom
+
+    @sync_app.get("/api/symptoms/{user_id}")
+    def list_symptoms(request: Request, user_id: str, skip: int = 0, limit: int = 100):
+        symptoms_collection = request.app.database.get_collection("symptoms")
+        symptoms = list(symptoms_collection.find({"user_id": user_id}).skip(skip).limit(limit))
+        for symptom in symptoms:
+            symptom["_id"] = str(symptom["_id"])
+        return symptoms
+
+    return sync_app
+
+
+async def drive(app, method, url, total, concurrency, json=None):
+    """Fire `total` requests with at most `concurrency` in flight, return (req/s, latencies)"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await http.request(method, url, json=json)
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return total / elapsed, latencies
+
+
+def report(label, throughput, latencies):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"{label:<42} {throughput:>9.1f} req/s   p50 {p50:>7.2f} ms   p95 {p95:>7.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    user_id = str(ObjectId())
+    symptom = {"name": "Headache", "details": "Benchmark entry", "severity": 5}
+
+    sync_client = MongoClient(MONGODB_URI)
+    async_client = create_client()
+    async_app.database = async_client[DATABASE_NAME]
+    async_app.repositories = create_repositories(async_app.database)
+    sync_app = build_sync_app(sync_client[DATABASE_NAME])
+
+    print(f"concurrency={args.concurrency} requests={args.requests}")
+    try:
+        for label, app in (("before (sync + threadpool)", sync_app), ("after (async)", async_app)):
+            throughput, latencies = await drive(
+                app, "POST", f"/api/symptoms?user_id={user_id}", args.requests, args.concurrency, json=symptom
+            )
+            report(f"create_symptom {label}", throughput, latencies)
+
+            throughput, latencies = await drive(
+                app, "GET", f"/api/symptoms/{user_id}", args.requests, args.concurrency
+            )
+            report(f"list_symptoms {label}", throughput, latencies)
+    finally:
+        await async_client.get_database(DATABASE_NAME)["symptoms"].delete_many({"user_id": user_id})
+        await async_client.get_database(DATABASE_NAME)["symptom_daily_rollups"].delete_many({"user_id": user_id})
+        await async_client.close()
+        sync_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+"""
+Latency of an unrelated endpoint during a burst of logins.
+
+"before" verifies passwords with bcrypt on the event loop, as login used to;
+"after" is the real login, which verifies on passwords.password_hasher's
+thread pool. In each run a burst of logins is fired while a user's symptom
+list is polled one request at a time, and the list's p50/p99 is reported
+along with login throughput. Runs in-process against the in-memory backend
+through httpx's ASGI transport; no database needed.
+
+Usage (from the backend directory):
+    python benchmarks/bench_login_burst.py --logins 64 --concurrency 16
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import httpx
+from bson import ObjectId
+
+from memory_repositories import create_memory_repositories
+from passwords import BCRYPT_ROUNDS, password_hasher
+from main import app
+
+POLL_INTERVAL = 0.01
+
+
+async def verify_on_loop(password, hashed_password):
+    """The previous verify_password: bcrypt straight on the event loop"""
+    return password_hasher.context.verify_and_update(password, hashed_password)
+
+
+def percentile(latencies, fraction):
+    latencies = sorted(latencies)
+    return latencies[max(0, int(len(latencies) * fraction) - 1)]
+
+
+async def run(logins, concurrency, user_id):
+    """(logins/s, symptom list latencies) for one burst"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        semaphore = asyncio.Semaphore(concurrency)
+        burst_done = asyncio.Event()
+        listing = []
+
+        async def login():
+            async with semaphore:
+                response = await http.post("/api/auth/login", data={"username": "bench_user", "password": "bench-password"})
+                response.raise_for_status()
+
+        async def poll_symptoms():
+            # Latency counts from when each request was due, so time the loop
+            # was blocked before it could even send one is not left out
+            due = time.perf_counter()
+            while not burst_done.is_set():
+                (await http.get(f"/api/symptoms/{user_id}")).raise_for_status()
+                now = time.perf_counter()
+                listing.append(now - due)
+                due = max(due + POLL_INTERVAL, now)
+                await asyncio.sleep(due - now)
+
+        poller = asyncio.ensure_future(poll_symptoms())
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+        burst_done.set()
+        await poller
+
+    return logins / elapsed, listing
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    app.repositories = create_memory_repositories()
+    user_id = str(ObjectId())
+    for i in range(20):
+        await app.repositories.symptoms.create({"name": "Headache", "details": f"Entry {i}", "severity": 1 + i % 10,
+                                               "user_id": user_id, "timestamp": datetime(2026, 1, 1) + timedelta(hours=i)})
+    await app.repositories.users.create({
+        "username": "bench_user",
+        "email": None,
+        "hashed_password": await password_hasher.hash("bench-password"),
+    })
+
+    print(f"logins={args.logins} concurrency={args.concurrency} "
+          f"bcrypt rounds={BCRYPT_ROUNDS} workers={password_hasher.workers}")
+    try:
+        for label, verify in (("before (on the loop)", verify_on_loop), ("after (hash pool)", None)):
+            if verify is None:
+                throughput, listing = await run(args.logins, args.concurrency, user_id)
+            else:
+                with patch("routes.auth.verify_password", verify):
+                    throughput, listing = await run(args.logins, args.concurrency, user_id)
+            print(f"{label:<22} {throughput:>7.1f} logins/s   list p50 {statistics.median(listing) * 1000:>8.2f} ms"
+                  f"   p99 {percentile(listing, 0.99) * 1000:>8.2f} ms   ({len(listing)} samples)")
+    finally:
+        password_hasher.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
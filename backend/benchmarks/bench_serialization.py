@@ -0,0 +1,85 @@
+"""
+Serialization time of symptom documents, per 1,000 documents.
+
+"before" is what list_symptoms used to do: rewrite each `_id` to a string in
+Python, then FastAPI's jsonable_encoder followed by JSONResponse's json.dumps.
+"after" is bson_json.dumps (orjson, ObjectId and datetime encoded natively).
+No database or server involved; documents are generated in memory.
+
+Usage (from the backend directory):
+    python benchmarks/bench_serialization.py --docs 1000 --rounds 200
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from bson_json import dumps
+
+
+def make_documents(count):
+    start = datetime(2026, 1, 1, 8, 0, 0, 123000)
+    return [
+        {
+            "_id": ObjectId(),
+            "name": ("Headache", "Cough", "Fatigue", "Nausea")[i % 4],
+            "details": f"Entry {i}: woke up with it, eased after lunch",
+            "severity": 1 + i % 10,
+            "user_id": "507f1f77bcf86cd799439011",
+            "timestamp": start + timedelta(minutes=37 * i),
+            "modified_at": start + timedelta(minutes=37 * i, seconds=1),
+        }
+        for i in range(count)
+    ]
+
+
+def before(documents):
+    for document in documents:
+        document["_id"] = str(document["_id"])
+    # JSONResponse.render
+    return json.dumps(jsonable_encoder(documents), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def after(documents):
+    return dumps(documents)
+
+
+def measure(encode, docs, rounds):
+    timings = []
+    for _ in range(rounds):
+        documents = make_documents(docs)
+        started = time.perf_counter()
+        encode(documents)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    sample = make_documents(3)
+    assert json.loads(before([dict(d) for d in sample])) == json.loads(after(sample)), "encoders disagree"
+
+    per_1k = 1000 / args.docs
+    results = {}
+    for label, encode in (("before", before), ("after", after)):
+        timings = measure(encode, args.docs, args.rounds)
+        results[label] = statistics.median(timings) * per_1k
+        print(f"{label:>6}: median {results[label] * 1000:.2f} ms / 1k docs, "
+              f"p95 {sorted(timings)[int(len(timings) * 0.95) - 1] * per_1k * 1000:.2f} ms")
+    print(f"speedup: {results['before'] / results['after']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
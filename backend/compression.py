@@ -0,0 +1,156 @@
+"""
+Opt-in response compression.
+
+RESPONSE_COMPRESSION=gzip compresses responses of at least
+RESPONSE_COMPRESSION_MIN_BYTES (symptom pages, reports) for clients that
+accept gzip; RESPONSE_COMPRESSION=br prefers brotli when the client accepts
+it and the `brotli` package is installed, and falls back to gzip otherwise.
+Unset (the default), nothing is compressed. Event streams and PDFs are sent
+as they are.
+
+A compressed body is a different representation, so its ETag gets the
+encoding appended (RFC 9110); etags.matching_etag accepts either form.
+"""
+import os
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "").strip().lower()
+MINIMUM_SIZE = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", 1024))
+# Per-request CPU matters more than the last few percent of size
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+EXCLUDED_CONTENT_TYPES = ("text/event-stream", "application/pdf")
+
+def accepted_encodings(header: str) -> dict:
+    """Content codings of an Accept-Encoding header and their q-values"""
+    encodings = {}
+    for item in header.split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        encodings[coding.lower()] = quality
+    return encodings
+
+def _quality(encodings: dict, coding: str) -> float:
+    # "*" stands for any coding the header does not name
+    return encodings.get(coding, encodings.get("*", 0.0))
+
+class GZipCompressor:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, body: bytes, more_body: bool) -> bytes:
+        # Flush each chunk of a streamed body so the client gets it without waiting
+        return self._compressor.compress(body) + self._compressor.flush(zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH)
+
+class BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, body: bytes, more_body: bool) -> bytes:
+        return self._compressor.process(body) + (self._compressor.flush() if more_body else self._compressor.finish())
+
+COMPRESSORS = {"gzip": GZipCompressor, "br": BrotliCompressor}
+
+class CompressionMiddleware:
+    """
+    Compresses response bodies with the client's preferred accepted coding.
+    A plain ASGI `send` wrapper: the start message is held until the first
+    body chunk shows whether the response is worth compressing.
+    """
+
+    def __init__(self, app, encoding: str = "gzip", minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.brotli = encoding == "br" and brotli is not None
+
+    def _choose(self, scope):
+        encodings = accepted_encodings(Headers(scope=scope).get("Accept-Encoding", ""))
+        br_quality = _quality(encodings, "br") if self.brotli else 0.0
+        gzip_quality = _quality(encodings, "gzip")
+        if br_quality > 0 and br_quality >= gzip_quality:
+            return "br"
+        if gzip_quality > 0:
+            return "gzip"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = self._choose(scope)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+                if "content-encoding" in headers or content_type in EXCLUDED_CONTENT_TYPES:
+                    passthrough = True
+                    await send(message)
+                else:
+                    # Held back: its headers depend on whether the body gets compressed
+                    start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                compressor = COMPRESSORS[encoding]()
+                headers["Content-Encoding"] = encoding
+                # A compressed body is another representation (RFC 9110)
+                etag = headers.get("etag")
+                if etag and etag.endswith('"'):
+                    headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+                compressed = compressor.compress(body, more_body)
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(compressed))
+                await send(start_message)
+                await send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+                return
+            await send({"type": "http.response.body", "body": compressor.compress(body, more_body), "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+def add_compression(app, encoding: str = RESPONSE_COMPRESSION):
+    """Install CompressionMiddleware when `encoding` is gzip or br"""
+    if encoding in ("gzip", "br"):
+        app.add_middleware(CompressionMiddleware, encoding=encoding)
@@ -1,18 +1,100 @@
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, monitoring
 from dotenv import load_dotenv
 import os
 
+from metrics import CommandMetrics
+
 # Load environment variables
 load_dotenv()
 
 MONGODB_URI = os.getenv("MONGODB_URI")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 
-# MongoDB client
-client = MongoClient(MONGODB_URI)
-database = client[DATABASE_NAME]
+def _env_int(name: str, default=None):
+    """Read an optional integer setting from the environment"""
+    value = os.getenv(name)
+    return default if value in (None, "") else int(value)
+
+def get_client_options():
+    """Connection pool and timeout settings for the shared MongoDB client"""
+    return {
+        "maxPoolSize": _env_int("MONGODB_MAX_POOL_SIZE", 100),
+        "minPoolSize": _env_int("MONGODB_MIN_POOL_SIZE", 0),
+        "waitQueueTimeoutMS": _env_int("MONGODB_WAIT_QUEUE_TIMEOUT_MS"),
+        "serverSelectionTimeoutMS": _env_int("MONGODB_SERVER_SELECTION_TIMEOUT_MS", 30000),
+        "connectTimeoutMS": _env_int("MONGODB_CONNECT_TIMEOUT_MS", 20000),
+    }
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Live connection pool statistics, fed by pymongo's connection pool events"""
+
+    def __init__(self):
+        self.open_connections = 0
+        self.checked_out = 0
+        self.wait_queue_length = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checkout_time_total = 0.0
+        self.checkout_time_max = 0.0
+
+    def snapshot(self, options=None):
+        """Current pool counters, with checkout latency in milliseconds"""
+        average = self.checkout_time_total / self.checkouts if self.checkouts else 0.0
+        stats = {
+            "open_connections": self.open_connections,
+            "checked_out": self.checked_out,
+            "wait_queue_length": self.wait_queue_length,
+            "checkouts": self.checkouts,
+            "checkout_failures": self.checkout_failures,
+            "checkout_latency_ms": {
+                "avg": round(average * 1000, 3),
+                "max": round(self.checkout_time_max * 1000, 3),
+            },
+        }
+        if options is not None:
+            stats["max_pool_size"] = options["maxPoolSize"]
+            stats["min_pool_size"] = options["minPoolSize"]
+        return stats
+
+    def connection_check_out_started(self, event):
+        self.wait_queue_length += 1
+
+    def connection_checked_out(self, event):
+        self.wait_queue_length -= 1
+        self.checked_out += 1
+        self.checkouts += 1
+        self.checkout_time_total += event.duration
+        self.checkout_time_max = max(self.checkout_time_max, event.duration)
+
+    def connection_check_out_failed(self, event):
+        self.wait_queue_length -= 1
+        self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def connection_created(self, event):
+        self.open_connections += 1
+
+    def connection_closed(self, event):
+        self.open_connections -= 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
 
-# Collections
-symptoms_collection = database.get_collection("symptoms")
-medications_collection = database.get_collection("medications")
-users_collection = database.get_collection("users")
+def create_client(pool_stats: PoolStats = None):
+    """Build the application's single MongoDB client"""
+    event_listeners = [CommandMetrics()] + ([pool_stats] if pool_stats is not None else [])
+    return AsyncMongoClient(MONGODB_URI, event_listeners=event_listeners, **get_client_options())
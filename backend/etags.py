@@ -0,0 +1,59 @@
+"""
+Conditional GETs for per-user read endpoints.
+
+Every write to a user's symptoms or medications bumps that user's data
+version (repositories.DataVersionRepository). A response's ETag is that
+version plus a digest of the request URL. Clients send the ETag back in
+If-None-Match to get a 304 while nothing changed: one small version lookup,
+without the endpoint running its query. "If-None-Match: *" never matches, as
+these endpoints answer for any user id and a 304 must not stand in for a 404.
+"""
+import hashlib
+from datetime import date
+
+from fastapi import Request, Response
+
+# Per-user data: shared caches must not store it, and clients must revalidate
+CACHE_CONTROL = "private, no-cache"
+# Content encodings compression.py appends to the ETag of compressed bodies
+ENCODING_SUFFIXES = ("gzip", "br")
+
+def make_etag(version: int, request: Request, *extra) -> str:
+    """Strong ETag for `request` at data version `version`"""
+    query = sorted(request.query_params.multi_items())
+    digest = hashlib.sha1(repr((request.url.path, query, extra)).encode()).hexdigest()[:16]
+    return f'"{version}-{digest}"'
+
+def matching_etag(request: Request, etag: str):
+    """
+    The If-None-Match entry matching `etag` (weak comparison, as RFC 9110
+    specifies for it), or None. A tag the compression middleware suffixed
+    with its content encoding still matches.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    for candidate in (candidate.strip() for candidate in header.split(",")):
+        opaque = candidate.removeprefix("W/")
+        if opaque == etag or any(opaque == f'{etag[:-1]}-{encoding}"' for encoding in ENCODING_SUFFIXES):
+            return candidate
+    return None
+
+async def check_etag(request: Request, response: Response, user_id: str, *extra):
+    """
+    Look up the user's data version and compute the ETag for this request.
+    Returns a 304 response when the client already has it; otherwise sets the
+    ETag on `response` and returns None. `extra` joins the ETag for responses
+    that depend on more than the URL and the data (e.g. today's date).
+    """
+    version = await request.app.repositories.versions.get(user_id)
+    etag = make_etag(version, request, *extra)
+    matched = matching_etag(request, etag)
+    if matched:
+        return Response(status_code=304, headers={"ETag": matched, "Cache-Control": CACHE_CONTROL})
+    response.headers.update({"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    return None
+
+def report_etag_extra(start_date, end_date):
+    """A defaulted range ends today (and starts 30 days earlier), so it changes daily"""
+    return (date.today().isoformat(),) if start_date is None or end_date is None else ()
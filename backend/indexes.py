@@ -0,0 +1,143 @@
+"""
+Declarative MongoDB index registry.
+
+The indexes below back the user-scoped queries in the routers. They are
+applied at app startup (creating an index that already exists is a no-op, so
+deploys stay idempotent) and can be checked from the command line:
+
+    python indexes.py            # report missing and unused indexes
+    python indexes.py --apply    # create whatever is missing, then report
+"""
+import argparse
+import asyncio
+import logging
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+from logs import get_logger, log_event
+from sync_tokens import TOMBSTONE_TTL_SECONDS
+
+logger = get_logger("indexes")
+
+# Collection name -> indexes the routers rely on
+INDEXES = {
+    "symptoms": [
+        # list_symptoms and generate_report: user_id + timestamp range, and the
+        # (timestamp, _id) keyset used to page through them
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="user_id_timestamp_id"),
+        # Bulk uploads from offline clients: a retried entry is rejected, not stored twice
+        IndexModel(
+            [("user_id", ASCENDING), ("client_id", ASCENDING)],
+            name="user_id_client_id_unique",
+            unique=True,
+            partialFilterExpression={"client_id": {"$type": "string"}},
+        ),
+        # Delta sync: a user's changes in (modified_at, _id) order
+        IndexModel([("user_id", ASCENDING), ("modified_at", ASCENDING), ("_id", ASCENDING)], name="user_id_modified_at_id"),
+        # Symptom search; the user_id prefix keeps each search within one user's entries
+        IndexModel(
+            [("user_id", ASCENDING), ("name", TEXT), ("details", TEXT)],
+            name="user_id_name_details_text",
+            weights={"name": 3, "details": 1},
+        ),
+    ],
+    "medications": [
+        # list_medications and the ownership checks on update/delete/adherence
+        IndexModel([("user_id", ASCENDING), ("_id", ASCENDING)], name="user_id_id"),
+        IndexModel([("user_id", ASCENDING), ("modified_at", ASCENDING), ("_id", ASCENDING)], name="user_id_modified_at_id"),
+    ],
+    "deletions": [
+        # Tombstones for delta sync, expired once no valid sync token can predate them
+        IndexModel([("user_id", ASCENDING), ("modified_at", ASCENDING), ("_id", ASCENDING)], name="user_id_modified_at_id"),
+        IndexModel([("modified_at", ASCENDING)], name="modified_at_ttl", expireAfterSeconds=TOMBSTONE_TTL_SECONDS),
+    ],
+    "users": [
+        # auth login/me and users.create_user lookups
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        # Users registered through /api/auth may not have an email
+        IndexModel(
+            [("email", ASCENDING)],
+            name="email_unique",
+            unique=True,
+            partialFilterExpression={"email": {"$type": "string"}},
+        ),
+    ],
+    "symptom_daily_rollups": [
+        # One rollup per user, day and symptom name; also serves the report range reads
+        IndexModel([("user_id", ASCENDING), ("day", ASCENDING), ("name", ASCENDING)], name="user_id_day_name_unique", unique=True),
+    ],
+    "report_jobs": [
+        # One pending job per equivalent request; `pending` is unset when a job finishes
+        IndexModel(
+            [("dedupe_key", ASCENDING)],
+            name="dedupe_key_pending_unique",
+            unique=True,
+            partialFilterExpression={"pending": True},
+        ),
+        # Startup/lease recovery of queued and stale running jobs
+        IndexModel([("status", ASCENDING), ("started_at", ASCENDING)], name="status_started_at"),
+    ],
+}
+
+def _key(spec):
+    """Comparable form of an index key specification"""
+    return tuple((field, int(direction) if isinstance(direction, (int, float)) else direction)
+                 for field, direction in spec.items())
+
+async def ensure_indexes(database):
+    """Create every registered index that does not exist yet"""
+    for collection_name, models in INDEXES.items():
+        try:
+            await database.get_collection(collection_name).create_indexes(models)
+        except PyMongoError as e:
+            # Keep serving (e.g. existing duplicates block a unique index, and
+            # with it every index of the collection); the report command shows
+            # what is still missing
+            log_event(logger, "index_creation_failed", logging.ERROR, collection=collection_name,
+                      indexes=[model.document["name"] for model in models], error=str(e))
+
+async def index_report(database):
+    """Registered indexes that are missing, and existing indexes with no recorded use"""
+    report = {}
+    for collection_name, models in INDEXES.items():
+        collection = database.get_collection(collection_name)
+        existing = await (await collection.list_indexes()).to_list(length=None)
+        existing_keys = {_key(index["key"]) for index in existing}
+
+        missing = [model.document["name"] for model in models
+                   if _key(model.document["key"]) not in existing_keys]
+
+        try:
+            stats = await (await collection.aggregate([{"$indexStats": {}}])).to_list(length=None)
+        except OperationFailure:
+            stats = []
+        unused = sorted(stat["name"] for stat in stats
+                        if stat["name"] != "_id_" and stat["accesses"]["ops"] == 0)
+
+        report[collection_name] = {"missing": missing, "unused": unused}
+    return report
+
+async def _main(apply: bool):
+    from database import create_client, DATABASE_NAME
+
+    client = create_client()
+    try:
+        database = client[DATABASE_NAME]
+        if apply:
+            await ensure_indexes(database)
+        report = await index_report(database)
+    finally:
+        await client.close()
+
+    for collection_name, result in report.items():
+        print(f"{collection_name}:")
+        print(f"  missing: {', '.join(result['missing']) or '-'}")
+        print(f"  unused since server start: {', '.join(result['unused']) or '-'}")
+    return 1 if any(result["missing"] for result in report.values()) else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report (and optionally create) the registered MongoDB indexes")
+    parser.add_argument("--apply", action="store_true", help="create missing indexes before reporting")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(_main(args.apply)))
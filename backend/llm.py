@@ -0,0 +1,257 @@
+"""
+Shared async client for the report LLM.
+
+One long-lived AsyncGroq client (and its HTTP connection pool) serves every
+request, wrapped with:
+- a per-call timeout,
+- retries with jittered exponential backoff for transient provider errors,
+- a circuit breaker that fails fast while the provider keeps failing,
+- a semaphore capping completions in flight across the process,
+- singleflight: identical concurrent prompts share one upstream call.
+
+complete() returns the whole text; stream() yields it as it is generated.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+
+import groq
+import httpx
+from groq import AsyncGroq
+
+from metrics import llm_request_duration, record_llm_usage
+
+REPORT_MODEL = "llama-3.3-70b-versatile"
+
+# Errors worth retrying: the request may well succeed a moment later
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    groq.APIConnectionError,  # includes APITimeoutError
+    groq.RateLimitError,
+    groq.InternalServerError,
+)
+
+class LLMUnavailableError(Exception):
+    """Raised without calling the provider while the circuit breaker is open"""
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures, lets one trial call through after `reset_after` seconds"""
+
+    def __init__(self, threshold: int = 5, reset_after: float = 30):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_after else "open"
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            # Half-open: re-arm the timer so only this trial call goes through
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+class LLMClient:
+    def __init__(
+        self,
+        api_key: str,
+        timeout: float = 60,
+        max_retries: int = 2,
+        max_concurrency: int = 8,
+        breaker_threshold: int = 5,
+        breaker_reset_after: float = 30,
+        backoff: float = 0.5,
+    ):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset_after)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._inflight = {}
+        # Completions currently holding a concurrency slot
+        self.in_flight = 0
+        # Retries are handled here, so the SDK's own retry loop is disabled
+        self._client = AsyncGroq(
+            api_key=api_key,
+            timeout=timeout,
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+                timeout=timeout,
+            ),
+        )
+
+    async def complete(self, messages, model: str = REPORT_MODEL):
+        """Return the completion text; identical concurrent calls share one upstream request"""
+        key = hashlib.sha1(json.dumps([model, messages], sort_keys=True, default=str).encode()).hexdigest()
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._complete(messages, model))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # Shield the shared call so one caller disconnecting does not cancel it for the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            # Mark the exception retrieved even if every caller went away
+            task.exception()
+
+    async def _complete(self, messages, model):
+        if not self.breaker.allow():
+            raise LLMUnavailableError("Report generation is temporarily unavailable, please try again shortly")
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    self.in_flight += 1
+                    started = time.perf_counter()
+                    outcome = "error"
+                    try:
+                        completion = await asyncio.wait_for(
+                            self._client.chat.completions.create(messages=messages, model=model),
+                            timeout=self.timeout,
+                        )
+                        outcome = "ok"
+                    finally:
+                        self.in_flight -= 1
+                        llm_request_duration.labels(model, "complete", outcome).observe(time.perf_counter() - started)
+            except RETRYABLE_ERRORS:
+                if attempt == self.max_retries:
+                    self.breaker.record_failure()
+                    raise
+                # Full jitter keeps a burst of failed callers from retrying in lockstep
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            else:
+                self.breaker.record_success()
+                record_llm_usage(model, getattr(completion, "usage", None))
+                return completion.choices[0].message.content
+
+    async def stream(self, messages, model: str = REPORT_MODEL):
+        """
+        Yield the completion text as the model produces it. Retries only happen
+        while opening the stream; once text has been sent a failure is final.
+        The timeout applies to opening the stream and to each gap between chunks.
+        """
+        if not self.breaker.allow():
+            raise LLMUnavailableError("Report generation is temporarily unavailable, please try again shortly")
+
+        started = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            await self._semaphore.acquire()
+            try:
+                chunks = await asyncio.wait_for(
+                    self._client.chat.completions.create(messages=messages, model=model, stream=True),
+                    timeout=self.timeout,
+                )
+                break
+            except RETRYABLE_ERRORS:
+                self._semaphore.release()
+                if attempt == self.max_retries:
+                    self.breaker.record_failure()
+                    raise
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            except BaseException:
+                self._semaphore.release()
+                raise
+
+        # The concurrency slot is held until the stream is drained or abandoned
+        self.in_flight += 1
+        outcome = "error"
+        try:
+            iterator = chunks.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), timeout=self.timeout)
+                except StopAsyncIteration:
+                    break
+                # Groq reports usage on the last chunk, under x_groq
+                usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None)
+                if usage is not None:
+                    record_llm_usage(model, usage)
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    yield text
+        except RETRYABLE_ERRORS:
+            self.breaker.record_failure()
+            raise
+        else:
+            self.breaker.record_success()
+            outcome = "ok"
+        finally:
+            llm_request_duration.labels(model, "stream", outcome).observe(time.perf_counter() - started)
+            self.in_flight -= 1
+            self._semaphore.release()
+            await chunks.close()
+
+    async def aclose(self):
+        await self._client.close()
+
+_llm_client = None
+# Close tasks of replaced clients, kept so they are not garbage collected mid-close
+_retiring = set()
+RETIRE_POLL_SECONDS = 0.1
+
+async def _close_when_idle(client: LLMClient):
+    """Close a replaced client once the calls it is still serving have finished"""
+    while client.in_flight or client._inflight:
+        await asyncio.sleep(RETIRE_POLL_SECONDS)
+    await client.aclose()
+
+def _retire(client: LLMClient):
+    try:
+        task = asyncio.get_running_loop().create_task(_close_when_idle(client))
+    except RuntimeError:
+        # No loop to close it on (a sync caller); its pool goes with the object
+        return
+    _retiring.add(task)
+    task.add_done_callback(_retiring.discard)
+
+def get_llm_client(api_key: str):
+    """The process-wide LLM client, created on first use and replaced when the API key changes"""
+    global _llm_client
+    if _llm_client is None or _llm_client.api_key != api_key:
+        if _llm_client is not None:
+            _retire(_llm_client)
+        _llm_client = LLMClient(
+            api_key,
+            timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", 60)),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", 2)),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 8)),
+            breaker_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", 5)),
+            breaker_reset_after=float(os.getenv("LLM_BREAKER_RESET_SECONDS", 30)),
+        )
+    return _llm_client
+
+def reset_llm_client():
+    """Forget the shared client so the next call builds a fresh one"""
+    global _llm_client
+    _llm_client = None
+
+async def close_llm_client():
+    """Close the shared client's connection pool (app shutdown)"""
+    if _llm_client is not None:
+        await _llm_client.aclose()
+    reset_llm_client()
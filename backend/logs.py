@@ -0,0 +1,62 @@
+"""
+Structured, sampled application logging.
+
+Events are logged as one JSON object per line on stderr through the
+"medbud" logger hierarchy: the event name, level, logger and any fields
+passed to log_event. Hot-path events (one per request) are logged with
+sampled=True and kept at a rate of LOG_SAMPLE_RATE; warnings and errors are
+never dropped.
+"""
+import logging
+import os
+import random
+import sys
+
+import orjson
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.1))
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+class SamplingFilter(logging.Filter):
+    """Keep a LOG_SAMPLE_RATE share of records marked sampled, below warning level"""
+
+    def __init__(self, rate: float = LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not getattr(record, "sampled", False):
+            return True
+        return random.random() < self.rate
+
+def get_logger(name: str):
+    return logging.getLogger(f"medbud.{name}")
+
+def log_event(logger, event: str, level: int = logging.INFO, sampled: bool = False, exc_info=None, **fields):
+    """Log `event` with `fields` as structured data"""
+    logger.log(level, event, exc_info=exc_info, extra={"fields": fields, "sampled": sampled})
+
+def configure_logging():
+    """Send "medbud" logs to stderr as JSON lines (once; leaves other loggers alone)"""
+    root = logging.getLogger("medbud")
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter())
+    handler.addFilter(SamplingFilter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
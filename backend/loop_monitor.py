@@ -0,0 +1,143 @@
+"""
+Opt-in event loop lag detector.
+
+With LOOP_MONITOR=1 a heartbeat task measures how late the event loop wakes
+it up, and a watchdog thread notices when the loop has been stuck for longer
+than LOOP_MONITOR_THRESHOLD_MS. While the loop is still stuck, the watchdog
+captures what the loop thread is executing and the route of the request
+whose task is running. Each stall is logged as a warning on the
+"medbud.loop_monitor" logger, and the most recent ones are served at
+/health/event-loop.
+
+Anything that blocks an async handler shows up here: a blocking driver
+call, CPU-bound work, or time.sleep. Work moved to thread or process pools
+does not.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from logs import get_logger, log_event
+from metrics import route_template
+
+LOOP_MONITOR = os.getenv("LOOP_MONITOR", "").strip().lower() in ("1", "true", "yes")
+LOOP_MONITOR_THRESHOLD_MS = float(os.getenv("LOOP_MONITOR_THRESHOLD_MS", 100))
+STALL_HISTORY = 20
+STACK_DEPTH = 15
+
+logger = get_logger("loop_monitor")
+
+# The running monitor, if any; LoopMonitorMiddleware only records requests for it
+active_monitor = None
+
+class LoopMonitor:
+    def __init__(self, threshold: float = LOOP_MONITOR_THRESHOLD_MS / 1000, interval: float = None):
+        self.threshold = threshold
+        self.interval = interval if interval is not None else min(threshold / 4, 0.05)
+        self.stalls = deque(maxlen=STALL_HISTORY)
+        self.stall_count = 0
+        self.max_lag = 0.0
+        self.requests = {}
+        self._beat = time.monotonic()
+        self._captured = None
+        self._stopping = threading.Event()
+        self._previous = None
+
+    async def start(self):
+        """Start monitoring the running loop"""
+        global active_monitor
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._heartbeat = asyncio.ensure_future(self._heartbeat_loop())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._watchdog.start()
+        self._previous, active_monitor = active_monitor, self
+        return self
+
+    async def stop(self):
+        global active_monitor
+        if active_monitor is self:
+            active_monitor = self._previous
+        self._stopping.set()
+        self._heartbeat.cancel()
+        # A stall that just ended may not have woken the heartbeat yet
+        lag = time.monotonic() - self._beat - self.interval
+        if lag >= self.threshold:
+            self._record(lag)
+        await asyncio.gather(self._heartbeat, return_exceptions=True)
+        self._watchdog.join()
+
+    async def _heartbeat_loop(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - self._beat - self.interval
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self._record(lag)
+
+    def _watch(self):
+        # Runs in its own thread: it can still look at the loop thread while that is stuck
+        while not self._stopping.wait(self.interval):
+            beat = self._beat
+            if time.monotonic() - beat - self.interval >= self.threshold and (
+                self._captured is None or self._captured[0] != beat
+            ):
+                self._captured = (beat, self._current_route(), self._loop_stack())
+
+    def _current_route(self):
+        task = asyncio.current_task(self.loop)
+        scope = self.requests.get(task)
+        if scope is None:
+            return None
+        return f'{scope["method"]} {route_template(scope) or scope["path"]}'
+
+    def _loop_stack(self):
+        frame = sys._current_frames().get(self.loop_thread)
+        return "".join(traceback.format_stack(frame, limit=STACK_DEPTH)) if frame else None
+
+    def _record(self, lag: float):
+        beat, route, stack = self._captured or (None, None, None)
+        if beat != self._beat:
+            # The stall ended before the watchdog looked
+            route, stack = None, None
+        stall = {"lag_ms": round(lag * 1000, 1), "route": route, "stack": stack, "at": time.time()}
+        self.stalls.append(stall)
+        self.stall_count += 1
+        log_event(logger, "event_loop_blocked", logging.WARNING, lag_ms=stall["lag_ms"], route=route, stack=stack)
+
+    def stats(self):
+        return {
+            "enabled": True,
+            "threshold_ms": self.threshold * 1000,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalls": self.stall_count,
+            "recent_stalls": list(self.stalls),
+        }
+
+async def start_loop_monitor(threshold: float = LOOP_MONITOR_THRESHOLD_MS / 1000):
+    return await LoopMonitor(threshold).start()
+
+class LoopMonitorMiddleware:
+    """Remembers which request each task is serving, for stall reports"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        monitor = active_monitor
+        if monitor is None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        task = asyncio.current_task()
+        monitor.requests[task] = scope
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            monitor.requests.pop(task, None)
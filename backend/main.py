@@ -1,20 +1,69 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from pymongo import MongoClient
 import os
 
-from routes import symptoms, medications, reports, users, auth
+from database import PoolStats, create_client, get_client_options, DATABASE_NAME
+from indexes import ensure_indexes
+from repositories import create_repositories
+from memory_repositories import create_memory_repositories
+from report_cache import report_cache
+import auth_cache
+from llm import close_llm_client
+from report_jobs import create_report_job_queue
+from compression import add_compression
+from pdf_renderer import create_pdf_renderer
+from passwords import password_hasher
+from metrics import MetricsMiddleware, metrics_response
+from logs import configure_logging
+from loop_monitor import LOOP_MONITOR, LoopMonitorMiddleware, start_loop_monitor
+from routes import symptoms, medications, reports, report_jobs, users, auth, sync
 
 
 # Load environment variables
 load_dotenv()
+configure_logging()
+
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "mongo")
+
+# Storage lifecycle: one shared MongoDB client for every router, or the
+# in-process backend when DATABASE_BACKEND=memory (tests, benchmarks)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Off unless LOOP_MONITOR is set
+    app.loop_monitor = await start_loop_monitor() if LOOP_MONITOR else None
+    app.mongodb_pool_stats = PoolStats()
+    if DATABASE_BACKEND == "memory":
+        app.mongodb_client = None
+        app.database = None
+        app.repositories = create_memory_repositories()
+        print("Using the in-memory database backend")
+    else:
+        app.mongodb_client = create_client(app.mongodb_pool_stats)
+        app.database = app.mongodb_client[DATABASE_NAME]
+        await ensure_indexes(app.database)
+        app.repositories = create_repositories(app.database)
+        print("Connected to the MongoDB database!")
+    app.report_jobs = create_report_job_queue(app.repositories, reports.build_report)
+    app.report_jobs.start()
+    app.pdf_renderer = create_pdf_renderer()
+    yield
+    await app.report_jobs.stop()
+    app.pdf_renderer.close()
+    password_hasher.close()
+    if app.mongodb_client is not None:
+        await app.mongodb_client.close()
+    await close_llm_client()
+    if app.loop_monitor is not None:
+        await app.loop_monitor.stop()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Symptom Tracker API",
     description="API for tracking symptoms, medications, and generating reports",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -32,31 +81,59 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Link", "X-Next-Cursor", "ETag"],
 )
-
-# MongoDB connection events
-@app.on_event("startup")
-def startup_db_client():
-    app.mongodb_client = MongoClient(os.getenv("MONGODB_URI"))
-    app.database = app.mongodb_client[os.getenv("DATABASE_NAME")]
-    print("Connected to the MongoDB database!")
-
-@app.on_event("shutdown")
-def shutdown_db_client():
-    app.mongodb_client.close()
+# Off unless RESPONSE_COMPRESSION is gzip or br
+add_compression(app)
+# Attributes event loop stalls to routes while a loop monitor runs
+app.add_middleware(LoopMonitorMiddleware)
+# Outermost, so request latency includes every other middleware
+app.add_middleware(MetricsMiddleware)
 
 # Include routers
 app.include_router(symptoms.router, tags=["symptoms"], prefix="/api/symptoms")
 app.include_router(medications.router, tags=["medications"], prefix="/api/medications")
+# Before the reports router, whose /{user_id} routes would otherwise match /jobs
+app.include_router(report_jobs.router, tags=["reports"], prefix="/api/reports/jobs")
 app.include_router(reports.router, tags=["reports"], prefix="/api/reports")
 app.include_router(users.router, tags=["users"], prefix="/api/users")
 app.include_router(auth.router, tags=["auth"], prefix="/api/auth")
+app.include_router(sync.router, tags=["sync"], prefix="/api/sync")
 
 # Root endpoint
 @app.get("/", tags=["root"])
 async def read_root():
     return {"message": "Welcome to the Symptom Tracker API"}
 
+# Prometheus metrics: route, MongoDB command, LLM and PDF render latencies
+@app.get("/metrics", tags=["root"], include_in_schema=False)
+async def metrics():
+    return metrics_response()
+
+# MongoDB connection pool statistics, for sizing workers against the database
+@app.get("/health/db-pool", tags=["root"])
+async def db_pool_stats():
+    return app.mongodb_pool_stats.snapshot(get_client_options())
+
+# Generated report cache hit/miss counters
+@app.get("/health/report-cache", tags=["root"])
+async def report_cache_stats():
+    return report_cache.stats()
+
+# Token claim and user cache hit/miss counters for get_current_user
+@app.get("/health/auth-cache", tags=["root"])
+async def auth_cache_stats():
+    return auth_cache.stats()
+
+# Event loop lag and recent stalls (LOOP_MONITOR=1)
+@app.get("/health/event-loop", tags=["root"])
+async def event_loop_stats():
+    return app.loop_monitor.stats() if app.loop_monitor is not None else {"enabled": False}
+
+@app.get("/health/pdf-renderer", tags=["root"])
+async def pdf_renderer_stats():
+    return app.pdf_renderer.stats()
+
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,376 @@
+"""
+In-process repositories with the same semantics as the MongoDB ones.
+
+Documents go through a BSON round trip on the way in and out, so callers get
+what Mongo would hand back: ObjectIds, naive UTC datetimes truncated to the
+millisecond, copies rather than shared references. Sort orders, keyset
+cursors and unique-key errors (pymongo's DuplicateKeyError, with keyPattern)
+match the MongoDB implementations. Nothing is persisted.
+
+Used when DATABASE_BACKEND=memory: for tests and benchmarks that should not
+depend on (or measure) a database server.
+"""
+import re
+from datetime import datetime
+
+import bson
+from bson import ObjectId
+from pymongo import DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from pagination import encode_cursor, decode_cursor
+from repositories import Repositories, SYMPTOM_SORT, MEDICATION_SORT, USER_SORT, SYNC_SORT, SEARCH_SORT, modified_now
+from rollups import symptom_day
+
+def _copy(document: dict):
+    """What Mongo would store (or return) for `document`"""
+    return bson.decode(bson.encode(document))
+
+def _project(document: dict, fields=None, exclude=()):
+    if fields:
+        return {key: value for key, value in document.items() if key == "_id" or key in fields}
+    return {key: value for key, value in document.items() if key not in exclude}
+
+def _after(values, sort):
+    """Predicate: document sorts strictly after `values` in `sort` order"""
+    def predicate(document):
+        for (field, direction), value in zip(sort, values):
+            if document[field] == value:
+                continue
+            return document[field] < value if direction == DESCENDING else document[field] > value
+        return False
+    return predicate
+
+def _page(documents, sort, limit: int, skip: int = 0, cursor: str = None):
+    """Same contract as pagination.paginate, over a list of documents"""
+    for field, direction in reversed(sort):
+        documents = sorted(documents, key=lambda document: document[field], reverse=direction == DESCENDING)
+    if cursor:
+        # Normalise decoded values (e.g. aware datetimes) the way the stored ones are
+        values = _copy({"values": decode_cursor(cursor, sort)})["values"]
+        documents = [document for document in documents if _after(values, sort)(document)]
+    else:
+        documents = documents[skip:]
+    if limit:
+        documents = documents[:limit]
+
+    next_cursor = None
+    if limit and len(documents) == limit:
+        next_cursor = encode_cursor(documents[-1], sort)
+    return [_copy(document) for document in documents], next_cursor
+
+def _insert(store: dict, document: dict):
+    """Set the caller's _id like insert_one does and store a copy"""
+    document.setdefault("_id", ObjectId())
+    if document["_id"] in store:
+        raise DuplicateKeyError("E11000 duplicate key error", 11000, {"keyPattern": {"_id": 1}, "keyValue": {"_id": document["_id"]}})
+    store[document["_id"]] = _copy(document)
+    return document["_id"]
+
+def _changed(documents, user_id, upper):
+    upper = _normalise(upper)
+    return [
+        document for document in documents
+        if document["user_id"] == user_id and "modified_at" in document and document["modified_at"] <= upper
+    ]
+
+# Field weights of the symptoms text index
+TEXT_WEIGHTS = {"name": 3, "details": 1}
+
+def _terms(text: str):
+    """Lower-cased words with a trailing plural "s" dropped (a stand-in for Mongo's stemmer)"""
+    return [word[:-1] if len(word) > 3 and word.endswith("s") else word for word in re.findall(r"\w+", text.lower())]
+
+def _text_score(document, terms):
+    """
+    Stand-in for Mongo's textScore: per field, weight × occurrences of each
+    query term, damped by field length. Orders results the same way for
+    typical entries; the exact values differ from MongoDB's.
+    """
+    score = 0.0
+    for field, weight in TEXT_WEIGHTS.items():
+        tokens = _terms(document.get(field) or "")
+        for term in terms:
+            count = tokens.count(term)
+            if count:
+                score += weight * count * (0.5 + 0.5 * count / len(tokens))
+    return score
+
+class MemoryDataVersionRepository:
+    def __init__(self):
+        self.documents = {}
+
+    async def get(self, user_id: str) -> int:
+        return self.documents.get(user_id, 0)
+
+    async def bump(self, user_id: str):
+        self.documents[user_id] = self.documents.get(user_id, 0) + 1
+
+class MemorySymptomRepository:
+    def __init__(self, versions: MemoryDataVersionRepository):
+        self.documents = {}
+        self.versions = versions
+
+    def _in_range(self, user_id, start=None, end=None):
+        return [
+            document for document in self.documents.values()
+            if document["user_id"] == user_id
+            and (start is None or document["timestamp"] >= start)
+            and (end is None or document["timestamp"] <= end)
+        ]
+
+    async def create(self, symptom: dict):
+        symptom["modified_at"] = modified_now()
+        # Same unique key as the symptoms index: (user_id, client_id) when client_id is a string
+        client_id = symptom.get("client_id")
+        if isinstance(client_id, str) and any(
+            document["user_id"] == symptom["user_id"] and document.get("client_id") == client_id
+            for document in self.documents.values()
+        ):
+            raise DuplicateKeyError(
+                "E11000 duplicate key error", 11000,
+                {"keyPattern": {"user_id": 1, "client_id": 1}, "keyValue": {"user_id": symptom["user_id"], "client_id": client_id}},
+            )
+        symptom_id = _insert(self.documents, symptom)
+        await self.versions.bump(symptom["user_id"])
+        return symptom_id
+
+    async def create_many(self, symptoms: list):
+        errors = {}
+        for i, symptom in enumerate(symptoms):
+            try:
+                await self.create(symptom)
+            except DuplicateKeyError as e:
+                # insert_many assigns every _id up front, stored or not
+                symptom.setdefault("_id", ObjectId())
+                errors[i] = {"code": e.code, "message": str(e)}
+        return errors
+
+    async def list(self, user_id: str, start=None, end=None, limit: int = 100, skip: int = 0, cursor: str = None):
+        return _page(self._in_range(user_id, _normalise(start), _normalise(end)), SYMPTOM_SORT, limit, skip, cursor)
+
+    async def search(self, user_id: str, text: str, start=None, end=None, limit: int = 20, cursor: str = None):
+        terms = set(_terms(text))
+        matches = []
+        for document in self._in_range(user_id, _normalise(start), _normalise(end)):
+            score = _text_score(document, terms)
+            if score:
+                matches.append({**document, "score": score})
+        return _page(matches, SEARCH_SORT, limit, 0, cursor)
+
+    async def changes(self, user_id: str, upper: datetime, limit: int, cursor: str = None):
+        return _page(_changed(self.documents.values(), user_id, upper), SYNC_SORT, limit, 0, cursor)
+
+    async def range_stats(self, user_id: str, start: datetime, end: datetime):
+        documents = self._in_range(user_id, _normalise(start), _normalise(end))
+        return len(documents), max((document["_id"] for document in documents), default=None)
+
+    async def daily_cells(self, user_id: str, start: datetime, end: datetime, use_rollups: bool = True):
+        # No separate rollup store: cells are always computed from the symptoms
+        cells = {}
+        for document in self._in_range(user_id, _normalise(start), _normalise(end)):
+            key = (symptom_day(document["timestamp"]), document["name"])
+            cell = cells.setdefault(key, {"count": 0, "sum": 0, "max": document["severity"]})
+            cell["count"] += 1
+            cell["sum"] += document["severity"]
+            cell["max"] = max(cell["max"], document["severity"])
+        return cells
+
+class MemoryMedicationRepository:
+    def __init__(self, versions: MemoryDataVersionRepository):
+        self.documents = {}
+        self.deletions = {}
+        self.versions = versions
+
+    def _owned(self, medication_id, user_id):
+        document = self.documents.get(medication_id)
+        return document if document is not None and document["user_id"] == user_id else None
+
+    async def create(self, medication: dict):
+        medication["modified_at"] = modified_now()
+        medication_id = _insert(self.documents, medication)
+        await self.versions.bump(medication["user_id"])
+        return medication_id
+
+    async def list(self, user_id: str, limit: int = 100, skip: int = 0, cursor: str = None):
+        documents = [document for document in self.documents.values() if document["user_id"] == user_id]
+        return _page(documents, MEDICATION_SORT, limit, skip, cursor)
+
+    async def changes(self, user_id: str, upper: datetime, limit: int, cursor: str = None):
+        return _page(_changed(self.documents.values(), user_id, upper), SYNC_SORT, limit, 0, cursor)
+
+    async def deleted(self, user_id: str, upper: datetime, limit: int, cursor: str = None):
+        return _page(_changed(self.deletions.values(), user_id, upper), SYNC_SORT, limit, 0, cursor)
+
+    async def find_by_user(self, user_id: str, fields=None):
+        documents, _ = _page(
+            [document for document in self.documents.values() if document["user_id"] == user_id], MEDICATION_SORT, 0
+        )
+        return [_project(document, fields) for document in documents]
+
+    async def update(self, medication_id, user_id: str, fields: dict):
+        document = self._owned(medication_id, user_id)
+        if document is None:
+            return None
+        document.update(_copy({**fields, "modified_at": modified_now()}))
+        await self.versions.bump(user_id)
+        return _copy(document)
+
+    async def increment_adherence(self, medication_id, user_id: str):
+        document = self._owned(medication_id, user_id)
+        if document is None:
+            return None
+        document["adherence"] = document.get("adherence", 0) + 1
+        document["modified_at"] = modified_now()
+        await self.versions.bump(user_id)
+        return _copy(document)
+
+    async def delete(self, medication_id, user_id: str):
+        if self._owned(medication_id, user_id) is None:
+            return False
+        del self.documents[medication_id]
+        _insert(self.deletions, {
+            "user_id": user_id, "collection": "medications", "document_id": medication_id, "modified_at": modified_now(),
+        })
+        await self.versions.bump(user_id)
+        return True
+
+class MemoryUserRepository:
+    def __init__(self, versions):
+        self.documents = {}
+        self.versions = versions
+
+    async def create(self, user: dict):
+        # Same unique keys as the users indexes: username, and email when it is a string
+        for field in ("username", "email"):
+            value = user.get(field)
+            if field == "email" and not isinstance(value, str):
+                continue
+            if any(document.get(field) == value for document in self.documents.values()):
+                raise DuplicateKeyError(
+                    "E11000 duplicate key error", 11000, {"keyPattern": {field: 1}, "keyValue": {field: value}}
+                )
+        return _insert(self.documents, user)
+
+    async def get(self, user_id):
+        document = self.documents.get(user_id)
+        return None if document is None else _copy(document)
+
+    async def get_by_username(self, username: str):
+        for document in self.documents.values():
+            if document.get("username") == username:
+                return _copy(document)
+        return None
+
+    async def get_by_email(self, email: str):
+        for document in self.documents.values():
+            if document.get("email") == email:
+                return _copy(document)
+        return None
+
+    async def set_password_hash(self, user_id, hashed_password: str):
+        if user_id in self.documents:
+            self.documents[user_id]["hashed_password"] = hashed_password
+
+    async def update(self, user_id, fields: dict):
+        document = self.documents.get(user_id)
+        if document is None:
+            return None
+        if isinstance(fields.get("email"), str) and any(
+            other.get("email") == fields["email"] for key, other in self.documents.items() if key != user_id
+        ):
+            raise DuplicateKeyError(
+                "E11000 duplicate key error", 11000, {"keyPattern": {"email": 1}, "keyValue": {"email": fields["email"]}}
+            )
+        document.update(_copy(fields))
+        await self.versions.bump(str(user_id))
+        return _copy(document)
+
+    async def list(self, limit: int = 100, skip: int = 0, cursor: str = None):
+        return _page(list(self.documents.values()), USER_SORT, limit, skip, cursor)
+
+class MemoryReportJobRepository:
+    def __init__(self):
+        self.documents = {}
+
+    async def find_pending(self, dedupe_key: str):
+        for document in self.documents.values():
+            if document.get("dedupe_key") == dedupe_key and document.get("pending") is True:
+                return _copy(_project(document, exclude=("result",)))
+        return None
+
+    async def insert(self, job: dict):
+        if job.get("pending") is True and await self.find_pending(job["dedupe_key"]) is not None:
+            raise DuplicateKeyError(
+                "E11000 duplicate key error", 11000,
+                {"keyPattern": {"dedupe_key": 1}, "keyValue": {"dedupe_key": job["dedupe_key"]}},
+            )
+        return _insert(self.documents, job)
+
+    async def get(self, job_id, include_result: bool = False):
+        document = self.documents.get(job_id)
+        if document is None:
+            return None
+        return _copy(document if include_result else _project(document, exclude=("result",)))
+
+    async def claim(self, job_id, now: datetime):
+        document = self.documents.get(job_id)
+        if document is None or document["status"] != "queued":
+            return None
+        document.update(_copy({"status": "running", "started_at": now, "updated_at": now}))
+        return _copy(document)
+
+    def _leased(self, job_id, started_at: datetime):
+        document = self.documents.get(job_id)
+        if document is None or document["status"] != "running" or document.get("started_at") != _normalise(started_at):
+            return None
+        return document
+
+    async def renew(self, job_id, started_at: datetime, now: datetime):
+        document = self._leased(job_id, started_at)
+        if document is None:
+            return False
+        document.update(_copy({"started_at": now, "updated_at": now}))
+        return True
+
+    async def finish(self, job_id, started_at: datetime, fields: dict):
+        document = self._leased(job_id, started_at)
+        if document is None:
+            return False
+        document.update(_copy(fields))
+        document.pop("pending", None)
+        return True
+
+    async def requeue_expired(self, started_before: datetime, now: datetime):
+        started_before = _normalise(started_before)
+        for document in self.documents.values():
+            if document["status"] == "running" and document.get("started_at") and document["started_at"] < started_before:
+                document.update(_copy({"status": "queued", "updated_at": now}))
+
+    async def queued_ids(self):
+        queued = [document for document in self.documents.values() if document["status"] == "queued"]
+        return [document["_id"] for document in sorted(queued, key=lambda document: document["created_at"])]
+
+def _normalise(value):
+    """Query bound as Mongo compares it (naive UTC, millisecond precision)"""
+    return None if value is None else _copy({"value": value})["value"]
+
+class MemoryRepositories(Repositories):
+    def __init__(self):
+        versions = MemoryDataVersionRepository()
+        super().__init__(
+            MemorySymptomRepository(versions),
+            MemoryMedicationRepository(versions),
+            MemoryUserRepository(versions),
+            MemoryReportJobRepository(),
+            versions,
+        )
+
+    def clear(self):
+        """Forget every document (tests reuse one app between cases)"""
+        for repository in (self.symptoms, self.medications, self.users, self.report_jobs, self.versions):
+            repository.documents.clear()
+        self.medications.deletions.clear()
+
+def create_memory_repositories():
+    return MemoryRepositories()
@@ -0,0 +1,104 @@
+"""
+Prometheus metrics, served at /metrics.
+
+- http_request_duration_seconds: per route template, method and status
+  (MetricsMiddleware; unmatched paths share one label so scanners cannot
+  blow up the series count)
+- mongodb_command_duration_seconds: per collection and command
+  (CommandMetrics, a pymongo CommandListener)
+- llm_request_duration_seconds / llm_tokens_total: per model and call type
+- pdf_render_duration_seconds: actual renders, not cache hits
+
+Metrics live in this process; with several workers, scrape each one (or run
+prometheus_client's multiprocess mode).
+"""
+import time
+
+from pymongo import monitoring
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from starlette.responses import Response
+
+# Request and command latencies are mostly milliseconds; LLM calls take seconds
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time to serve a request, including the body",
+    ["method", "route", "status"], buckets=FAST_BUCKETS,
+)
+mongodb_command_duration = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round trip time",
+    ["collection", "command", "outcome"], buckets=FAST_BUCKETS,
+)
+llm_request_duration = Histogram(
+    "llm_request_duration_seconds", "LLM call time (a stream until its last chunk)",
+    ["model", "call", "outcome"], buckets=SLOW_BUCKETS,
+)
+llm_tokens = Counter("llm_tokens_total", "Tokens used by LLM calls", ["model", "kind"])
+pdf_render_duration = Histogram(
+    "pdf_render_duration_seconds", "Report PDF render time", ["executor"], buckets=FAST_BUCKETS,
+)
+
+def record_llm_usage(model: str, usage):
+    """Count the prompt/completion tokens of an LLM response's `usage`, when it reports them"""
+    for kind in ("prompt", "completion"):
+        tokens = getattr(usage, f"{kind}_tokens", None)
+        if isinstance(tokens, int):
+            llm_tokens.labels(model, kind).inc(tokens)
+
+def route_template(scope):
+    """Path template of the route that served `scope` (e.g. /api/symptoms/{user_id}), or None"""
+    # FastAPI keeps routes of included routers relative to their prefix and
+    # records the full template in its per-request context
+    context = scope.get("fastapi", {}).get("effective_route_context")
+    return getattr(context, "path", None) or getattr(scope.get("route"), "path", None)
+
+def metrics_response():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+class MetricsMiddleware:
+    """Times each HTTP request until its response is fully sent"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router has stored the matched route in the scope by now
+            route = route_template(scope) or "unmatched"
+            http_request_duration.labels(scope["method"], route, str(status)).observe(time.perf_counter() - started)
+
+class CommandMetrics(monitoring.CommandListener):
+    """Feeds mongodb_command_duration_seconds from pymongo's command events"""
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        # Collection commands name their collection as the command's value
+        collection = event.command.get(event.command_name)
+        self._collections[(event.request_id, event.connection_id)] = collection if isinstance(collection, str) else ""
+
+    def _observe(self, event, outcome: str):
+        collection = self._collections.pop((event.request_id, event.connection_id), "")
+        mongodb_command_duration.labels(collection, event.command_name, outcome).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._observe(event, "succeeded")
+
+    def failed(self, event):
+        self._observe(event, "failed")
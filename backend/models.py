@@ -52,6 +52,12 @@ class SymptomCreate(BaseModel):
     details: str
     severity: int = Field(ge=1, le=10)
 
+class SymptomBulkItem(SymptomCreate):
+    # When the entry was recorded on the device (server time if omitted)
+    timestamp: Optional[datetime] = None
+    # Client-generated id; re-sending an entry with the same id is a no-op
+    client_id: Optional[str] = None
+
 # Medication Model
 class MedicationModel(BaseModel):
     id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
@@ -83,11 +89,18 @@ class ReportQuery(BaseModel):
     start_date: Optional[datetime] = None
     end_date: Optional[datetime] = None
 
+class ReportJobCreate(ReportQuery):
+    report_format: str = "summary"
+
 
 class UserCreate(BaseModel):
     username: str
     email: EmailStr
     unique_id_from_auth: str
+
+class UserUpdate(BaseModel):
+    email: Optional[EmailStr] = None
+    disabled: Optional[bool] = None
     
 class UserResponse(BaseModel):
     id: str
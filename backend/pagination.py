@@ -0,0 +1,68 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+A page is fetched with a fixed sort and, when a continuation token is given,
+a range condition on the sort keys of the last document already returned.
+That is a single index seek however deep the page is, unlike skip/limit.
+The token itself is the opaque, URL-safe encoding of those sort key values.
+"""
+import base64
+import binascii
+
+from bson import json_util
+from bson.errors import BSONError
+from fastapi import HTTPException, Request, Response
+from pymongo import DESCENDING
+
+def encode_cursor(document, sort):
+    """Continuation token pointing just past `document` for the given sort"""
+    values = [document[field] for field, _ in sort]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode().rstrip("=")
+
+def decode_cursor(token: str, sort):
+    """Sort key values stored in a continuation token"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, ValueError, TypeError, BSONError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def keyset_filter(sort, values):
+    """Query matching documents strictly after `values` in `sort` order"""
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {name: value for (name, _), value in zip(sort[:i], values[:i])}
+        clause[field] = {"$lt" if direction == DESCENDING else "$gt": values[i]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+async def paginate(collection, query, sort, limit: int, skip: int = 0, cursor: str = None):
+    """
+    Fetch one page of `query` in `sort` order.
+    With a cursor the page starts right after it and `skip` is ignored; without
+    one the legacy skip/limit behaviour applies. Returns the documents and the
+    token for the next page (None once a page comes back short).
+    """
+    if cursor:
+        query = {"$and": [query, keyset_filter(sort, decode_cursor(cursor, sort))]}
+        find = collection.find(query).sort(sort)
+    else:
+        find = collection.find(query).sort(sort).skip(skip)
+
+    documents = await find.limit(limit).to_list(length=None)
+
+    next_cursor = None
+    if limit and len(documents) == limit:
+        next_cursor = encode_cursor(documents[-1], sort)
+    return documents, next_cursor
+
+def set_next_page(request: Request, response: Response, next_cursor: str):
+    """Advertise the next page through the Link and X-Next-Cursor headers"""
+    if not next_cursor:
+        return
+    next_url = request.url.remove_query_params("skip").include_query_params(cursor=next_cursor)
+    response.headers["Link"] = f'<{next_url}>; rel="next"'
+    response.headers["X-Next-Cursor"] = next_cursor
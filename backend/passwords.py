@@ -0,0 +1,62 @@
+"""
+Password hashing off the event loop.
+
+bcrypt is deliberately slow (~0.1-0.3 s per hash at the default cost), so
+hashing or verifying on the event loop stalls every other request for that
+long. Both run on a dedicated thread pool instead (bcrypt releases the GIL
+while it works), sized by PASSWORD_HASH_WORKERS; past PASSWORD_HASH_MAX_PENDING
+queued operations callers get PasswordHasherBusyError rather than an
+ever-growing queue.
+
+The cost is PASSWORD_BCRYPT_ROUNDS. Hashes made with other parameters still
+verify, and verify() returns a replacement hash so login can upgrade them.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 64))
+
+class PasswordHasherBusyError(Exception):
+    """Too many password operations are queued; try again shortly"""
+
+class PasswordHasher:
+    def __init__(self, rounds: int = BCRYPT_ROUNDS, workers: int = PASSWORD_HASH_WORKERS,
+                 max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def _run(self, function, *args):
+        if self.pending >= self.max_pending:
+            raise PasswordHasherBusyError("Too many sign-ins in progress, try again shortly")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), function, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str):
+        """(matches, new hash or None); a new hash means the stored one uses outdated parameters"""
+        return await self._run(self.context.verify_and_update, password, hashed_password)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,153 @@
+"""
+Report PDF rendering off the event loop and off the GIL.
+
+FPDF is pure Python and CPU bound, so rendering in a worker thread still
+competes with request handling for the GIL. PDFs are rendered in a small,
+lazily started process pool instead (PDF_RENDER_PROCESSES; 0 renders in a
+thread), with at most PDF_RENDER_MAX_PENDING distinct renders in flight.
+
+Output is cached by a hash of exactly what is rendered (the period and the
+report text), so the same report downloaded again, from either the reports
+or the report jobs endpoints, is served without rendering; concurrent
+requests for the same PDF share one render.
+"""
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
+
+from cache import TTLCache
+from metrics import pdf_render_duration
+
+PDF_RENDER_PROCESSES = int(os.getenv("PDF_RENDER_PROCESSES", min(2, os.cpu_count() or 1)))
+PDF_RENDER_MAX_PENDING = int(os.getenv("PDF_RENDER_MAX_PENDING", 16))
+
+class PDFRendererBusyError(Exception):
+    """Too many PDFs are being rendered; try again shortly"""
+
+def render_report_pdf(report_data: dict) -> bytes:
+    """Render the report text to PDF bytes (CPU bound; runs in a worker process)"""
+    from fpdf import FPDF
+
+    # Create PDF
+    pdf = FPDF()
+    pdf.add_page()
+
+    # Set up the PDF
+    pdf.set_font("Arial", "B", 16)
+    pdf.cell(190, 10, "Health Report", ln=True, align="C")
+
+    # Add period
+    pdf.set_font("Arial", "I", 12)
+    pdf.cell(190, 10, f"Period: {report_data['report_period']['start_date']} to {report_data['report_period']['end_date']}", ln=True)
+
+    # Add report content
+    pdf.set_font("Arial", "", 12)
+
+    # Split the report into lines to properly format in PDF
+    report_text = report_data["generated_report"]
+    pdf.multi_cell(190, 10, report_text)
+
+    # Generate the PDF in memory
+    return pdf.output(dest="S").encode("latin1")
+
+def pdf_cache_key(report_data: dict) -> str:
+    """Content hash of everything render_report_pdf puts on the page"""
+    period = report_data["report_period"]
+    content = json.dumps([period["start_date"], period["end_date"], report_data["generated_report"]])
+    return hashlib.sha256(content.encode()).hexdigest()
+
+class PDFRenderer:
+    def __init__(self, processes: int = PDF_RENDER_PROCESSES, max_pending: int = PDF_RENDER_MAX_PENDING, cache: TTLCache = None):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.cache = cache if cache is not None else TTLCache(
+            maxsize=int(os.getenv("PDF_CACHE_SIZE", 64)),
+            ttl=float(os.getenv("PDF_CACHE_TTL_SECONDS", 3600)),
+        )
+        self.pool = None
+        self._inflight = {}
+        self.renders = 0
+
+    def _get_pool(self):
+        if self.pool is None:
+            # spawn: forking a process that runs an event loop and driver threads is unsafe
+            self.pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"))
+        return self.pool
+
+    async def render(self, report_data: dict) -> bytes:
+        """PDF bytes for a report; raises PDFRendererBusyError when the pool is saturated"""
+        key = pdf_cache_key(report_data)
+        pdf = self.cache.get(key)
+        if pdf is not None:
+            return pdf
+
+        task = self._inflight.get(key)
+        if task is None:
+            if len(self._inflight) >= self.max_pending:
+                raise PDFRendererBusyError("Too many PDF reports are being generated, try again shortly")
+            # Only what is rendered crosses the process boundary
+            content = {"report_period": report_data["report_period"], "generated_report": report_data["generated_report"]}
+            task = asyncio.ensure_future(self._render(key, content))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # One waiter disconnecting must not cancel the render for the others
+        return await asyncio.shield(task)
+
+    async def _render(self, key: str, content: dict) -> bytes:
+        started = time.perf_counter()
+        if self.processes > 0:
+            pool = self._get_pool()
+            try:
+                pdf = await asyncio.get_running_loop().run_in_executor(pool, render_report_pdf, content)
+            except BrokenProcessPool:
+                # A worker died; the next render starts a fresh pool. Renders that
+                # failed on the same pool must not drop one built since.
+                if self.pool is pool:
+                    self.pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+        else:
+            pdf = await run_in_threadpool(render_report_pdf, content)
+        pdf_render_duration.labels("process" if self.processes > 0 else "thread").observe(time.perf_counter() - started)
+        self.renders += 1
+        self.cache.set(key, pdf)
+        return pdf
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def stats(self):
+        return {
+            "processes": self.processes,
+            "in_flight": len(self._inflight),
+            "max_pending": self.max_pending,
+            "renders": self.renders,
+            "cache": self.cache.stats(),
+        }
+
+def create_pdf_renderer():
+    return PDFRenderer()
+
+def pdf_file_response(pdf: bytes, filename: str, headers: dict = None):
+    """
+    PDF bytes as a download. The render happens in another process and
+    comes back (and is cached) whole, so there is nothing to stream.
+    """
+    return Response(
+        pdf,
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            **(headers or {}),
+        },
+    )
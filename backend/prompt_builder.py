@@ -0,0 +1,176 @@
+"""
+Token-budgeted rendering of the symptom summary for report prompts.
+
+The per-day part of the summary grows with the length of the range, so it
+is fitted to a token budget in stages, stopping as soon as it fits:
+
+1. consecutive days with identical stats collapse into one counted run,
+2. consecutive low-signal days (below PEAK_SEVERITY and not among the
+   highest-severity days) merge into runs,
+3. low-signal runs are dropped, mildest first,
+4. the least frequent symptoms are dropped,
+5. peak days are dropped, mildest first.
+
+The medication list gets its own budget: the most-taken medications are
+listed and the rest are counted on a "+N more" line.
+
+Tokens are estimated at ~4 characters each, which is close enough for
+budgeting without shipping the model's tokenizer.
+"""
+import math
+
+# Days reaching this severity are always kept as individual lines if possible
+PEAK_SEVERITY = 7
+# ...as are the N most severe days, so mild ranges still keep their worst days
+PEAK_DAYS = 3
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / 4)
+
+def _symptom_line(s):
+    trend = s["trend"]
+    if s["trend_per_week"] is not None:
+        trend += f" ({s['trend_per_week']:+} severity/week)"
+    return (
+        f"- {s['name']}: {s['count']} entries, mean severity {s['mean_severity']}, max {s['max_severity']}, "
+        f"trend {trend}, first {s['first_seen']}, last {s['last_seen']}"
+    )
+
+def _run(days):
+    """Merge consecutive daily buckets into one counted run"""
+    count = sum(d["count"] for d in days)
+    return {
+        "first": days[0]["day"],
+        "last": days[-1]["day"],
+        "days": len(days),
+        "count": count,
+        "mean_severity": round(sum(d["mean_severity"] * d["count"] for d in days) / count, 1),
+        "max_severity": max(d["max_severity"] for d in days),
+        "peak": False,
+    }
+
+def _run_line(run):
+    if run["days"] == 1:
+        label = run["first"]
+    else:
+        label = f"{run['first']}..{run['last']} ({run['days']} days)"
+    return f"- {label}: {run['count']}, {run['mean_severity']}, {run['max_severity']}"
+
+def _group_runs(days, same_run):
+    runs, current = [], []
+    for day in days:
+        if current and not same_run(current[-1], day):
+            runs.append(current)
+            current = []
+        current.append(day)
+    if current:
+        runs.append(current)
+    return runs
+
+def _render(summary, symptoms, runs):
+    lines = [f"Total entries: {summary['total']}", "", "By symptom:"]
+    lines += [_symptom_line(s) for s in symptoms]
+    omitted = len(summary["symptoms"]) - len(symptoms)
+    if omitted:
+        lines.append(f"- ({omitted} less frequent symptoms omitted)")
+    lines += ["", "Daily (day or run of days: entries, mean severity, max severity):"]
+    lines += [_run_line(run) for run in runs]
+    omitted = len(summary["daily"]) - sum(run["days"] for run in runs)
+    if omitted:
+        lines.append(f"- ({omitted} days omitted, mildest first)")
+    return "\n".join(lines)
+
+def build_symptom_section(summary: dict, token_budget: int = None):
+    """
+    Render summarize_symptoms() output within `token_budget` tokens (no limit
+    when None). Returns (text, stats) where stats records the tokens used and
+    what was merged or dropped to fit.
+    """
+    daily = summary["daily"]
+    symptoms = list(summary["symptoms"])
+    stats = {
+        "token_budget": token_budget,
+        "tokens_used": 0,
+        "days": len(daily),
+        "days_merged": 0,
+        "days_dropped": 0,
+        "symptoms_dropped": [],
+    }
+
+    def fits(text):
+        return token_budget is None or estimate_tokens(text) <= token_budget
+
+    def finish(text):
+        shown = sum(run["days"] for run in runs)
+        stats["days_merged"] = shown - len(runs)
+        stats["days_dropped"] = len(daily) - shown
+        stats["tokens_used"] = estimate_tokens(text)
+        return text, stats
+
+    # 1. Repeated identical days become one counted run (lossless)
+    signature = lambda d: (d["count"], d["mean_severity"], d["max_severity"])
+    runs = [_run(group) for group in _group_runs(daily, lambda a, b: signature(a) == signature(b))]
+    text = _render(summary, symptoms, runs)
+    if fits(text):
+        return finish(text)
+
+    # 2. Low-signal days merge into runs; peaks stay on their own lines
+    top_days = sorted(daily, key=lambda d: (-d["max_severity"], -d["count"]))[:PEAK_DAYS]
+    peak_days = {d["day"] for d in top_days} | {d["day"] for d in daily if d["max_severity"] >= PEAK_SEVERITY}
+    is_peak = lambda d: d["day"] in peak_days
+    runs = []
+    for group in _group_runs(daily, lambda a, b: not is_peak(a) and not is_peak(b)):
+        run = _run(group)
+        run["peak"] = is_peak(group[0])
+        runs.append(run)
+    text = _render(summary, symptoms, runs)
+    if fits(text):
+        return finish(text)
+
+    # 3. Drop low-signal runs, mildest (then longest ago) first
+    def drop_runs(candidates):
+        for run in sorted(candidates, key=lambda r: (r["max_severity"], r["mean_severity"], r["first"])):
+            runs.remove(run)
+            text = _render(summary, symptoms, runs)
+            if fits(text):
+                return text
+        return None
+
+    text = drop_runs([run for run in runs if not run["peak"]])
+    if text is not None:
+        return finish(text)
+
+    # 4. Drop the least frequent symptoms, keeping the most frequent one
+    while len(symptoms) > 1:
+        dropped = symptoms.pop()
+        stats["symptoms_dropped"].append(dropped["name"])
+        text = _render(summary, symptoms, runs)
+        if fits(text):
+            return finish(text)
+
+    # 5. Peaks alone exceed the budget: drop the mildest
+    text = drop_runs(list(runs))
+    return finish(text if text is not None else _render(summary, symptoms, runs))
+
+def _medication_line(m):
+    return f"- {m['name']}: {m['frequency']} times a day, {m['adherence']} doses taken"
+
+def _render_medications(medications, shown):
+    lines = [_medication_line(m) for m in medications[:shown]]
+    omitted = len(medications) - shown
+    if omitted:
+        lines.append(f"- (+{omitted} more, least taken omitted)")
+    return "\n".join(lines) if lines else "No medications recorded"
+
+def build_medication_section(medications: list, token_budget: int = None):
+    """
+    Render the medication list within `token_budget` tokens (no limit when
+    None), most-taken first; ties keep their order. Returns (text, stats).
+    """
+    ordered = sorted(medications, key=lambda m: -m["adherence"])
+    shown = len(ordered)
+    text = _render_medications(ordered, shown)
+    while token_budget is not None and shown and estimate_tokens(text) > token_budget:
+        shown -= 1
+        text = _render_medications(ordered, shown)
+    return text, {"medication_tokens_used": estimate_tokens(text), "medications_dropped": len(ordered) - shown}
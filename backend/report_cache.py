@@ -0,0 +1,46 @@
+"""
+Cache of generated reports.
+
+Entries are keyed by user, normalised date range, report format and a
+fingerprint of the data the report was generated from, so a report is only
+reused while the symptoms and medications behind it are unchanged. Writes
+to a user's symptoms or medications also drop that user's entries.
+"""
+import hashlib
+import os
+
+from cache import TTLCache
+
+report_cache = TTLCache(
+    maxsize=int(os.getenv("REPORT_CACHE_SIZE", 256)),
+    ttl=float(os.getenv("REPORT_CACHE_TTL_SECONDS", 900)),
+)
+
+def report_cache_key(user_id: str, start_date, end_date, report_format: str, fingerprint: str):
+    """
+    Cache key for a report. Defaulted bounds are keyed by the request shape
+    rather than by the current time, so repeated views of "the last 30 days"
+    share an entry; the fingerprint still changes when new data falls in range.
+    """
+    start_key = start_date.isoformat() if start_date else "default"
+    end_key = end_date.isoformat() if end_date else "now"
+    return (user_id, start_key, end_key, report_format.strip().lower(), fingerprint)
+
+async def data_fingerprint(repositories, user_id: str, start, end):
+    """
+    Cheap digest of the symptoms in range and the user's medications.
+    Returns (symptom count, fingerprint). The symptom part is a count and max
+    _id served from the {user_id, timestamp, _id} index.
+    """
+    count, last_id = await repositories.symptoms.range_stats(user_id, start, end)
+    medications = await repositories.medications.find_by_user(user_id, ["updated_at", "adherence"])
+
+    digest = hashlib.sha1()
+    digest.update(f"{count}:{last_id}".encode())
+    for medication in medications:
+        digest.update(f"|{medication['_id']}:{medication.get('updated_at')}:{medication.get('adherence', 0)}".encode())
+    return count, digest.hexdigest()
+
+def invalidate_user_reports(user_id: str):
+    """Drop every cached report for a user after their data changed"""
+    return report_cache.invalidate(lambda key: key[0] == user_id)
@@ -0,0 +1,232 @@
+"""
+Background report jobs.
+
+Reports can take a while to generate, so clients may enqueue one and poll for
+it instead of holding a request open. Jobs live in the `report_jobs`
+collection and a bounded pool of asyncio workers runs them:
+
+- queued -> running -> done | failed, with the report (or the HTTP error it
+  raised) stored on the job document,
+- equivalent jobs (same user, requested range and format) that are still
+  pending share one document: a partial unique index on `dedupe_key` covers
+  only documents with `pending: true`, which is unset when a job finishes,
+- workers claim a job with an atomic queued -> running update, so a job is
+  run once even if several processes enqueued it,
+- a running job's lease (its `started_at`) is renewed every third of the
+  lease period while it runs, and its outcome is only stored under the lease
+  it still holds,
+- on startup, and every lease period after, queued jobs no worker picked up
+  and running jobs whose lease expired (their process died) are queued again.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+from utils import bson_datetime
+from logs import get_logger, log_event
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+logger = get_logger("report_jobs")
+
+class ReportQueueFullError(Exception):
+    """Raised when the in-process queue cannot take another job"""
+
+def _utcnow():
+    return bson_datetime(datetime.now(timezone.utc))
+
+def job_dedupe_key(user_id: str, start_date, end_date, report_format: str):
+    """Equivalent requests map to the same key (defaulted bounds as in report_cache_key)"""
+    start_key = start_date.isoformat() if start_date else "default"
+    end_key = end_date.isoformat() if end_date else "now"
+    return f"{user_id}|{start_key}|{end_key}|{report_format.strip().lower()}"
+
+def serialize_job(job: dict) -> dict:
+    """Job document as returned by the API (without the report itself)"""
+    data = {key: value for key, value in job.items() if key not in ("result", "dedupe_key", "pending")}
+    data["_id"] = str(job["_id"])
+    return data
+
+class ReportJobQueue:
+    """
+    Persisted report jobs run by `workers` asyncio tasks. `run_report` is
+    called as run_report(repositories, user_id, start_date, end_date, report_format)
+    and returns the report dict or raises HTTPException. Jobs are stored
+    through repositories.report_jobs.
+    """
+
+    def __init__(self, repositories, run_report, workers: int = 2, max_queued: int = 100, lease_seconds: float = 300):
+        self.repositories = repositories
+        self.jobs = repositories.report_jobs
+        self.run_report = run_report
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self._queue = asyncio.Queue(maxsize=max_queued)
+        self._tasks = []
+
+    def start(self):
+        """Start the workers and re-queue jobs left over from a previous run"""
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._recover()))
+
+    async def stop(self):
+        """Cancel the workers; jobs they were running are recovered on the next start"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, user_id: str, start_date=None, end_date=None, report_format: str = "summary"):
+        """Enqueue a report, or return the pending job for an equivalent request"""
+        dedupe_key = job_dedupe_key(user_id, start_date, end_date, report_format)
+        existing = await self.jobs.find_pending(dedupe_key)
+        if existing is not None:
+            return existing
+        if self._queue.full():
+            raise ReportQueueFullError("Too many report jobs queued, please try again shortly")
+
+        now = _utcnow()
+        job = {
+            "user_id": user_id,
+            "start_date": start_date,
+            "end_date": end_date,
+            "report_format": report_format,
+            "dedupe_key": dedupe_key,
+            "pending": True,
+            "status": QUEUED,
+            "created_at": now,
+            "updated_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+        }
+        try:
+            await self.jobs.insert(job)
+        except DuplicateKeyError:
+            # An equivalent job was enqueued concurrently
+            existing = await self.jobs.find_pending(dedupe_key)
+            if existing is not None:
+                return existing
+            raise
+        try:
+            self._queue.put_nowait(job["_id"])
+        except asyncio.QueueFull:
+            # Concurrent submits filled the queue during the insert; the job is
+            # stored as queued, so the recovery sweep picks it up
+            log_event(logger, "report_job_left_for_recovery", logging.WARNING, job_id=job["_id"])
+        return job
+
+    async def get(self, job_id: ObjectId, include_result: bool = False):
+        return await self.jobs.get(job_id, include_result)
+
+    def stats(self):
+        return {"workers": self.workers, "queued_in_process": self._queue.qsize(), "max_queued": self._queue.maxsize}
+
+    async def _recover(self):
+        """
+        Sweep for orphaned jobs every lease period: running jobs whose lease
+        expired go back to queued, and queued jobs are picked up (at startup,
+        and afterwards whenever this process has nothing queued).
+        """
+        first_pass = True
+        while True:
+            try:
+                now = _utcnow()
+                lease_expired = now - timedelta(seconds=self.lease_seconds)
+                await self.jobs.requeue_expired(lease_expired, now)
+                # Once running, only pick up other processes' leftovers when idle
+                job_ids = []
+                if first_pass or self._queue.empty():
+                    job_ids = await self.jobs.queued_ids()
+                for job_id in job_ids:
+                    # Claiming is atomic, so a job queued twice still runs once
+                    await self._queue.put(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_event(logger, "report_job_recovery_failed", logging.ERROR, exc_info=e)
+            first_pass = False
+            await asyncio.sleep(self.lease_seconds)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_event(logger, "report_job_crashed", logging.ERROR, job_id=job_id, exc_info=e)
+            finally:
+                self._queue.task_done()
+
+    async def _renew_lease(self, job_id, lease: dict, done: asyncio.Event):
+        """Keep `lease["started_at"]` fresh until `done` is set or the lease is lost"""
+        while True:
+            try:
+                await asyncio.wait_for(done.wait(), self.lease_seconds / 3)
+                return
+            except asyncio.TimeoutError:
+                pass
+            now = _utcnow()
+            try:
+                renewed = await self.jobs.renew(job_id, lease["started_at"], now)
+            except Exception as e:
+                # Try again next time; the lease outlives a few missed renewals
+                log_event(logger, "report_job_renew_failed", logging.WARNING, job_id=job_id, exc_info=e)
+                continue
+            if not renewed:
+                return
+            lease["started_at"] = now
+
+    async def _generate(self, job):
+        try:
+            report = await self.run_report(
+                self.repositories, job["user_id"], job["start_date"], job["end_date"], job["report_format"]
+            )
+        except HTTPException as e:
+            return {"status": FAILED, "error": {"status_code": e.status_code, "detail": e.detail}}
+        except Exception as e:
+            return {"status": FAILED, "error": {"status_code": 500, "detail": f"Error generating report: {str(e)}"}}
+        return {"status": DONE, "result": report}
+
+    async def _run(self, job_id):
+        now = _utcnow()
+        # Claim the job; None means another worker or process already has it
+        job = await self.jobs.claim(job_id, now)
+        if job is None:
+            return
+
+        lease = {"started_at": job["started_at"]}
+        done = asyncio.Event()
+        heartbeat = asyncio.create_task(self._renew_lease(job_id, lease, done))
+        try:
+            update = await self._generate(job)
+        finally:
+            # Let a renewal in flight land, so `lease` matches what is stored
+            done.set()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+
+        now = _utcnow()
+        update.update({"updated_at": now, "finished_at": now})
+        if not await self.jobs.finish(job_id, lease["started_at"], update):
+            # The lease expired and the job was re-queued; its new run records the outcome
+            log_event(logger, "report_job_lease_lost", logging.WARNING, job_id=job_id)
+
+def create_report_job_queue(repositories, run_report):
+    """Queue sized from REPORT_JOB_WORKERS, REPORT_JOB_MAX_QUEUED and REPORT_JOB_LEASE_SECONDS"""
+    return ReportJobQueue(
+        repositories,
+        run_report,
+        workers=int(os.getenv("REPORT_JOB_WORKERS", 2)),
+        max_queued=int(os.getenv("REPORT_JOB_MAX_QUEUED", 100)),
+        lease_seconds=float(os.getenv("REPORT_JOB_LEASE_SECONDS", 300)),
+    )
@@ -0,0 +1,347 @@
+"""
+Data access for the routers.
+
+Routers and services talk to repositories (symptoms, medications, users,
+report jobs, data versions) instead of MongoDB collections. The classes here are the
+MongoDB implementations used in production; memory_repositories.py has
+in-process twins with the same semantics (same documents, ordering, cursors
+and duplicate-key errors), selected with DATABASE_BACKEND=memory so tests
+and benchmarks can run without a database.
+
+Every write to a symptom or medication stamps `modified_at` (server UTC
+time), and deleting a medication leaves a tombstone in `deletions`, so
+routes/sync.py can hand clients just what changed since their last sync.
+The same writes bump the user's data version, which etags.py turns into
+ETags for the read endpoints.
+"""
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from pagination import paginate, keyset_filter, encode_cursor, decode_cursor
+from utils import bson_datetime
+from rollups import ROLLUPS_COLLECTION, DAY_FORMAT, record_symptom, record_symptoms, daily_cells_pipeline
+
+# Newest first; _id breaks ties between symptoms logged in the same millisecond
+SYMPTOM_SORT = [("timestamp", DESCENDING), ("_id", DESCENDING)]
+MEDICATION_SORT = [("_id", ASCENDING)]
+USER_SORT = [("_id", ASCENDING)]
+
+# Search results: best match first, newest first among equal scores
+SEARCH_SORT = [("score", DESCENDING), ("_id", DESCENDING)]
+# Delta sync order: oldest change first
+SYNC_SORT = [("modified_at", ASCENDING), ("_id", ASCENDING)]
+# Sorts after every real _id, so (t, MAX_OBJECT_ID) means "everything up to t"
+MAX_OBJECT_ID = ObjectId("f" * 24)
+
+REPORT_JOBS_COLLECTION = "report_jobs"
+DELETIONS_COLLECTION = "deletions"
+DATA_VERSIONS_COLLECTION = "data_versions"
+
+def modified_now():
+    return bson_datetime(datetime.now(timezone.utc))
+
+def changes_query(user_id: str, upper: datetime):
+    """Documents of a user last modified at or before `upper`"""
+    return {"user_id": user_id, "modified_at": {"$lte": upper}}
+
+def symptom_query(user_id: str, start: datetime = None, end: datetime = None):
+    query = {"user_id": user_id}
+    date_filter = {}
+    if start:
+        date_filter["$gte"] = start
+    if end:
+        date_filter["$lte"] = end
+    if date_filter:
+        query["timestamp"] = date_filter
+    return query
+
+def full_days(start: datetime, end: datetime):
+    """First and last calendar day lying entirely inside [start, end] (first > last when none does)"""
+    first = start.date() if start.time() == datetime.min.time() else start.date() + timedelta(days=1)
+    last = (end + timedelta(milliseconds=1)).date() - timedelta(days=1)
+    return first, last
+
+class DataVersionRepository:
+    """Per-user counter bumped after every write to that user's data"""
+
+    def __init__(self, database):
+        self.collection = database.get_collection(DATA_VERSIONS_COLLECTION)
+
+    async def get(self, user_id: str) -> int:
+        document = await self.collection.find_one({"_id": user_id})
+        return document["version"] if document else 0
+
+    async def bump(self, user_id: str):
+        await self.collection.update_one({"_id": user_id}, {"$inc": {"version": 1}}, upsert=True)
+
+class SymptomRepository:
+    def __init__(self, database, versions: DataVersionRepository):
+        self.database = database
+        self.collection = database.get_collection("symptoms")
+        self.versions = versions
+
+    async def create(self, symptom: dict):
+        """Insert a symptom (setting its _id) and add it to the daily rollups"""
+        symptom["modified_at"] = modified_now()
+        await self.collection.insert_one(symptom)
+        await record_symptom(self.database, symptom)
+        await self.versions.bump(symptom["user_id"])
+        return symptom["_id"]
+
+    async def create_many(self, symptoms: list):
+        """
+        Insert symptoms in one unordered batch (setting each _id) and roll up
+        the ones that were stored. Returns {index: write error} for the rest;
+        duplicate keys have code 11000.
+        """
+        modified_at = modified_now()
+        for symptom in symptoms:
+            symptom["modified_at"] = modified_at
+        errors = {}
+        try:
+            await self.collection.insert_many(symptoms, ordered=False)
+        except BulkWriteError as e:
+            errors = {error["index"]: {"code": error["code"], "message": error["errmsg"]} for error in e.details["writeErrors"]}
+        stored = [symptom for i, symptom in enumerate(symptoms) if i not in errors]
+        await record_symptoms(self.database, stored)
+        for user_id in {symptom["user_id"] for symptom in stored}:
+            await self.versions.bump(user_id)
+        return errors
+
+    async def list(self, user_id: str, start=None, end=None, limit: int = 100, skip: int = 0, cursor: str = None):
+        """One page of a user's symptoms, newest first, and the next page's cursor"""
+        return await paginate(self.collection, symptom_query(user_id, start, end), SYMPTOM_SORT, limit, skip, cursor)
+
+    async def search(self, user_id: str, text: str, start=None, end=None, limit: int = 20, cursor: str = None):
+        """
+        One page of the user's symptoms matching `text` on the text index
+        (name weighted over details), best match first, each with its `score`,
+        and the next page's cursor. Cost follows the number of matches.
+        """
+        pipeline = [
+            {"$match": {**symptom_query(user_id, start, end), "$text": {"$search": text}}},
+            {"$addFields": {"score": {"$meta": "textScore"}}},
+        ]
+        if cursor:
+            pipeline.append({"$match": keyset_filter(SEARCH_SORT, decode_cursor(cursor, SEARCH_SORT))})
+        pipeline += [{"$sort": dict(SEARCH_SORT)}, {"$limit": limit}]
+        documents = await (await self.collection.aggregate(pipeline)).to_list(length=None)
+        next_cursor = encode_cursor(documents[-1], SEARCH_SORT) if len(documents) == limit else None
+        return documents, next_cursor
+
+    async def changes(self, user_id: str, upper: datetime, limit: int, cursor: str = None):
+        """One page of symptoms modified up to `upper`, in SYNC_SORT order, and the next page's cursor"""
+        return await paginate(self.collection, changes_query(user_id, upper), SYNC_SORT, limit, 0, cursor)
+
+    async def range_stats(self, user_id: str, start: datetime, end: datetime):
+        """(count, max _id) of the user's symptoms in [start, end]"""
+        stats = await (await self.collection.aggregate([
+            {"$match": symptom_query(user_id, start, end)},
+            {"$group": {"_id": None, "count": {"$sum": 1}, "last_id": {"$max": "$_id"}}},
+        ])).to_list(length=1)
+        return (stats[0]["count"], stats[0]["last_id"]) if stats else (0, None)
+
+    async def daily_cells(self, user_id: str, start: datetime, end: datetime, use_rollups: bool = True):
+        """
+        (day, name) -> {count, sum, max} of severity for the range. With
+        rollups, whole days come from symptom_daily_rollups and only the
+        partial days at either end are aggregated from raw symptoms.
+        """
+        first, last = full_days(start, end)
+        raw_ranges = [{"$gte": start, "$lte": end}]
+        cells = {}
+        if use_rollups and first <= last:
+            first_midnight = datetime.combine(first, datetime.min.time())
+            after_last_midnight = datetime.combine(last + timedelta(days=1), datetime.min.time())
+            raw_ranges = [{"$gte": start, "$lt": first_midnight}, {"$gte": after_last_midnight, "$lte": end}]
+            rollups = await self.database.get_collection(ROLLUPS_COLLECTION).find(
+                {"user_id": user_id, "day": {"$gte": first.strftime(DAY_FORMAT), "$lte": last.strftime(DAY_FORMAT)}},
+                {"_id": 0, "day": 1, "name": 1, "count": 1, "sum": 1, "max": 1},
+            ).to_list(length=None)
+            for rollup in rollups:
+                cells[(rollup["day"], rollup["name"])] = rollup
+
+        match = {"user_id": user_id, "$or": [{"timestamp": timestamp_range} for timestamp_range in raw_ranges]}
+        raw = await (await self.collection.aggregate(daily_cells_pipeline(match))).to_list(length=None)
+        for cell in raw:
+            cells[(cell["_id"]["day"], cell["_id"]["name"])] = cell
+        return cells
+
+class MedicationRepository:
+    def __init__(self, database, versions: DataVersionRepository):
+        self.collection = database.get_collection("medications")
+        self.deletions = database.get_collection(DELETIONS_COLLECTION)
+        self.versions = versions
+
+    async def create(self, medication: dict):
+        medication["modified_at"] = modified_now()
+        await self.collection.insert_one(medication)
+        await self.versions.bump(medication["user_id"])
+        return medication["_id"]
+
+    async def list(self, user_id: str, limit: int = 100, skip: int = 0, cursor: str = None):
+        """One page of a user's medications in creation order, and the next page's cursor"""
+        return await paginate(self.collection, {"user_id": user_id}, MEDICATION_SORT, limit, skip, cursor)
+
+    async def changes(self, user_id: str, upper: datetime, limit: int, cursor: str = None):
+        """One page of medications modified up to `upper`, in SYNC_SORT order, and the next page's cursor"""
+        return await paginate(self.collection, changes_query(user_id, upper), SYNC_SORT, limit, 0, cursor)
+
+    async def deleted(self, user_id: str, upper: datetime, limit: int, cursor: str = None):
+        """One page of medication tombstones recorded up to `upper`, in SYNC_SORT order"""
+        query = {**changes_query(user_id, upper), "collection": "medications"}
+        return await paginate(self.deletions, query, SYNC_SORT, limit, 0, cursor)
+
+    async def find_by_user(self, user_id: str, fields=None):
+        """Every medication of a user in _id order, optionally only `fields` (plus _id)"""
+        projection = {field: 1 for field in fields} if fields else None
+        return await self.collection.find({"user_id": user_id}, projection).sort(MEDICATION_SORT).to_list(length=None)
+
+    async def update(self, medication_id, user_id: str, fields: dict):
+        """Set `fields` on the user's medication; the updated document, or None if not theirs"""
+        medication = await self.collection.find_one_and_update(
+            {"_id": medication_id, "user_id": user_id},
+            {"$set": {**fields, "modified_at": modified_now()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if medication:
+            await self.versions.bump(user_id)
+        return medication
+
+    async def increment_adherence(self, medication_id, user_id: str):
+        """Add one to adherence (from 0 if unset); the updated document, or None if not theirs"""
+        medication = await self.collection.find_one_and_update(
+            {"_id": medication_id, "user_id": user_id},
+            {"$inc": {"adherence": 1}, "$set": {"modified_at": modified_now()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if medication:
+            await self.versions.bump(user_id)
+        return medication
+
+    async def delete(self, medication_id, user_id: str):
+        """Delete the user's medication, leaving a tombstone for sync; False if there was none"""
+        result = await self.collection.delete_one({"_id": medication_id, "user_id": user_id})
+        if not result.deleted_count:
+            return False
+        await self.deletions.insert_one({
+            "user_id": user_id, "collection": "medications", "document_id": medication_id, "modified_at": modified_now(),
+        })
+        await self.versions.bump(user_id)
+        return True
+
+class UserRepository:
+    def __init__(self, database, versions: DataVersionRepository):
+        self.collection = database.get_collection("users")
+        self.versions = versions
+
+    async def create(self, user: dict):
+        """Insert a user; raises DuplicateKeyError (with keyPattern) for a taken username or email"""
+        await self.collection.insert_one(user)
+        return user["_id"]
+
+    async def get(self, user_id):
+        return await self.collection.find_one({"_id": user_id})
+
+    async def get_by_username(self, username: str):
+        return await self.collection.find_one({"username": username})
+
+    async def get_by_email(self, email: str):
+        return await self.collection.find_one({"email": email})
+
+    async def set_password_hash(self, user_id, hashed_password: str):
+        await self.collection.update_one({"_id": user_id}, {"$set": {"hashed_password": hashed_password}})
+
+    async def update(self, user_id, fields: dict):
+        """Set `fields` on a user; the updated document, or None if there is no such user"""
+        user = await self.collection.find_one_and_update(
+            {"_id": user_id}, {"$set": fields}, return_document=ReturnDocument.AFTER
+        )
+        if user:
+            await self.versions.bump(str(user_id))
+        return user
+
+    async def list(self, limit: int = 100, skip: int = 0, cursor: str = None):
+        return await paginate(self.collection, {}, USER_SORT, limit, skip, cursor)
+
+class ReportJobRepository:
+    """Storage for report_jobs.ReportJobQueue"""
+
+    def __init__(self, database):
+        self.collection = database.get_collection(REPORT_JOBS_COLLECTION)
+
+    async def find_pending(self, dedupe_key: str):
+        return await self.collection.find_one({"dedupe_key": dedupe_key, "pending": True}, {"result": 0})
+
+    async def insert(self, job: dict):
+        """Insert a job; DuplicateKeyError if an equivalent job is already pending"""
+        await self.collection.insert_one(job)
+        return job["_id"]
+
+    async def get(self, job_id, include_result: bool = False):
+        return await self.collection.find_one({"_id": job_id}, None if include_result else {"result": 0})
+
+    async def claim(self, job_id, now: datetime):
+        """Move a queued job to running; None if it is not queued (any more)"""
+        return await self.collection.find_one_and_update(
+            {"_id": job_id, "status": "queued"},
+            {"$set": {"status": "running", "started_at": now, "updated_at": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def renew(self, job_id, started_at: datetime, now: datetime):
+        """Extend the lease of a job still running from `started_at`; False if the lease was lost"""
+        result = await self.collection.update_one(
+            {"_id": job_id, "status": "running", "started_at": started_at},
+            {"$set": {"started_at": now, "updated_at": now}},
+        )
+        return result.matched_count == 1
+
+    async def finish(self, job_id, started_at: datetime, fields: dict):
+        """
+        Record a job's outcome and release its dedupe key, if the job is still
+        running under the lease that started (or last renewed) at `started_at`;
+        False if it is not (the lease expired and the job was re-queued)
+        """
+        result = await self.collection.update_one(
+            {"_id": job_id, "status": "running", "started_at": started_at},
+            {"$set": fields, "$unset": {"pending": ""}},
+        )
+        return result.matched_count == 1
+
+    async def requeue_expired(self, started_before: datetime, now: datetime):
+        """Send running jobs started before `started_before` back to the queue"""
+        await self.collection.update_many(
+            {"status": "running", "started_at": {"$lt": started_before}},
+            {"$set": {"status": "queued", "updated_at": now}},
+        )
+
+    async def queued_ids(self):
+        """_ids of queued jobs, oldest first"""
+        jobs = await self.collection.find({"status": "queued"}, {"_id": 1}).sort("created_at", 1).to_list(length=None)
+        return [job["_id"] for job in jobs]
+
+class Repositories:
+    """The repositories one app instance uses"""
+
+    def __init__(self, symptoms, medications, users, report_jobs, versions):
+        self.symptoms = symptoms
+        self.medications = medications
+        self.users = users
+        self.report_jobs = report_jobs
+        self.versions = versions
+
+def create_repositories(database):
+    """MongoDB-backed repositories on `database`"""
+    versions = DataVersionRepository(database)
+    return Repositories(
+        SymptomRepository(database, versions),
+        MedicationRepository(database, versions),
+        UserRepository(database, versions),
+        ReportJobRepository(database),
+        versions,
+    )
@@ -0,0 +1,112 @@
+"""
+Daily symptom rollups.
+
+`symptom_daily_rollups` holds one document per (user_id, day, symptom name)
+with the count, sum and max of severity, so range reads cost O(days) small
+documents instead of O(symptoms). create_symptom keeps it current with an
+upserted $inc/$max; the command below regenerates it from raw symptoms
+(after a backfill, or if a write was lost):
+
+    python rollups.py --rebuild                 # every user
+    python rollups.py --rebuild --user-id ID    # one user
+"""
+import argparse
+import asyncio
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+ROLLUPS_COLLECTION = "symptom_daily_rollups"
+
+# Days are the calendar day of the stored (UTC+4) symptom timestamp
+DAY_FORMAT = "%Y-%m-%d"
+
+REBUILD_BATCH_SIZE = 1000
+
+def symptom_day(timestamp: datetime) -> str:
+    return timestamp.strftime(DAY_FORMAT)
+
+async def record_symptom(database, symptom: dict):
+    """Add one new symptom to its day's rollup"""
+    await database.get_collection(ROLLUPS_COLLECTION).update_one(
+        {"user_id": symptom["user_id"], "day": symptom_day(symptom["timestamp"]), "name": symptom["name"]},
+        {"$inc": {"count": 1, "sum": symptom["severity"]}, "$max": {"max": symptom["severity"]}},
+        upsert=True,
+    )
+
+async def record_symptoms(database, symptoms):
+    """Add a batch of new symptoms to their rollups, one upsert per (user, day, name) in a single bulk write"""
+    cells = {}
+    for symptom in symptoms:
+        key = (symptom["user_id"], symptom_day(symptom["timestamp"]), symptom["name"])
+        cell = cells.setdefault(key, {"count": 0, "sum": 0, "max": symptom["severity"]})
+        cell["count"] += 1
+        cell["sum"] += symptom["severity"]
+        cell["max"] = max(cell["max"], symptom["severity"])
+    if not cells:
+        return
+    await database.get_collection(ROLLUPS_COLLECTION).bulk_write([
+        UpdateOne(
+            {"user_id": user_id, "day": day, "name": name},
+            {"$inc": {"count": cell["count"], "sum": cell["sum"]}, "$max": {"max": cell["max"]}},
+            upsert=True,
+        )
+        for (user_id, day, name), cell in cells.items()
+    ], ordered=False)
+
+def daily_cells_pipeline(match: dict, by_user: bool = False):
+    """Aggregation grouping raw symptoms matching `match` into rollup-shaped documents"""
+    group_id = {"day": {"$dateToString": {"format": DAY_FORMAT, "date": "$timestamp"}}, "name": "$name"}
+    if by_user:
+        group_id["user_id"] = "$user_id"
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": group_id,
+            "count": {"$sum": 1},
+            "sum": {"$sum": "$severity"},
+            "max": {"$max": "$severity"},
+        }},
+    ]
+
+async def rebuild_rollups(database, user_id: str = None):
+    """
+    Regenerate rollups from raw symptoms, for one user or everyone. Symptoms
+    created while a rebuild runs may be counted twice or not at all; rebuild
+    again once writes are quiet. Returns the number of rollup documents written.
+    """
+    match = {"user_id": user_id} if user_id else {}
+    rollups = database.get_collection(ROLLUPS_COLLECTION)
+    cells = await database.get_collection("symptoms").aggregate(daily_cells_pipeline(match, by_user=True))
+
+    await rollups.delete_many(match)
+    written = 0
+    batch = []
+    async for cell in cells:
+        batch.append({**cell["_id"], "count": cell["count"], "sum": cell["sum"], "max": cell["max"]})
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            await rollups.insert_many(batch, ordered=False)
+            written += len(batch)
+            batch = []
+    if batch:
+        await rollups.insert_many(batch, ordered=False)
+        written += len(batch)
+    return written
+
+async def _main(user_id):
+    from database import create_client, DATABASE_NAME
+
+    client = create_client()
+    try:
+        written = await rebuild_rollups(client[DATABASE_NAME], user_id)
+    finally:
+        await client.close()
+    print(f"Rebuilt {written} daily rollups")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Regenerate symptom_daily_rollups from raw symptoms")
+    parser.add_argument("--rebuild", action="store_true", required=True, help="rebuild the rollups")
+    parser.add_argument("--user-id", help="only rebuild this user's rollups")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(_main(args.user_id)))
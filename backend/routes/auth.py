@@ -1,30 +1,36 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pymongo.errors import DuplicateKeyError
-from database import users_collection
 from models import User, UserInDB, Token
+from passwords import password_hasher, PasswordHasherBusyError
+from logs import get_logger, log_event
+from auth_cache import token_claims_cache, auth_user_cache, cache_claims
 
 router = APIRouter(prefix="", tags=["auth"])
+logger = get_logger("auth")
 
 # Security settings
 SECRET_KEY = "your-secret-key"  # Replace with a secure key in production
 ALGORITHM = "HS256"
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    """(matches, upgraded hash or None), computed off the event loop"""
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusyError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "1"})
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusyError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "1"})
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -32,63 +38,75 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+async def get_users_repository(request: Request):
+    """The app's users repository"""
+    return request.app.repositories.users
+
+async def get_current_user(token: str = Depends(oauth2_scheme), users = Depends(get_users_repository)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    payload = token_claims_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = users_collection.find_one({"username": username})
-    if user is None:
+        cache_claims(token, payload)
+    username: str = payload.get("sub")
+    if username is None:
         raise credentials_exception
 
-    # Convert ObjectId to string and include it in the user data
-    user["_id"] = str(user["_id"])
-    # Create a dictionary with all user fields including _id
-    user_data = {
-        "username": user["username"],
-        "email": user.get("email", ""),
-        "_id": user["_id"]
-    }
-    return user_data
+    user_data = auth_user_cache.get(username)
+    if user_data is None:
+        user = await users.get_by_username(username)
+        if user is None:
+            raise credentials_exception
+        if user.get("disabled"):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
+
+        # Create a dictionary with all user fields including _id (as a string)
+        user_data = {
+            "username": user["username"],
+            "email": user.get("email", ""),
+            "_id": str(user["_id"])
+        }
+        auth_user_cache.set(username, user_data)
+    # A copy, so handlers cannot change the cached record
+    return dict(user_data)
 
 @router.post("/register", response_model=User)
-async def register(user: UserInDB):
+async def register(user: UserInDB, users = Depends(get_users_repository)):
     # Check if user already exists
-    if users_collection.find_one({"username": user.username}):
+    if await users.get_by_username(user.username):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
     
     # Hash password
-    hashed_password = get_password_hash(user.hashed_password)
+    hashed_password = await get_password_hash(user.hashed_password)
     user_dict = user.dict()
     user_dict["hashed_password"] = hashed_password
     
     try:
-        users_collection.insert_one(user_dict)
-    except DuplicateKeyError:
+        await users.create(user_dict)
+    except DuplicateKeyError as e:
+        field = "Username" if "username" in (e.details or {}).get("keyPattern", {}) else "Email"
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already registered"
+            detail=f"{field} already registered"
         )
     
     return User(**user_dict)
 
 @router.post("/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = users_collection.find_one({"username": form_data.username})
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), users = Depends(get_users_repository)):
+    user = await users.get_by_username(form_data.username)
     if not user:
-        print("User not found")
+        log_event(logger, "login_failed", sampled=True, reason="unknown_user")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -96,14 +114,19 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         )
     
     user_in_db = UserInDB(**user)
-    if not verify_password(form_data.password, user_in_db.hashed_password):
-        print("Password mismatch")
+    matches, new_hash = await verify_password(form_data.password, user_in_db.hashed_password)
+    if not matches:
+        log_event(logger, "login_failed", sampled=True, reason="password_mismatch")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    if new_hash:
+        # Stored with an outdated bcrypt cost; upgrade it now that we have the password
+        await users.set_password_hash(user["_id"], new_hash)
+    
     access_token = create_access_token(data={"sub": user_in_db.username})
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -1,15 +1,19 @@
-from fastapi import APIRouter, HTTPException, Body, Path, Query, Request
-from typing import List
+from fastapi import APIRouter, HTTPException, Body, Path, Query, Request, Response
+from typing import List, Optional
 from datetime import datetime, timezone, timedelta
 from bson import ObjectId
 
 from models import MedicationModel, MedicationCreate, MedicationUpdate
-from utils import validate_object_id
+from utils import validate_object_id, bson_datetime
+from pagination import set_next_page
+from etags import check_etag
+from bson_json import bson_json_response
+from report_cache import invalidate_user_reports
 
 router = APIRouter()
 
 @router.post("/", response_description="Add new medication")
-def create_medication(request: Request, user_id: str, medication: MedicationCreate = Body(...)):
+async def create_medication(request: Request, user_id: str, medication: MedicationCreate = Body(...)):
     """Add a new medication for a specific user"""
     if not validate_object_id(user_id):
         raise HTTPException(status_code=400, detail="Invalid user ID")
@@ -18,36 +22,42 @@ def create_medication(request: Request, user_id: str, medication: MedicationCrea
     medication_data["user_id"] = user_id
     medication_data["adherence"] = 0  # Initialize adherence count to 0
     utc_now = datetime.now(timezone.utc)
-    gst_now = utc_now + timedelta(hours=4)
+    # Stored as Mongo would hand it back, so the inserted dict is the response
+    gst_now = bson_datetime(utc_now + timedelta(hours=4))
     medication_data["created_at"] = gst_now
     medication_data["updated_at"] = gst_now
     
-    medications_collection = request.app.database.get_collection("medications")
-    new_medication = medications_collection.insert_one(medication_data)
-    created_medication = medications_collection.find_one({"_id": new_medication.inserted_id})
+    new_medication_id = await request.app.repositories.medications.create(medication_data)
+    invalidate_user_reports(user_id)
     
     # Convert ObjectId to string
-    created_medication["_id"] = str(created_medication["_id"])
+    medication_data["_id"] = str(new_medication_id)
     
-    return created_medication
+    return medication_data
 
 @router.get("/{user_id}", response_description="List all medications for a user")
-def list_medications(request: Request, user_id: str, skip: int = 0, limit: int = 100):
-    """Get all medications for a specific user"""
+async def list_medications(
+    request: Request,
+    response: Response,
+    user_id: str,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None
+):
+    """Get all medications for a specific user, paginated by skip/limit or by cursor"""
     if not validate_object_id(user_id):
         raise HTTPException(status_code=400, detail="Invalid user ID")
+    not_modified = await check_etag(request, response, user_id)
+    if not_modified:
+        return not_modified
     
-    medications_collection = request.app.database.get_collection("medications")
-    medications = list(medications_collection.find({"user_id": user_id}).skip(skip).limit(limit))
+    medications, next_cursor = await request.app.repositories.medications.list(user_id, limit, skip, cursor)
+    set_next_page(request, response, next_cursor)
     
-    # Convert ObjectId to string for each medication
-    for medication in medications:
-        medication["_id"] = str(medication["_id"])
-    
-    return medications
+    return bson_json_response(medications, response)
 
 @router.put("/{medication_id}", response_description="Update a medication")
-def update_medication(
+async def update_medication(
     request: Request,
     medication_id: str, 
     user_id: str,
@@ -66,83 +76,49 @@ def update_medication(
     # Add updated timestamp
     update_data["updated_at"] = datetime.now()
     
-    medications_collection = request.app.database.get_collection("medications")
-    
-    # Ensure the medication belongs to the user
-    medication_exists = medications_collection.find_one({
-        "_id": ObjectId(medication_id),
-        "user_id": user_id
-    })
-    
-    if not medication_exists:
-        raise HTTPException(status_code=404, detail="Medication not found or does not belong to user")
-    
-    medications_collection.update_one(
-        {"_id": ObjectId(medication_id)}, 
-        {"$set": update_data}
+    # Update only if the medication belongs to the user, in one atomic command
+    updated_medication = await request.app.repositories.medications.update(
+        ObjectId(medication_id), user_id, update_data
     )
     
-    updated_medication = medications_collection.find_one({"_id": ObjectId(medication_id)})
-    
-    # Convert ObjectId to string
-    updated_medication["_id"] = str(updated_medication["_id"])
+    if not updated_medication:
+        raise HTTPException(status_code=404, detail="Medication not found or does not belong to user")
+    invalidate_user_reports(user_id)
     
-    return updated_medication
+    return bson_json_response(updated_medication)
 
 @router.delete("/{medication_id}", response_description="Delete a medication")
-def delete_medication(request: Request, medication_id: str, user_id: str):
+async def delete_medication(request: Request, medication_id: str, user_id: str):
     """Delete a medication for a specific user"""
     if not validate_object_id(medication_id) or not validate_object_id(user_id):
         raise HTTPException(status_code=400, detail="Invalid ID format")
     
-    medications_collection = request.app.database.get_collection("medications")
-    
-    # Ensure the medication belongs to the user
-    medication = medications_collection.find_one({
-        "_id": ObjectId(medication_id),
-        "user_id": user_id
-    })
+    # Delete only if the medication belongs to the user
+    deleted = await request.app.repositories.medications.delete(ObjectId(medication_id), user_id)
     
-    if not medication:
+    if not deleted:
         raise HTTPException(status_code=404, detail="Medication not found or does not belong to user")
+    invalidate_user_reports(user_id)
     
-    delete_result = medications_collection.delete_one({"_id": ObjectId(medication_id)})
-    
-    if delete_result.deleted_count == 1:
-        return {"message": "Medication deleted successfully"}
-    
-    raise HTTPException(status_code=500, detail="Failed to delete medication")
+    return {"message": "Medication deleted successfully"}
 
 @router.post("/increment-adherence", response_description="Increment medication adherence")
-def increment_medication_adherence(request: Request, medication_id: str, user_id: str):
+async def increment_medication_adherence(request: Request, medication_id: str, user_id: str):
     """Increment the adherence count for a specific medication"""
     if not validate_object_id(medication_id) or not validate_object_id(user_id):
         raise HTTPException(status_code=400, detail="Invalid ID format")
     
-    medications_collection = request.app.database.get_collection("medications")
-    
-    # Ensure the medication belongs to the user
-    medication = medications_collection.find_one({
-        "_id": ObjectId(medication_id),
-        "user_id": user_id
-    })
-    
-    if not medication:
-        raise HTTPException(status_code=404, detail="Medication not found or does not belong to user")
-    
-    # Increment the adherence field, creating it with value 1 if it doesn't exist
-    result = medications_collection.update_one(
-        {"_id": ObjectId(medication_id)},
-        {"$inc": {"adherence": 1}}
+    # Increment the adherence field (creating it with value 1 if it doesn't
+    # exist) only if the medication belongs to the user
+    updated_medication = await request.app.repositories.medications.increment_adherence(
+        ObjectId(medication_id), user_id
     )
     
-    if result.modified_count == 1:
-        updated_medication = medications_collection.find_one({"_id": ObjectId(medication_id)})
-        # Convert ObjectId to string
-        updated_medication["_id"] = str(updated_medication["_id"])
-        return updated_medication
+    if not updated_medication:
+        raise HTTPException(status_code=404, detail="Medication not found or does not belong to user")
+    invalidate_user_reports(user_id)
     
-    raise HTTPException(status_code=500, detail="Failed to update medication adherence")
+    return bson_json_response(updated_medication)
 
 
 
@@ -0,0 +1,58 @@
+from fastapi import APIRouter, HTTPException, Body, Request
+from bson import ObjectId
+
+from models import ReportJobCreate
+from utils import validate_object_id
+from report_jobs import ReportQueueFullError, serialize_job, DONE, FAILED
+from routes.reports import pdf_response
+
+router = APIRouter()
+
+async def _get_job(request: Request, job_id: str, include_result: bool = False):
+    if not validate_object_id(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job ID")
+    job = await request.app.report_jobs.get(ObjectId(job_id), include_result=include_result)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    return job
+
+async def _get_finished_report(request: Request, job_id: str):
+    """The job's report, the error the job failed with, or a 409 while it is still pending"""
+    job = await _get_job(request, job_id, include_result=True)
+    if job["status"] == FAILED:
+        raise HTTPException(status_code=job["error"]["status_code"], detail=job["error"]["detail"])
+    if job["status"] != DONE:
+        raise HTTPException(status_code=409, detail=f"Report job is {job['status']}")
+    return job["result"]
+
+@router.post("", status_code=202, response_description="Queue a report for a user")
+async def create_report_job(request: Request, user_id: str, job: ReportJobCreate = Body(ReportJobCreate())):
+    """
+    Queue a report for background generation and return the job to poll.
+    While an equivalent job (same user, range and format) is still pending,
+    that job is returned instead of queueing another.
+    """
+    if not validate_object_id(user_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+    
+    try:
+        report_job = await request.app.report_jobs.submit(user_id, job.start_date, job.end_date, job.report_format)
+    except ReportQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    return serialize_job(report_job)
+
+@router.get("/{job_id}", response_description="Get report job status")
+async def get_report_job(request: Request, job_id: str):
+    """Status of a report job: queued, running, done or failed (with the error)"""
+    return serialize_job(await _get_job(request, job_id))
+
+@router.get("/{job_id}/result", response_description="Get the report generated by a job")
+async def get_report_job_result(request: Request, job_id: str):
+    """The generated report, same shape as GET /api/reports/{user_id}"""
+    return await _get_finished_report(request, job_id)
+
+@router.get("/{job_id}/pdf", response_description="Get the report generated by a job as a PDF")
+async def get_report_job_pdf(request: Request, job_id: str):
+    """The generated report rendered as a PDF"""
+    report_data = await _get_finished_report(request, job_id)
+    return await pdf_response(request, report_data)
@@ -1,85 +1,32 @@
-from fastapi import APIRouter, HTTPException, Query, Path, Request
+from fastapi import APIRouter, HTTPException, Query, Path, Request, Response
+from fastapi.responses import StreamingResponse
 from typing import Optional
 from datetime import datetime, timedelta
 from bson import ObjectId
 import os
-from groq import Groq
+import json
+import logging
 
 from models import ReportQuery
 from utils import parse_date_range, validate_object_id
+from report_cache import report_cache, report_cache_key, data_fingerprint
+from etags import check_etag, report_etag_extra
+from bson_json import bson_json_response
+from symptom_summary import summarize_symptoms
+from prompt_builder import build_medication_section, build_symptom_section, estimate_tokens
+from llm import get_llm_client, LLMUnavailableError, REPORT_MODEL
+from pdf_renderer import PDFRendererBusyError, pdf_file_response
+from logs import get_logger, log_event
 
 router = APIRouter()
+logger = get_logger("reports")
 
-@router.get("/{user_id}", response_description="Generate report for a user")
-def generate_report(
-    request: Request,
-    user_id: str,
-    start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None,
-    report_format: str = "summary"
-):
-    """
-    Fetch data for a given date range and generate a report using Groq API.
-    If no date range is specified, it uses the last 30 days.
-    """
-    if not validate_object_id(user_id):
-        raise HTTPException(status_code=400, detail="Invalid user ID")
-    
-    # Parse date range or use defaults
-    start, end = parse_date_range(start_date, end_date)
-    
-    # Query symptoms for the user within the date range
-    symptoms_collection = request.app.database.get_collection("symptoms")
-    medications_collection = request.app.database.get_collection("medications")
-    
-    symptoms_query = {
-        "user_id": user_id,
-        "timestamp": {"$gte": start, "$lte": end}
-    }
-    
-    symptoms = list(symptoms_collection.find(symptoms_query))
-    medications = list(medications_collection.find({"user_id": user_id}))
-
-    # if symptom and medication data is empty, raise an error and return 404
-    if not symptoms:
-        raise HTTPException(status_code=404, detail="No data found for the specified user and date range")
-    
-    # Convert ObjectIds to strings
-    for symptom in symptoms:
-        symptom["_id"] = str(symptom["_id"])
-    
-    for medication in medications:
-        medication["_id"] = str(medication["_id"])
-    
-    # Prepare data for the report
-    symptom_data = [
-        {
-            "name": s["name"],
-            "details": s["details"],
-            "severity": s["severity"],
-            "timestamp": s["timestamp"].isoformat() if isinstance(s["timestamp"], datetime) else s["timestamp"]
-        } for s in symptoms
-    ]
+# Upper bound on the estimated tokens of the whole report prompt
+PROMPT_TOKEN_BUDGET = int(os.getenv("REPORT_PROMPT_TOKEN_BUDGET", 4000))
+# Share of it the medication list may take
+MEDICATION_TOKEN_BUDGET = int(os.getenv("REPORT_MEDICATION_TOKEN_BUDGET", 600))
 
-
-    
-    medication_data = [
-        {
-            "name": m["name"],
-            "frequency": m["frequency"],
-            "adherence": m.get("adherence", 0)
-        } for m in medications
-    ]
-    
-    # Initialize Groq client
-    try:
-        groq_api_key = os.environ.get("GROQ_API_KEY")
-        if not groq_api_key:
-            raise HTTPException(status_code=500, detail="GROQ_API_KEY not found in environment variables")
-        
-        client = Groq(api_key=groq_api_key)
-        
-        system_prompt = """You are a medical report generator that creates clear, well-structured health reports.
+SYSTEM_PROMPT = """You are a medical report generator that creates clear, well-structured health reports.
 
         Always organize the report using these exact sections and format:
 
@@ -108,10 +55,12 @@ def generate_report(
 
         IMPORTANT: The report must be simple but professional, like a standard medical report. Do not add any decorative elements or unnecessary formatting."""
 
-        user_content = f"""
+def _build_messages(start, end, symptom_data, medication_data, report_format):
+    """Chat messages asking the LLM for the report"""
+    user_content = f"""
         Generate a detailed, professionally formatted health report timeline for the period from **{start.strftime('%B %d, %Y')}** to **{end.strftime('%B %d, %Y')}**.
 
-        # SYMPTOMS DATA:
+        # SYMPTOMS SUMMARY (aggregated from every entry in the period):
         {symptom_data}
 
         # MEDICATIONS DATA:
@@ -121,90 +70,221 @@ def generate_report(
 
         Ensure the report uses proper hierarchical headings, bold for important information, italics for supporting details, and maintains a consistent formatting style throughout. Include clear section dividers and organize information in a logical flow that will render well in a PDF document.
         """
+    return [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": user_content
+        }
+    ]
+
+def _count_tokens(messages):
+    return sum(estimate_tokens(message["content"]) for message in messages)
+
+async def _prepare_report(repositories, user_id: str, start_date, end_date, report_format: str):
+    """
+    Validate the request and gather what the report needs.
+    Returns (cache_key, report, messages). On a cache hit `report` is the
+    cached report and `messages` is None; otherwise `report` holds everything
+    except "generated_report" and `messages` is the LLM prompt.
+    """
+    if not validate_object_id(user_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+    
+    # Parse date range or use defaults
+    start, end = parse_date_range(start_date, end_date)
+    
+    # Serve a cached report if the data behind it has not changed
+    symptoms_count, fingerprint = await data_fingerprint(repositories, user_id, start, end)
+    
+    # if symptom and medication data is empty, raise an error and return 404
+    if not symptoms_count:
+        raise HTTPException(status_code=404, detail="No data found for the specified user and date range")
+    
+    cache_key = report_cache_key(user_id, start_date, end_date, report_format, fingerprint)
+    cached_report = report_cache.get(cache_key)
+    if cached_report is not None:
+        return cache_key, dict(cached_report), None
+    
+    # Symptoms are summarised from the daily rollups; only medications are read as documents
+    summary = await summarize_symptoms(repositories.symptoms, user_id, start, end)
+    if summary["total"] != symptoms_count:
+        # Rollups are missing or stale (e.g. not rebuilt after a backfill)
+        log_event(logger, "rollups_out_of_date", logging.WARNING, user_id=user_id,
+                  rollup_total=summary["total"], symptoms_count=symptoms_count)
+        summary = await summarize_symptoms(repositories.symptoms, user_id, start, end, use_rollups=False)
+    medications = await repositories.medications.find_by_user(user_id, ["name", "frequency", "adherence"])
+    
+    # Prepare data for the report
+    medication_data = [
+        {
+            "name": m["name"],
+            "frequency": m["frequency"],
+            "adherence": m.get("adherence", 0)
+        } for m in medications
+    ]
+    
+    # Medications get a capped share of the budget; whatever is left goes to symptoms
+    available = max(PROMPT_TOKEN_BUDGET - _count_tokens(_build_messages(start, end, "", "", report_format)), 0)
+    medication_section, medication_stats = build_medication_section(medication_data, min(MEDICATION_TOKEN_BUDGET, available))
+    symptom_data, prompt_stats = build_symptom_section(summary, max(available - medication_stats["medication_tokens_used"], 0))
+    messages = _build_messages(start, end, symptom_data, medication_section, report_format)
+    prompt_stats.update(medication_stats, token_budget=PROMPT_TOKEN_BUDGET, tokens_used=_count_tokens(messages))
+    
+    report = {
+        "user_id": user_id,
+        "report_period": {
+            "start_date": start.isoformat(),
+            "end_date": end.isoformat()
+        },
+        "data_summary": {
+            "symptoms_count": summary["total"],
+            "medications_count": len(medications)
+        },
+        "prompt_stats": prompt_stats
+    }
+    return cache_key, report, messages
+
+def _get_report_llm_client():
+    """Shared LLM client, or a 500 when the API key is not configured"""
+    groq_api_key = os.environ.get("GROQ_API_KEY")
+    if not groq_api_key:
+        raise HTTPException(status_code=500, detail="GROQ_API_KEY not found in environment variables")
+    return get_llm_client(groq_api_key)
+
+async def build_report(repositories, user_id: str, start_date=None, end_date=None, report_format: str = "summary"):
+    """
+    Generate (or fetch from cache) a report. Errors are raised as HTTPException,
+    which is what the endpoints return and what report jobs record.
+    """
+    cache_key, report, messages = await _prepare_report(repositories, user_id, start_date, end_date, report_format)
+    if messages is None:
+        return report
+    
+    try:
+        client = _get_report_llm_client()
         
         # Call Groq API
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": user_content
-                }
-            ],
-            model="llama-3.3-70b-versatile",
-        )
-        
-        # Extract the generated report
-        generated_report = chat_completion.choices[0].message.content
+        report["generated_report"] = await client.complete(messages=messages, model=REPORT_MODEL)
         
-        return {
-            "user_id": user_id,
-            "report_period": {
-                "start_date": start.isoformat(),
-                "end_date": end.isoformat()
-            },
-            "generated_report": generated_report,
-            "data_summary": {
-                "symptoms_count": len(symptoms),
-                "medications_count": len(medications)
-            }
-        }
+        report_cache.set(cache_key, report)
+        return dict(report)
         
+    except LLMUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(client.breaker.reset_after))})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating report: {str(e)}")
 
+@router.get("/{user_id}", response_description="Generate report for a user")
+async def generate_report(
+    request: Request,
+    response: Response,
+    user_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    report_format: str = "summary"
+):
+    """
+    Fetch data for a given date range and generate a report using Groq API.
+    If no date range is specified, it uses the last 30 days.
+    """
+    if not validate_object_id(user_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+    not_modified = await check_etag(request, response, user_id, *report_etag_extra(start_date, end_date))
+    if not_modified:
+        return not_modified
+    return bson_json_response(await build_report(request.app.repositories, user_id, start_date, end_date, report_format), response)
+
+def _sse(event: str, data: dict) -> str:
+    """One Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _report_events(client, cache_key, report, messages):
+    """Stream the report as `token` events, then a `done` event with the report metadata"""
+    if messages is None:
+        # Cached: the whole text is available at once
+        yield _sse("token", {"text": report["generated_report"]})
+    else:
+        parts = []
+        try:
+            async for text in client.stream(messages=messages, model=REPORT_MODEL):
+                parts.append(text)
+                yield _sse("token", {"text": text})
+        except LLMUnavailableError as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+        except Exception as e:
+            yield _sse("error", {"detail": f"Error generating report: {str(e)}"})
+            return
+        report["generated_report"] = "".join(parts)
+        report_cache.set(cache_key, report)
+    
+    yield _sse("done", {
+        "user_id": report["user_id"],
+        "report_period": report["report_period"],
+        "data_summary": report["data_summary"]
+    })
+
+@router.get("/{user_id}/stream", response_description="Stream a generated report for a user")
+async def stream_report(
+    request: Request,
+    user_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    report_format: str = "summary"
+):
+    """
+    Same report as GET /{user_id}, sent as Server-Sent Events while the model
+    writes it: `token` events carry text, the final `done` event carries
+    report_period and data_summary, and `error` ends a failed stream.
+    """
+    cache_key, report, messages = await _prepare_report(request.app.repositories, user_id, start_date, end_date, report_format)
+    client = _get_report_llm_client() if messages is not None else None
+    
+    return StreamingResponse(
+        _report_events(client, cache_key, report, messages),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/{user_id}/pdf", response_description="Generate PDF report for a user")
-def generate_pdf_report(
+async def generate_pdf_report(
     request: Request,
+    response: Response,
     user_id: str,
     start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None,
+    report_format: str = "detailed"
 ):
     """
     Generate a PDF report for the user's health data within the specified date range.
+    Pass the report_format of a report just viewed to reuse its cached text.
     """
-    # First get the report content using the existing endpoint
-    report_data = generate_report(request, user_id, start_date, end_date, report_format="detailed")
+    if not validate_object_id(user_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+    not_modified = await check_etag(request, response, user_id, *report_etag_extra(start_date, end_date))
+    if not_modified:
+        return not_modified
     
+    # First get the report content (cached when possible)
+    report_data = await build_report(request.app.repositories, user_id, start_date, end_date, report_format)
+    return await pdf_response(request, report_data, {
+        "ETag": response.headers["ETag"],
+        "Cache-Control": response.headers["Cache-Control"],
+    })
+
+async def pdf_response(request: Request, report_data: dict, headers: dict = None):
+    """Render (or fetch the cached) PDF of a report and send it"""
     try:
-        from fpdf import FPDF
-        
-        # Create PDF
-        pdf = FPDF()
-        pdf.add_page()
-        
-        # Set up the PDF
-        pdf.set_font("Arial", "B", 16)
-        pdf.cell(190, 10, "Health Report", ln=True, align="C")
-        
-        # Add period
-        pdf.set_font("Arial", "I", 12)
-        pdf.cell(190, 10, f"Period: {report_data['report_period']['start_date']} to {report_data['report_period']['end_date']}", ln=True)
-        
-        # Add report content
-        pdf.set_font("Arial", "", 12)
-        
-        # Split the report into lines to properly format in PDF
-        report_text = report_data["generated_report"]
-        pdf.multi_cell(190, 10, report_text)
-        
-        # Generate the PDF in memory
-        pdf_output = pdf.output(dest="S").encode("latin1")
-        
-        # Create a FastAPI response with the PDF
-        from fastapi.responses import Response
-        return Response(
-            content=pdf_output,
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename=health_report_{user_id}.pdf"
-            }
-        )
+        pdf_output = await request.app.pdf_renderer.render(report_data)
+    except PDFRendererBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except ImportError:
         # If FPDF is not installed
         raise HTTPException(status_code=500, detail="PDF generation library not available")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating PDF report: {str(e)}")
+    return pdf_file_response(pdf_output, f"health_report_{report_data['user_id']}.pdf", headers)
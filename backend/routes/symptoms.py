@@ -1,69 +1,172 @@
-from fastapi import APIRouter, HTTPException, Body, Query, Path, Request
-from typing import List
+from fastapi import APIRouter, HTTPException, Body, Query, Path, Request, Response
+from pydantic import ValidationError
+from typing import List, Optional, Dict, Any
 from datetime import datetime, timezone, timedelta
 from bson import ObjectId
+import os
 
 # Use relative imports for local modules
-from models import SymptomModel, SymptomCreate
-from utils import validate_object_id
+from models import SymptomModel, SymptomCreate, SymptomBulkItem
+from utils import validate_object_id, bson_datetime
+from pagination import set_next_page
+from etags import check_etag
+from bson_json import bson_json_response
+from report_cache import invalidate_user_reports
+from logs import get_logger, log_event
 
 router = APIRouter()
+logger = get_logger("symptoms")
+
+# Largest batch POST /bulk accepts
+BULK_MAX_ITEMS = int(os.getenv("SYMPTOM_BULK_MAX_ITEMS", 500))
+# Device clocks may run this far ahead of the server's
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+def _stored_timestamp(value: datetime = None):
+    """Timestamp as symptoms are stored (UTC+4); naive client times are taken as UTC"""
+    if value is None:
+        value = datetime.now(timezone.utc)
+    elif value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return bson_datetime(value.astimezone(timezone.utc) + timedelta(hours=4))
 
 @router.post("", response_description="Add new symptom")
-def create_symptom(request: Request, user_id: str, symptom: SymptomCreate = Body(...)):
+async def create_symptom(request: Request, user_id: str, symptom: SymptomCreate = Body(...)):
     """Add a new symptom for a specific user"""
     if not validate_object_id(user_id):
-        print("user id validation failed")
+        log_event(logger, "symptom_rejected", sampled=True, reason="invalid_user_id")
         raise HTTPException(status_code=400, detail="Invalid user ID")
     
-    print(symptom)
     symptom_data = symptom.dict()
     symptom_data["user_id"] = user_id
     utc_now = datetime.now(timezone.utc)
     gst_now = utc_now + timedelta(hours=4)
-    symptom_data["timestamp"] = gst_now
-    print(user_id)
+    # Stored as Mongo would hand it back, so the inserted dict is the response
+    symptom_data["timestamp"] = bson_datetime(gst_now)
     
-    symptoms_collection = request.app.database.get_collection("symptoms")
-    new_symptom = symptoms_collection.insert_one(symptom_data)
-    created_symptom = symptoms_collection.find_one({"_id": new_symptom.inserted_id})
+    new_symptom_id = await request.app.repositories.symptoms.create(symptom_data)
+    invalidate_user_reports(user_id)
+    # Ids and severity only: names and details are health data
+    log_event(logger, "symptom_created", sampled=True, user_id=user_id, symptom_id=new_symptom_id, severity=symptom_data.get("severity"))
     
     # Convert ObjectId to string for the response
-    created_symptom["_id"] = str(created_symptom["_id"])
+    symptom_data["_id"] = str(new_symptom_id)
     
-    return created_symptom
+    return symptom_data
+
+@router.post("/bulk", response_description="Add many symptoms at once")
+async def create_symptoms_bulk(request: Request, user_id: str, symptoms: List[Dict[str, Any]] = Body(...)):
+    """
+    Add up to SYMPTOM_BULK_MAX_ITEMS symptoms recorded offline, in one write.
+    Each item is a symptom plus an optional `timestamp` (when it was recorded)
+    and `client_id`; an item whose client_id was already stored is reported as
+    a duplicate, so a client can safely resend a batch. Every item gets a
+    result: created (with its _id), duplicate, invalid or error.
+    """
+    if not validate_object_id(user_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+    if len(symptoms) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ITEMS} symptoms per request")
+    
+    results = [None] * len(symptoms)
+    documents, positions = [], []
+    latest_allowed = _stored_timestamp() + MAX_CLOCK_SKEW
+    for index, item in enumerate(symptoms):
+        try:
+            symptom = SymptomBulkItem.model_validate(item)
+        except ValidationError as e:
+            error = "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors())
+            results[index] = {"index": index, "status": "invalid", "error": error}
+            continue
+        
+        timestamp = _stored_timestamp(symptom.timestamp)
+        if timestamp > latest_allowed:
+            results[index] = {"index": index, "status": "invalid", "error": "timestamp: is in the future"}
+            continue
+        
+        document = {"name": symptom.name, "details": symptom.details, "severity": symptom.severity,
+                    "user_id": user_id, "timestamp": timestamp}
+        if symptom.client_id is not None:
+            document["client_id"] = symptom.client_id
+        documents.append(document)
+        positions.append(index)
+    
+    # One unordered insert: a duplicate or failed item does not stop the rest
+    errors = await request.app.repositories.symptoms.create_many(documents) if documents else {}
+    
+    created = 0
+    for position, (index, document) in enumerate(zip(positions, documents)):
+        error = errors.get(position)
+        if error is None:
+            created += 1
+            results[index] = {"index": index, "status": "created", "_id": str(document["_id"]), "timestamp": document["timestamp"]}
+        elif error["code"] == 11000:
+            results[index] = {"index": index, "status": "duplicate", "client_id": document.get("client_id")}
+        else:
+            results[index] = {"index": index, "status": "error", "error": error["message"]}
+    
+    if created:
+        invalidate_user_reports(user_id)
+    
+    return {"created": created, "results": results}
+
+@router.get("/{user_id}/search", response_description="Search a user's symptoms")
+async def search_symptoms(
+    request: Request,
+    response: Response,
+    user_id: str,
+    q: str = Query(..., min_length=1, max_length=200),
+    start_date: datetime = None,
+    end_date: datetime = None,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None
+):
+    """
+    Full-text search over a user's symptom names and details, best match
+    first (a match in the name counts more than one in the details). Each
+    result carries its relevance `score`; continue with the `cursor` from the
+    Link / X-Next-Cursor header.
+    """
+    if not validate_object_id(user_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query is empty")
+    not_modified = await check_etag(request, response, user_id)
+    if not_modified:
+        return not_modified
+    
+    symptoms, next_cursor = await request.app.repositories.symptoms.search(
+        user_id, q, start_date, end_date, limit, cursor
+    )
+    set_next_page(request, response, next_cursor)
+    
+    return bson_json_response(symptoms, response)
 
 @router.get("/{user_id}", response_description="List all symptoms for a user")
-def list_symptoms(
+async def list_symptoms(
     request: Request,
+    response: Response,
     user_id: str,
     skip: int = 0,
     limit: int = 100,
     start_date: datetime = None,
-    end_date: datetime = None
+    end_date: datetime = None,
+    cursor: Optional[str] = None
 ):
-    """Get all symptoms for a specific user with optional date filtering"""
+    """
+    Get all symptoms for a specific user with optional date filtering, newest first.
+    Pass the `cursor` from the previous page's Link / X-Next-Cursor header to
+    continue; skip/limit still work for older clients.
+    """
     if not validate_object_id(user_id):
         raise HTTPException(status_code=400, detail="Invalid user ID")
+    not_modified = await check_etag(request, response, user_id)
+    if not_modified:
+        return not_modified
     
-    query = {"user_id": user_id}
-    
-    # Add date range filtering if provided
-    if start_date or end_date:
-        date_filter = {}
-        if start_date:
-            date_filter["$gte"] = start_date
-        if end_date:
-            date_filter["$lte"] = end_date
-        
-        if date_filter:
-            query["timestamp"] = date_filter
-    
-    symptoms_collection = request.app.database.get_collection("symptoms")
-    symptoms = list(symptoms_collection.find(query).skip(skip).limit(limit))
-    
-    # Convert ObjectId to string for each symptom
-    for symptom in symptoms:
-        symptom["_id"] = str(symptom["_id"])
+    symptoms, next_cursor = await request.app.repositories.symptoms.list(
+        user_id, start_date, end_date, limit, skip, cursor
+    )
+    set_next_page(request, response, next_cursor)
     
-    return symptoms
+    return bson_json_response(symptoms, response)
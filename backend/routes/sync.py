@@ -0,0 +1,78 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from typing import Optional
+from datetime import datetime, timezone, timedelta
+
+from utils import validate_object_id, bson_datetime
+from bson_json import bson_json_response
+from sync_tokens import (
+    SETTLE_SECONDS, caught_up, new_snapshot, snapshot_finished, encode_token, decode_token, expired,
+)
+
+router = APIRouter()
+
+@router.get("/{user_id}", response_description="Symptoms and medications changed since the last sync")
+async def sync(
+    request: Request,
+    user_id: str,
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=1000)
+):
+    """
+    Changes to a user's symptoms and medications since `since`, the
+    `sync_token` of the previous response. Without a token (or with one too
+    old to bring up to date) the first response has `reset` set and starts a
+    full snapshot: the client should drop its local copy first. Created and
+    updated documents come back whole, deleted ones as ids under `deleted`.
+    While `has_more` is set, call again straight away with the new token.
+    """
+    if not validate_object_id(user_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+
+    repositories = request.app.repositories
+    now = bson_datetime(datetime.now(timezone.utc))
+    upper = now - timedelta(seconds=SETTLE_SECONDS)
+
+    state = decode_token(since) if since else None
+    if state is not None and state["mode"] == "delta" and expired(state, now):
+        state = None
+    reset = state is None
+    if state is None:
+        state = new_snapshot(upper)
+
+    result = {"reset": reset, "symptoms": [], "medications": [], "deleted": {"medications": []}}
+    has_more = False
+    positions = state["positions"]
+
+    if state["mode"] == "snapshot":
+        # Everything that exists now, in each list's usual order
+        if "symptoms" not in state["done"]:
+            result["symptoms"], positions["symptoms"] = await repositories.symptoms.list(
+                user_id, limit=limit, cursor=positions["symptoms"]
+            )
+        if "medications" not in state["done"]:
+            result["medications"], positions["medications"] = await repositories.medications.list(
+                user_id, limit=limit, cursor=positions["medications"]
+            )
+        state["done"] = [kind for kind, position in positions.items() if position is None]
+        has_more = len(state["done"]) < len(positions)
+        if not has_more:
+            # Changes made while the snapshot was read come in the next delta
+            state = snapshot_finished(state["upper"])
+    else:
+        readers = {
+            "symptoms": repositories.symptoms.changes,
+            "medications": repositories.medications.changes,
+            "deleted": repositories.medications.deleted,
+        }
+        changes = {}
+        for kind, read in readers.items():
+            changes[kind], cursor = await read(user_id, upper, limit, positions[kind])
+            positions[kind] = cursor or caught_up(upper)
+            has_more = has_more or cursor is not None
+        result["symptoms"] = changes["symptoms"]
+        result["medications"] = changes["medications"]
+        result["deleted"]["medications"] = [str(tombstone["document_id"]) for tombstone in changes["deleted"]]
+
+    result["has_more"] = has_more
+    result["sync_token"] = encode_token(state)
+    return bson_json_response(result)
@@ -1,57 +1,88 @@
-from fastapi import APIRouter, HTTPException, Body, Request
+from fastapi import APIRouter, HTTPException, Body, Depends, Request, Response, status
+from typing import Optional
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
 
-from models import UserModel, UserCreate
-from utils import validate_object_id
+from models import UserModel, UserCreate, UserUpdate
+from utils import validate_object_id, bson_datetime
+from pagination import set_next_page
+from etags import check_etag
+from bson_json import bson_json_response
+from auth_cache import invalidate_user
+from routes.auth import get_current_user
 
 router = APIRouter()
 
 @router.post("/", response_description="Create new user")
-def create_user(request: Request, user: UserCreate = Body(...)):
+async def create_user(request: Request, user: UserCreate = Body(...)):
     """Create a new user"""
     user_data = user.dict()
-    user_data["created_at"] = datetime.now()
+    user_data["created_at"] = bson_datetime(datetime.now())
     
-    # Check if user with this email already exists
-    if request.app.database.get_collection("users").find_one({"email": user_data["email"]}):
+    # Check if user with this email already exists (the unique index may be
+    # missing on a database that already holds duplicates)
+    if await request.app.repositories.users.get_by_email(user_data["email"]):
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    # Insert user into database
-    users_collection = request.app.database.get_collection("users")
-    new_user = users_collection.insert_one(user_data)
-    created_user = users_collection.find_one({"_id": new_user.inserted_id})
+    # Insert user into database; the unique indexes catch what the check above can race past
+    try:
+        new_user_id = await request.app.repositories.users.create(user_data)
+    except DuplicateKeyError as e:
+        field = "Username" if "username" in (e.details or {}).get("keyPattern", {}) else "Email"
+        raise HTTPException(status_code=400, detail=f"{field} already registered")
     
     # Convert ObjectId to string for the response
-    created_user["_id"] = str(created_user["_id"])
+    user_data["_id"] = str(new_user_id)
     
-    return created_user
+    return user_data
 
 @router.get("/{user_id}", response_description="Get a user by ID")
-def get_user(request: Request, user_id: str):
+async def get_user(request: Request, response: Response, user_id: str):
     """Get a user by their ID"""
     if not validate_object_id(user_id):
         raise HTTPException(status_code=400, detail="Invalid user ID")
     
-    users_collection = request.app.database.get_collection("users")
-    user = users_collection.find_one({"_id": ObjectId(user_id)})
+    user = await request.app.repositories.users.get(ObjectId(user_id))
     
     if not user:
         raise HTTPException(status_code=404, detail=f"User with ID {user_id} not found")
     
-    # Convert ObjectId to string
-    user["_id"] = str(user["_id"])
+    # Only an existing user can be "not modified"
+    not_modified = await check_etag(request, response, user_id)
+    if not_modified:
+        return not_modified
     
-    return user
+    return bson_json_response(user, response)
+
+@router.patch("/{user_id}", response_description="Update or disable a user")
+async def update_user(request: Request, user_id: str, user: UserUpdate = Body(...), current_user = Depends(get_current_user)):
+    """Change the signed-in user's email or disable their account"""
+    if not validate_object_id(user_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+    # There are no admin accounts: users may only change themselves
+    if user_id != current_user["_id"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to modify another user")
+
+    update_data = {k: v for k, v in user.dict().items() if v is not None}
+    if not update_data:
+        raise HTTPException(status_code=400, detail="No fields to update")
+
+    try:
+        updated_user = await request.app.repositories.users.update(ObjectId(user_id), update_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    if not updated_user:
+        raise HTTPException(status_code=404, detail=f"User with ID {user_id} not found")
+    # Authenticated requests must see the change (or the disabling) straight away
+    invalidate_user(updated_user["username"])
+
+    return bson_json_response(updated_user)
 
 @router.get("/", response_description="List all users")
-def list_users(request: Request, skip: int = 0, limit: int = 100):
-    """Get a list of all users"""
-    users_collection = request.app.database.get_collection("users")
-    users = list(users_collection.find().skip(skip).limit(limit))
-    
-    # Convert ObjectId to string for each user
-    for user in users:
-        user["_id"] = str(user["_id"])
+async def list_users(request: Request, response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    """Get a list of all users, paginated by skip/limit or by cursor"""
+    users, next_cursor = await request.app.repositories.users.list(limit, skip, cursor)
+    set_next_page(request, response, next_cursor)
     
-    return users
+    return bson_json_response(users, response)
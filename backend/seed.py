@@ -0,0 +1,279 @@
+"""
+Synthetic data for benchmarks and load tests.
+
+Generates users, symptom streams and medication schedules shaped like the
+documents the API writes, and inserts them straight into MongoDB with batched
+unordered insert_many calls from several worker processes:
+
+    python seed.py --users 100000 --days 730 --processes 8
+    python seed.py --users 1000 --drop          # empty the collections first
+
+Every user is generated from (--seed, user number) alone, so the same seed,
+--days and --end-date produce exactly the same documents (ids included),
+however the work is split across processes. Each user has:
+- a symptom rate;
+- a few recurring symptoms whose severity drifts (a slow trend plus a random
+  walk, with noise on each entry);
+- a few medications, with adherence counts to match.
+
+Daily rollups are written with the symptoms, so reports work on seeded data
+without `rollups.py --rebuild`. Every seeded user can log in with
+--password.
+"""
+import argparse
+import asyncio
+import math
+import multiprocessing
+import os
+import random
+import struct
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+
+from passwords import BCRYPT_ROUNDS
+from rollups import ROLLUPS_COLLECTION, symptom_day
+from utils import bson_datetime
+
+load_dotenv()
+
+MONGODB_URI = os.getenv("MONGODB_URI")
+DATABASE_NAME = os.getenv("DATABASE_NAME")
+
+SEEDED_COLLECTIONS = ("users", "symptoms", "medications", ROLLUPS_COLLECTION, "data_versions", "deletions")
+# Users handed to a worker at a time
+CHUNK_USERS = 100
+
+# Recurring symptoms and how common each is
+SYMPTOMS = (
+    ("Headache", 10), ("Fatigue", 9), ("Back pain", 7), ("Cough", 6), ("Insomnia", 6), ("Nausea", 4),
+    ("Dizziness", 4), ("Joint pain", 4), ("Heartburn", 3), ("Migraine", 3), ("Anxiety", 3), ("Shortness of breath", 2),
+)
+DETAILS = (
+    "Started in the morning", "Worse after work", "Eased after resting", "Woke up with it", "Came on suddenly",
+    "Mild, manageable", "Kept me from sleeping", "Better after medication", "Lasted most of the day", "",
+)
+# (name, doses per day)
+MEDICATIONS = (
+    ("Ibuprofen", 3), ("Paracetamol", 4), ("Vitamin D", 1), ("Metformin", 2), ("Lisinopril", 1),
+    ("Atorvastatin", 1), ("Omeprazole", 1), ("Loratadine", 1), ("Sertraline", 1), ("Amoxicillin", 3),
+)
+DOSE_TIMES = {1: ["08:00"], 2: ["08:00", "20:00"], 3: ["08:00", "14:00", "20:00"], 4: ["08:00", "12:00", "16:00", "20:00"]}
+
+def seeded_object_id(rng: random.Random, at: datetime) -> ObjectId:
+    """ObjectId with `at` as its timestamp and the rest drawn from `rng` (so ids are reproducible)"""
+    seconds = int(at.replace(tzinfo=timezone.utc).timestamp())
+    return ObjectId(struct.pack(">I", seconds) + rng.getrandbits(64).to_bytes(8, "big"))
+
+def _poisson(rng: random.Random, mean: float) -> int:
+    # Knuth's method; means here are small
+    limit, count, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+def generate_user(seed: int, number: int, days: int, end: datetime, hashed_password: str):
+    """
+    One user and their documents: (user, symptoms, medications, rollups).
+    `end` is naive UTC; symptom timestamps are stored UTC+4 like the API's.
+    """
+    rng = random.Random(f"{seed}:{number}")
+    start = end - timedelta(days=days)
+    username = f"seed{seed}_user{number}"
+    joined = start - timedelta(days=rng.randint(0, 60), seconds=rng.randint(0, 86399))
+    user = {
+        "_id": seeded_object_id(rng, joined),
+        "username": username,
+        "email": f"{username}@example.com",
+        "unique_id_from_auth": f"seed-{seed}-{number}",
+        "hashed_password": hashed_password,
+        "disabled": False,
+        "created_at": bson_datetime(joined),
+    }
+    user_id = str(user["_id"])
+
+    # Some people log a symptom every few weeks, some several times a day
+    rate = rng.gammavariate(1.5, 0.6)
+    names = [name for name, _ in SYMPTOMS]
+    weights = [weight for _, weight in SYMPTOMS]
+    tracked = []
+    for name in dict.fromkeys(rng.choices(names, weights, k=rng.randint(1, 4))):
+        tracked.append({
+            "name": name,
+            "share": rng.random() + 0.2,
+            "level": rng.uniform(2, 7),
+            # Severity per day: a slow trend (getting better or worse) plus a random walk
+            "trend": rng.gauss(0, 0.01),
+            "volatility": rng.uniform(0.05, 0.3),
+        })
+
+    symptoms = []
+    for day in range(days):
+        for condition in tracked:
+            condition["level"] = min(10.0, max(1.0, condition["level"] + condition["trend"] + rng.gauss(0, condition["volatility"])))
+        for _ in range(_poisson(rng, rate)):
+            condition = rng.choices(tracked, [condition["share"] for condition in tracked])[0]
+            recorded = start + timedelta(days=day, seconds=rng.randint(6 * 3600, 23 * 3600))
+            symptoms.append({
+                "_id": seeded_object_id(rng, recorded),
+                "name": condition["name"],
+                "details": rng.choice(DETAILS),
+                "severity": min(10, max(1, round(condition["level"] + rng.gauss(0, 1)))),
+                "user_id": user_id,
+                "timestamp": bson_datetime(recorded + timedelta(hours=4)),
+                "modified_at": bson_datetime(recorded),
+            })
+
+    medications = []
+    for name, frequency in rng.sample(MEDICATIONS, rng.randint(0, 3)):
+        prescribed = start + timedelta(days=rng.randint(0, max(0, days - 1)), seconds=rng.randint(0, 86399))
+        taken_days = (end - prescribed).days
+        prescribed_gst = bson_datetime(prescribed + timedelta(hours=4))
+        medications.append({
+            "_id": seeded_object_id(rng, prescribed),
+            "name": name,
+            "frequency": frequency,
+            "times": DOSE_TIMES[frequency],
+            "user_id": user_id,
+            "adherence": round(taken_days * frequency * rng.betavariate(8, 2)),
+            "created_at": prescribed_gst,
+            "updated_at": prescribed_gst,
+            "modified_at": bson_datetime(prescribed),
+        })
+
+    cells = {}
+    for symptom in symptoms:
+        cell = cells.setdefault((symptom_day(symptom["timestamp"]), symptom["name"]), {"count": 0, "sum": 0, "max": 0})
+        cell["count"] += 1
+        cell["sum"] += symptom["severity"]
+        cell["max"] = max(cell["max"], symptom["severity"])
+    rollups = [{"user_id": user_id, "day": day, "name": name, **cell} for (day, name), cell in cells.items()]
+
+    return user, symptoms, medications, rollups
+
+class BatchWriter:
+    """Buffers documents per collection and writes them with unordered insert_many"""
+
+    def __init__(self, database, batch_size: int):
+        self.database = database
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.written = {}
+        self.duplicates = 0
+
+    def add(self, collection: str, documents):
+        buffer = self.buffers.setdefault(collection, [])
+        buffer.extend(documents)
+        if len(buffer) >= self.batch_size:
+            self.flush(collection)
+
+    def flush(self, collection: str = None):
+        for name in [collection] if collection else list(self.buffers):
+            documents = self.buffers.pop(name, [])
+            if not documents:
+                continue
+            written = len(documents)
+            if self.database is not None:
+                try:
+                    self.database[name].insert_many(documents, ordered=False)
+                except BulkWriteError as e:
+                    # Already seeded (same seed, no --drop): keep what is new
+                    written = e.details["nInserted"]
+                    self.duplicates += len(documents) - written
+            self.written[name] = self.written.get(name, 0) + written
+
+_worker = {}
+
+def _init_worker(uri, database_name, batch_size, hashed_password):
+    client = MongoClient(uri) if uri else None
+    _worker["writer_args"] = (client[database_name] if client else None, batch_size)
+    _worker["hashed_password"] = hashed_password
+
+def seed_users(numbers, seed: int, days: int, end: datetime):
+    """Generate and insert users `numbers` (in a worker); counts written per collection"""
+    writer = BatchWriter(*_worker["writer_args"])
+    for number in numbers:
+        user, symptoms, medications, rollups = generate_user(seed, number, days, end, _worker["hashed_password"])
+        writer.add("users", [user])
+        writer.add("symptoms", symptoms)
+        writer.add("medications", medications)
+        writer.add(ROLLUPS_COLLECTION, rollups)
+    writer.flush()
+    return writer.written, writer.duplicates
+
+def _seed_chunk(job):
+    return seed_users(*job)
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed MongoDB with deterministic synthetic users, symptoms and medications")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=365, help="days of history per user")
+    parser.add_argument("--end-date", type=lambda value: datetime.strptime(value, "%Y-%m-%d"),
+                        default=datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0),
+                        help="last day of history, YYYY-MM-DD (default: today)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--first-user", type=int, default=0, help="number of the first user (to extend a population)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=5000, help="documents per insert_many")
+    parser.add_argument("--password", default="seed-password", help="password of every seeded user")
+    parser.add_argument("--drop", action="store_true", help=f"empty {', '.join(SEEDED_COLLECTIONS)} first")
+    parser.add_argument("--dry-run", action="store_true", help="generate without writing, to measure generation alone")
+    args = parser.parse_args()
+
+    if not args.dry_run:
+        client = MongoClient(MONGODB_URI)
+        database = client[DATABASE_NAME]
+        if args.drop:
+            for name in SEEDED_COLLECTIONS:
+                database[name].delete_many({})
+        # Indexes first: unique usernames, and the queries benchmarks run against
+        from database import create_client
+        from indexes import ensure_indexes
+
+        async def create_indexes():
+            async_client = create_client()
+            try:
+                await ensure_indexes(async_client[DATABASE_NAME])
+            finally:
+                await async_client.close()
+        asyncio.run(create_indexes())
+        client.close()
+
+    # One hash for everyone: bcrypt per user would dominate the run
+    hashed_password = CryptContext(schemes=["bcrypt"], bcrypt__rounds=BCRYPT_ROUNDS).hash(args.password)
+    numbers = range(args.first_user, args.first_user + args.users)
+    chunks = [numbers[i:i + CHUNK_USERS] for i in range(0, len(numbers), CHUNK_USERS)]
+
+    print(f"Seeding {args.users} users x {args.days} days (seed {args.seed}, end date {args.end_date:%Y-%m-%d}) "
+          f"with {args.processes} processes{' (dry run)' if args.dry_run else ''}")
+    totals, duplicates, done = {}, 0, 0
+    started = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(args.processes, _init_worker,
+                      (None if args.dry_run else MONGODB_URI, DATABASE_NAME, args.batch_size, hashed_password)) as pool:
+        jobs = pool.imap_unordered(_seed_chunk, [(chunk, args.seed, args.days, args.end_date) for chunk in chunks])
+        for written, chunk_duplicates in jobs:
+            for name, count in written.items():
+                totals[name] = totals.get(name, 0) + count
+            duplicates += chunk_duplicates
+            done += 1
+            elapsed = time.perf_counter() - started
+            if done % max(1, len(chunks) // 20) == 0 or done == len(chunks):
+                documents = sum(totals.values())
+                print(f"  {totals.get('users', 0):>9} users  {documents:>12} documents  "
+                      f"{documents / elapsed:>10.0f} docs/s  {elapsed:>7.1f} s")
+
+    elapsed = time.perf_counter() - started
+    print(", ".join(f"{name}: {count}" for name, count in totals.items()))
+    if duplicates:
+        print(f"{duplicates} documents were already there and were skipped")
+    print(f"{sum(totals.values())} documents in {elapsed:.1f} s ({sum(totals.values()) / elapsed:.0f} docs/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Compact symptom summary for report prompts.
+
+Per symptom name: count, mean and max severity and a least-squares severity
+trend, plus per-day buckets. Both are computed from (day, name) cells read
+from the daily rollups, with raw symptoms aggregated server side only for
+the partial days at the ends of the range, so the work and the prompt size
+follow the number of days and distinct symptoms rather than the number of
+entries.
+"""
+from datetime import datetime
+
+from rollups import DAY_FORMAT
+
+# Severity change per week beyond which a trend is reported as rising/falling
+TREND_THRESHOLD = 0.5
+
+def _trend(stats):
+    """Least-squares slope of severity over time, in severity points per week"""
+    n = stats["count"]
+    denominator = n * stats["sum_xx"] - stats["sum_x"] ** 2
+    if n < 2 or denominator <= 0:
+        return None
+    slope = (n * stats["sum_xy"] - stats["sum_x"] * stats["sum"]) / denominator
+    return round(slope * 7, 2)
+
+async def summarize_symptoms(symptoms, user_id: str, start: datetime, end: datetime, use_rollups: bool = True):
+    """Per-name and per-day severity statistics for a user's symptoms in [start, end], from the symptoms repository"""
+    cells = await symptoms.daily_cells(user_id, start, end, use_rollups)
+
+    by_name, daily = {}, {}
+    for (day, name), cell in sorted(cells.items()):
+        # x: whole days since the start of the range
+        x = (datetime.strptime(day, DAY_FORMAT).date() - start.date()).days
+        stats = by_name.setdefault(name, {
+            "count": 0, "sum": 0, "max": cell["max"], "first_seen": day,
+            "sum_x": 0, "sum_xy": 0, "sum_xx": 0,
+        })
+        stats["count"] += cell["count"]
+        stats["sum"] += cell["sum"]
+        stats["max"] = max(stats["max"], cell["max"])
+        stats["last_seen"] = day
+        stats["sum_x"] += cell["count"] * x
+        stats["sum_xy"] += cell["sum"] * x
+        stats["sum_xx"] += cell["count"] * x * x
+
+        bucket = daily.setdefault(day, {"count": 0, "sum": 0, "max": cell["max"]})
+        bucket["count"] += cell["count"]
+        bucket["sum"] += cell["sum"]
+        bucket["max"] = max(bucket["max"], cell["max"])
+
+    symptoms = []
+    for name, stats in sorted(by_name.items(), key=lambda item: (-item[1]["count"], item[0])):
+        trend = _trend(stats)
+        if trend is None:
+            direction = "insufficient data"
+        elif trend >= TREND_THRESHOLD:
+            direction = "rising"
+        elif trend <= -TREND_THRESHOLD:
+            direction = "falling"
+        else:
+            direction = "stable"
+        symptoms.append({
+            "name": name,
+            "count": stats["count"],
+            "mean_severity": round(stats["sum"] / stats["count"], 1),
+            "max_severity": stats["max"],
+            "trend_per_week": trend,
+            "trend": direction,
+            "first_seen": stats["first_seen"],
+            "last_seen": stats["last_seen"],
+        })
+
+    daily = [
+        {"day": day, "count": bucket["count"], "mean_severity": round(bucket["sum"] / bucket["count"], 1), "max_severity": bucket["max"]}
+        for day, bucket in sorted(daily.items())
+    ]
+    return {"total": sum(s["count"] for s in symptoms), "symptoms": symptoms, "daily": daily}
@@ -0,0 +1,81 @@
+"""
+Sync tokens for GET /api/sync/{user_id}.
+
+A token is the opaque, URL-safe encoding of where a client's last sync
+stopped: for each kind of change (symptoms, medications, deletions) the
+pagination cursor of the last change it received, in (modified_at, _id)
+order. While a client is still downloading its first full snapshot the
+token instead holds the snapshot's start time and its position in each list.
+
+Changes are only handed out once they are SETTLE_SECONDS old, so a write
+stamped before a sync but committed just after it is not skipped. Tombstones
+expire after TOMBSTONE_TTL_SECONDS; a token older than that can no longer be
+brought up to date and the client gets a fresh snapshot instead.
+"""
+import base64
+import binascii
+import os
+from datetime import datetime, timedelta
+
+from bson import json_util
+from bson.errors import BSONError
+from fastapi import HTTPException
+
+from pagination import encode_cursor, decode_cursor
+from repositories import SYNC_SORT, MAX_OBJECT_ID
+
+SETTLE_SECONDS = float(os.getenv("SYNC_SETTLE_SECONDS", 2))
+TOMBSTONE_TTL_SECONDS = int(os.getenv("SYNC_TOMBSTONE_TTL_DAYS", 30)) * 24 * 3600
+
+# Change lists a delta token tracks a position in
+DELTA_KINDS = ("symptoms", "medications", "deleted")
+# Lists a full snapshot pages through
+SNAPSHOT_KINDS = ("symptoms", "medications")
+
+def caught_up(upper: datetime):
+    """Delta position past every change made up to `upper`"""
+    return encode_cursor({"modified_at": upper, "_id": MAX_OBJECT_ID}, SYNC_SORT)
+
+def position_time(position: str) -> datetime:
+    """modified_at of the last change a delta position has passed"""
+    return decode_cursor(position, SYNC_SORT)[0]
+
+def new_snapshot(upper: datetime):
+    """State of a full snapshot starting now; each kind's cursor is None until its first page"""
+    return {"mode": "snapshot", "upper": upper, "positions": {kind: None for kind in SNAPSHOT_KINDS}, "done": []}
+
+def snapshot_finished(upper: datetime):
+    """Delta state right after a snapshot taken at `upper`"""
+    return {"mode": "delta", "positions": {kind: caught_up(upper) for kind in DELTA_KINDS}}
+
+def encode_token(state: dict) -> str:
+    return base64.urlsafe_b64encode(json_util.dumps(state).encode()).decode().rstrip("=")
+
+def decode_token(token: str) -> dict:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        state = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, ValueError, TypeError, BSONError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+    valid = isinstance(state, dict) and isinstance(state.get("positions"), dict)
+    if valid and state.get("mode") == "delta":
+        valid = all(isinstance(state["positions"].get(kind), str) for kind in DELTA_KINDS)
+    elif valid and state.get("mode") == "snapshot":
+        valid = isinstance(state.get("upper"), datetime) and isinstance(state.get("done"), list) and all(
+            isinstance(state["positions"].get(kind, 0), (str, type(None))) and kind in state["positions"]
+            for kind in SNAPSHOT_KINDS
+        )
+    else:
+        valid = False
+    if not valid:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    return state
+
+def expired(state: dict, now: datetime) -> bool:
+    """True if tombstones this delta token still needs may already be gone"""
+    try:
+        deleted_up_to = position_time(state["positions"]["deleted"])
+    except HTTPException:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    return deleted_up_to < now - timedelta(seconds=TOMBSTONE_TTL_SECONDS)
@@ -8,7 +8,41 @@ from unittest.mock import patch
 from main import app
 from datetime import datetime, timedelta, timezone
 import dotenv
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock, ANY
+from database import get_client_options
+from llm import reset_llm_client, get_llm_client, LLMClient, LLMUnavailableError
+from report_jobs import ReportJobQueue
+from memory_repositories import MemoryRepositories
+from symptom_summary import summarize_symptoms
+from rollups import rebuild_rollups
+from prompt_builder import build_medication_section, build_symptom_section, estimate_tokens
+import asyncio
+import time
+import json
+import groq
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from bson_json import dumps as bson_json_dumps
+from compression import CompressionMiddleware, brotli
+from passwords import password_hasher
+from pdf_renderer import PDFRenderer
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+from passlib.context import CryptContext
+from auth_cache import token_claims_cache, auth_user_cache
+from jose import jwt
+from contextlib import contextmanager
+from loop_monitor import LoopMonitor
+from types import SimpleNamespace
+import logging
+from prometheus_client import REGISTRY
+from metrics import CommandMetrics
+from logs import JSONFormatter, SamplingFilter
+from seed import generate_user, BatchWriter
+from models import SymptomCreate, MedicationCreate
 
 # Load environment variables from .env file
 dotenv.load_dotenv()
@@ -16,22 +50,50 @@ dotenv.load_dotenv()
 # ---- Setup database connection manually ----
 MONGODB_URI = os.getenv("MONGODB_URI")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
+# DATABASE_BACKEND=memory runs the suite on the in-process repositories: no
+# MongoDB needed, and separate test processes do not share data
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "mongo")
 
-print(f"\n[TEST] Using MongoDB URI: {MONGODB_URI}")
+print(f"\n[TEST] Using {'the in-memory backend' if DATABASE_BACKEND == 'memory' else f'MongoDB URI: {MONGODB_URI}'}")
 
-client_db = MongoClient(MONGODB_URI)
-test_db = client_db[DATABASE_NAME]
-app.database = test_db
+# The app talks to Mongo through the async client; a plain sync client is
+# enough for cleaning up between tests.
+test_db = None if DATABASE_BACKEND == "memory" else MongoClient(MONGODB_URI)[DATABASE_NAME]
+
+requires_mongo = pytest.mark.skipif(DATABASE_BACKEND == "memory", reason="needs MongoDB")
 # --------------------------------------------
 
 client = TestClient(app)
 
+# The async Mongo client is bound to the event loop it was first used on, so
+# keep one TestClient portal (and loop) open for the whole module.
+@pytest.fixture(scope="module", autouse=True)
+def app_lifespan():
+   with client:
+       yield
+
+# Each test patches the Groq SDK, so drop the shared LLM client between tests
+@pytest.fixture(autouse=True)
+def fresh_llm_client():
+   reset_llm_client()
+
+# Users are deleted behind the auth cache's back between tests
+@pytest.fixture(autouse=True)
+def fresh_auth_cache():
+   token_claims_cache.clear()
+   auth_user_cache.clear()
+
 # Optional DB cleanup before each test
 @pytest.fixture(autouse=True)
 def clear_test_data():
-   app.database["users"].delete_many({})
-   app.database["symptoms"].delete_many({})
-   app.database["medications"].delete_many({})
+   if DATABASE_BACKEND == "memory":
+      app.repositories.clear()
+      return
+   test_db["users"].delete_many({})
+   test_db["symptoms"].delete_many({})
+   test_db["medications"].delete_many({})
+   test_db["report_jobs"].delete_many({})
+   test_db["symptom_daily_rollups"].delete_many({})
 
 def test_root_endpoint():
    print("\n[TEST] Root Endpoint")
@@ -197,6 +259,66 @@ def test_list_symptoms_pagination():
     assert response.status_code == 200
     assert len(response.json()) == 5
 
+def test_list_symptoms_cursor_pagination():
+    print("\n[TEST] List Symptoms - Cursor Pagination")
+    user_res = client.post("/api/users/", json={
+        "username": "cursor_user",
+        "email": "cursor_user@example.com",
+        "unique_id_from_auth": "cursor_user_auth"
+    })
+    user_id = user_res.json()["_id"]
+
+    for i in range(10):
+        client.post(f"/api/symptoms/?user_id={user_id}", json={
+            "name": f"Test Symptom {i}",
+            "details": f"Test Details {i}",
+            "severity": 5
+        })
+
+    seen = []
+    response = client.get(f"/api/symptoms/{user_id}?limit=4")
+    while True:
+        assert response.status_code == 200
+        seen.extend(symptom["_id"] for symptom in response.json())
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if not next_cursor:
+            break
+        assert 'rel="next"' in response.headers["Link"]
+        response = client.get(f"/api/symptoms/{user_id}", params={"limit": 4, "cursor": next_cursor})
+
+    # Every symptom exactly once, newest first
+    assert len(seen) == 10
+    assert len(set(seen)) == 10
+    assert seen == [symptom["_id"] for symptom in client.get(f"/api/symptoms/{user_id}").json()]
+
+def test_list_medications_cursor_pagination():
+    print("\n[TEST] List Medications - Cursor Pagination")
+    user_res = client.post("/api/users/", json={
+        "username": "cursor_med_user",
+        "email": "cursor_med_user@example.com",
+        "unique_id_from_auth": "cursor_med_user_auth"
+    })
+    user_id = user_res.json()["_id"]
+
+    for i in range(3):
+        client.post(f"/api/medications/?user_id={user_id}", json={
+            "name": f"Medication {i}",
+            "frequency": 1,
+            "times": ["09:00"]
+        })
+
+    first = client.get(f"/api/medications/{user_id}?limit=2")
+    assert len(first.json()) == 2
+    second = client.get(f"/api/medications/{user_id}", params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]})
+    assert [m["name"] for m in second.json()] == ["Medication 2"]
+    assert "X-Next-Cursor" not in second.headers
+
+def test_list_symptoms_invalid_cursor():
+    print("\n[TEST] List Symptoms - Invalid Cursor")
+    response = client.get("/api/symptoms/507f1f77bcf86cd799439011?cursor=not-a-cursor")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
 def test_list_symptoms_invalid_date_format():
     print("\n[TEST] List Symptoms - Invalid Date Format")
     user_res = client.post("/api/users/", json={
@@ -210,11 +332,12 @@ def test_list_symptoms_invalid_date_format():
     response = client.get(f"/api/symptoms/{user_id}?start_date=invalid-date")
     assert response.status_code == 422
 
-@patch("routes.reports.Groq")
+@patch("llm.AsyncGroq")
 def test_generate_report(mock_groq):
    print("\n[TEST] Generate AI Report (Mocked)")
    # Setup fake Groq response
    mock_client = mock_groq.return_value
+   mock_client.chat.completions.create = AsyncMock()
    mock_client.chat.completions.create.return_value.choices = [
        type("Choice", (object,), {
            "message": type("Message", (object,), {
@@ -246,6 +369,869 @@ def test_generate_report(mock_groq):
    assert data["generated_report"] == "This is a mocked health report."
 
 
+@patch("llm.AsyncGroq")
+def test_generate_report_cached_until_data_changes(mock_groq):
+   print("\n[TEST] Generate Report - Cached Until Data Changes")
+   mock_client = mock_groq.return_value
+   mock_client.chat.completions.create = AsyncMock()
+   mock_client.chat.completions.create.return_value.choices = [
+       type("Choice", (object,), {
+           "message": type("Message", (object,), {
+               "content": "Cached health report."
+           })()
+       })()
+   ]
+
+   user_res = client.post("/api/users/", json={
+       "username": "cache_report_user",
+       "email": "cache_report_user@example.com",
+       "unique_id_from_auth": "cache_report_user_001"
+   })
+   user_id = user_res.json()["_id"]
+
+   client.post(f"/api/symptoms/?user_id={user_id}", json={
+       "name": "Headache",
+       "details": "Mild tension headache",
+       "severity": 5
+   })
+
+   params = {
+       "start_date": (datetime.now() - timedelta(days=30)).isoformat(),
+       "end_date": (datetime.now() + timedelta(days=1)).isoformat()
+   }
+   first = client.get(f"/api/reports/{user_id}", params=params)
+   second = client.get(f"/api/reports/{user_id}", params=params)
+   assert first.status_code == second.status_code == 200
+   assert first.json() == second.json()
+
+   # The PDF of the report just viewed reuses the cached text
+   pdf = client.get(f"/api/reports/{user_id}/pdf", params={**params, "report_format": "summary"})
+   assert pdf.status_code == 200
+   assert mock_client.chat.completions.create.call_count == 1
+
+   # New data invalidates the cached report
+   client.post(f"/api/symptoms/?user_id={user_id}", json={
+       "name": "Headache",
+       "details": "Worse in the evening",
+       "severity": 6
+   })
+   third = client.get(f"/api/reports/{user_id}", params=params)
+   assert third.json()["data_summary"]["symptoms_count"] == 2
+   assert mock_client.chat.completions.create.call_count == 2
+
+   stats = client.get("/health/report-cache").json()
+   assert stats["hits"] >= 2
+
+
+def _completion(content):
+   return type("Completion", (object,), {"choices": [
+       type("Choice", (object,), {
+           "message": type("Message", (object,), {"content": content})()
+       })()
+   ]})()
+
+
+@patch("llm.AsyncGroq")
+def test_llm_client_retries_transient_errors(mock_groq):
+   print("\n[TEST] LLM Client - Retries Transient Errors")
+   mock_groq.return_value.chat.completions.create = AsyncMock(side_effect=[
+       groq.APIConnectionError(request=MagicMock()),
+       _completion("Recovered report")
+   ])
+   llm_client = LLMClient("test", max_retries=2, backoff=0)
+
+   assert asyncio.run(llm_client.complete([{"role": "user", "content": "hi"}])) == "Recovered report"
+   assert mock_groq.return_value.chat.completions.create.await_count == 2
+   assert llm_client.breaker.state == "closed"
+
+
+@patch("llm.AsyncGroq")
+def test_llm_client_circuit_breaker_opens(mock_groq):
+   print("\n[TEST] LLM Client - Circuit Breaker Opens")
+   create = AsyncMock(side_effect=groq.APIConnectionError(request=MagicMock()))
+   mock_groq.return_value.chat.completions.create = create
+   llm_client = LLMClient("test", max_retries=0, breaker_threshold=2, breaker_reset_after=60, backoff=0)
+   messages = [{"role": "user", "content": "hi"}]
+
+   for _ in range(2):
+       with pytest.raises(groq.APIConnectionError):
+           asyncio.run(llm_client.complete(messages))
+
+   # Open circuit: fail fast without calling the provider
+   with pytest.raises(LLMUnavailableError):
+       asyncio.run(llm_client.complete(messages))
+   assert create.await_count == 2
+
+
+@patch("llm.AsyncGroq")
+def test_llm_client_coalesces_identical_requests(mock_groq):
+   print("\n[TEST] LLM Client - Singleflight")
+   async def slow_completion(**kwargs):
+       await asyncio.sleep(0.05)
+       return _completion("Shared report")
+   create = AsyncMock(side_effect=slow_completion)
+   mock_groq.return_value.chat.completions.create = create
+   llm_client = LLMClient("test")
+   messages = [{"role": "user", "content": "same prompt"}]
+
+   async def burst():
+       return await asyncio.gather(*(llm_client.complete(messages) for _ in range(5)))
+
+   assert asyncio.run(burst()) == ["Shared report"] * 5
+   assert create.await_count == 1
+
+
+@patch("llm.AsyncGroq")
+def test_llm_client_replaced_on_key_change_is_closed(mock_groq):
+   print("\n[TEST] LLM Client - A Replaced Client's Pool Is Closed Once Idle")
+   mock_groq.return_value.close = AsyncMock()
+
+   async def rotate_key():
+      old = get_llm_client("old-key")
+      old.in_flight = 1
+      new = get_llm_client("new-key")
+      assert new is not old and new.api_key == "new-key"
+      await asyncio.sleep(0.15)
+      # Still serving a call: left open
+      assert mock_groq.return_value.close.await_count == 0
+      old.in_flight = 0
+      await asyncio.sleep(0.15)
+      assert mock_groq.return_value.close.await_count == 1
+      assert get_llm_client("new-key") is new
+
+   asyncio.run(rotate_key())
+
+
+class FakeCompletionStream:
+   """Stands in for the SDK's streamed completion: yields one chunk per piece of text"""
+   def __init__(self, pieces):
+       self._pieces = iter(pieces)
+       self.closed = False
+
+   def __aiter__(self):
+       return self
+
+   async def __anext__(self):
+       try:
+           text = next(self._pieces)
+       except StopIteration:
+           raise StopAsyncIteration
+       delta = type("Delta", (object,), {"content": text})()
+       return type("Chunk", (object,), {"choices": [type("Choice", (object,), {"delta": delta})()]})()
+
+   async def close(self):
+       self.closed = True
+
+
+def _parse_sse(body):
+   events = []
+   for block in body.strip().split("\n\n"):
+       lines = dict(line.split(": ", 1) for line in block.splitlines())
+       events.append((lines["event"], json.loads(lines["data"])))
+   return events
+
+
+@patch("llm.AsyncGroq")
+def test_stream_report(mock_groq):
+   print("\n[TEST] Stream Report (Fake Streaming LLM)")
+   fake_stream = FakeCompletionStream(["### HEALTH SUMMARY\n", "Mostly ", "well."])
+   create = AsyncMock(return_value=fake_stream)
+   mock_groq.return_value.chat.completions.create = create
+
+   user_res = client.post("/api/users/", json={
+       "username": "stream_user",
+       "email": "stream_user@example.com",
+       "unique_id_from_auth": "stream_user_001"
+   })
+   user_id = user_res.json()["_id"]
+   client.post(f"/api/symptoms/?user_id={user_id}", json={
+       "name": "Cough",
+       "details": "Dry cough at night",
+       "severity": 4
+   })
+
+   params = {
+       "start_date": (datetime.now() - timedelta(days=30)).isoformat(),
+       "end_date": (datetime.now() + timedelta(days=1)).isoformat()
+   }
+   response = client.get(f"/api/reports/{user_id}/stream", params=params)
+   assert response.status_code == 200
+   assert response.headers["Content-Type"].startswith("text/event-stream")
+
+   events = _parse_sse(response.text)
+   assert [name for name, _ in events] == ["token", "token", "token", "done"]
+   assert "".join(data["text"] for name, data in events if name == "token") == "### HEALTH SUMMARY\nMostly well."
+   done = events[-1][1]
+   assert done["data_summary"] == {"symptoms_count": 1, "medications_count": 0}
+   assert "start_date" in done["report_period"]
+   assert fake_stream.closed
+
+   # The streamed report is cached for the regular endpoint
+   report = client.get(f"/api/reports/{user_id}", params=params)
+   assert report.json()["generated_report"] == "### HEALTH SUMMARY\nMostly well."
+   assert create.await_count == 1
+
+
+def test_stream_report_no_data():
+   print("\n[TEST] Stream Report - No Data (Expect 404)")
+   response = client.get("/api/reports/507f1f77bcf86cd799439011/stream")
+   assert response.status_code == 404
+
+
+def _insert_symptoms(symptoms):
+   """Store symptoms with chosen timestamps through the app's repository"""
+   async def insert():
+      for symptom in symptoms:
+         await app.repositories.symptoms.create(symptom)
+   client.portal.call(insert)
+
+
+def test_symptom_summary_aggregation():
+   print("\n[TEST] Symptom Summary - Per Name Stats, Trend and Daily Buckets")
+   user_id = "507f1f77bcf86cd799439011"
+   start = datetime(2026, 1, 1)
+   rows = [("Headache", 2, 0), ("Headache", 4, 7), ("Headache", 6, 14), ("Nausea", 5, 0), ("Nausea", 5, 14)]
+   _insert_symptoms([
+      {"user_id": user_id, "name": name, "details": "x", "severity": severity, "timestamp": start + timedelta(days=day, hours=9)}
+      for name, severity, day in rows
+   ])
+
+   symptoms = app.repositories.symptoms
+   summary = client.portal.call(summarize_symptoms, symptoms, user_id, start, start + timedelta(days=30))
+   assert summary == client.portal.call(summarize_symptoms, symptoms, user_id, start, start + timedelta(days=30), False)
+   assert summary["total"] == 5
+   headache, nausea = summary["symptoms"]
+   assert (headache["name"], headache["count"], headache["mean_severity"], headache["max_severity"]) == ("Headache", 3, 4.0, 6)
+   assert headache["trend_per_week"] == 2.0
+   assert headache["trend"] == "rising"
+   assert nausea["trend"] == "stable"
+   assert summary["daily"] == [
+      {"day": "2026-01-01", "count": 2, "mean_severity": 3.5, "max_severity": 5},
+      {"day": "2026-01-08", "count": 1, "mean_severity": 4.0, "max_severity": 4},
+      {"day": "2026-01-15", "count": 2, "mean_severity": 5.5, "max_severity": 6},
+   ]
+
+
+@requires_mongo
+def test_create_symptom_updates_daily_rollup():
+   print("\n[TEST] Daily Rollups - Maintained On Create, Rebuilt From Raw")
+   user_id = "507f1f77bcf86cd799439013"
+   for severity in (2, 7, 4):
+      client.post(f"/api/symptoms/?user_id={user_id}", json={"name": "Migraine", "details": "x", "severity": severity})
+   client.post(f"/api/symptoms/?user_id={user_id}", json={"name": "Nausea", "details": "x", "severity": 1})
+
+   rollup = test_db["symptom_daily_rollups"].find_one({"user_id": user_id, "name": "Migraine"})
+   assert (rollup["count"], rollup["sum"], rollup["max"]) == (3, 13, 7)
+   maintained = sorted((r["day"], r["name"], r["count"], r["sum"], r["max"])
+                       for r in test_db["symptom_daily_rollups"].find({"user_id": user_id}))
+
+   test_db["symptom_daily_rollups"].update_many({}, {"$set": {"count": 99}})
+   assert client.portal.call(rebuild_rollups, app.database, user_id) == 2
+   rebuilt = sorted((r["day"], r["name"], r["count"], r["sum"], r["max"])
+                    for r in test_db["symptom_daily_rollups"].find({"user_id": user_id}))
+   assert rebuilt == maintained
+
+
+def test_symptom_summary_mixes_rollups_and_partial_days():
+   print("\n[TEST] Symptom Summary - Partial Days Read From Raw Symptoms")
+   user_id = "507f1f77bcf86cd799439014"
+   day = datetime(2026, 2, 1)
+   _insert_symptoms([
+      {"user_id": user_id, "name": "Cough", "details": "x", "severity": 2, "timestamp": day + timedelta(hours=8)},
+      {"user_id": user_id, "name": "Cough", "details": "x", "severity": 6, "timestamp": day + timedelta(days=1, hours=8)},
+      {"user_id": user_id, "name": "Cough", "details": "x", "severity": 4, "timestamp": day + timedelta(days=2, hours=20)},
+   ])
+   # Starts after the first entry and ends before the last: only the middle one counts
+   summary = client.portal.call(summarize_symptoms, app.repositories.symptoms, user_id, day + timedelta(hours=12), day + timedelta(days=2, hours=12))
+   assert summary["total"] == 1
+   assert summary["daily"] == [{"day": "2026-02-02", "count": 1, "mean_severity": 6.0, "max_severity": 6}]
+
+
+@patch("llm.AsyncGroq")
+def test_report_prompt_uses_summary(mock_groq):
+   print("\n[TEST] Generate Report - Prompt Carries Summary, Not Rows")
+   create = mock_groq.return_value.chat.completions.create = AsyncMock(return_value=_completion("Report."))
+   user_id = "507f1f77bcf86cd799439012"
+   for i in range(20):
+      client.post(f"/api/symptoms/?user_id={user_id}", json={"name": "Cough", "details": f"entry {i}", "severity": 3})
+
+   response = client.get(f"/api/reports/{user_id}")
+   assert response.status_code == 200
+   assert response.json()["data_summary"]["symptoms_count"] == 20
+   prompt = create.call_args.kwargs["messages"][1]["content"]
+   assert "- Cough: 20 entries, mean severity 3.0, max 3" in prompt
+   assert "entry 7" not in prompt
+   stats = response.json()["prompt_stats"]
+   assert 0 < stats["tokens_used"] <= stats["token_budget"]
+   assert stats["days_dropped"] == 0
+
+
+@requires_mongo
+@patch("llm.AsyncGroq")
+def test_report_falls_back_to_raw_without_rollups(mock_groq):
+   print("\n[TEST] Generate Report - Missing Rollups Fall Back To Raw Symptoms")
+   create = mock_groq.return_value.chat.completions.create = AsyncMock(return_value=_completion("Report."))
+   user_id = "507f1f77bcf86cd799439015"
+   now = datetime.now() - timedelta(days=3)
+   test_db["symptoms"].insert_many([
+      {"user_id": user_id, "name": "Rash", "details": "x", "severity": 3, "timestamp": now - timedelta(days=i)} for i in range(4)
+   ])
+
+   response = client.get(f"/api/reports/{user_id}")
+   assert response.status_code == 200
+   assert response.json()["data_summary"]["symptoms_count"] == 4
+   assert "- Rash: 4 entries" in create.call_args.kwargs["messages"][1]["content"]
+
+
+def test_prompt_builder_caps_medications():
+   print("\n[TEST] Prompt Builder - Medication List Capped, Least Taken Dropped")
+   medications = [{"name": f"Medication {i}", "frequency": 2, "adherence": i} for i in range(100)]
+   text, stats = build_medication_section(medications)
+   assert stats["medications_dropped"] == 0 and text.count("\n") == 99
+
+   text, stats = build_medication_section(medications, 200)
+   assert stats["medication_tokens_used"] == estimate_tokens(text) <= 200
+   assert text.startswith("- Medication 99: 2 times a day, 99 doses taken")
+   assert "- Medication 0:" not in text
+   assert text.endswith(f"- (+{stats['medications_dropped']} more, least taken omitted)")
+   assert build_medication_section([])[0] == "No medications recorded"
+
+
+@patch("llm.AsyncGroq")
+def test_report_prompt_caps_medications(mock_groq):
+   print("\n[TEST] Generate Report - Many Medications Leave Room For Symptoms")
+   create = mock_groq.return_value.chat.completions.create = AsyncMock(return_value=_completion("Report."))
+   user_id = "507f1f77bcf86cd799439022"
+   client.post(f"/api/symptoms/?user_id={user_id}", json={"name": "Cough", "details": "x", "severity": 3})
+   for i in range(150):
+      client.post(f"/api/medications/?user_id={user_id}", json={"name": f"Long medication name number {i}", "frequency": 1, "times": ["08:00"]})
+
+   with patch("routes.reports.MEDICATION_TOKEN_BUDGET", 300):
+      response = client.get(f"/api/reports/{user_id}")
+   assert response.status_code == 200
+   stats = response.json()["prompt_stats"]
+   assert stats["medications_dropped"] > 0 and stats["medication_tokens_used"] <= 300
+   assert stats["tokens_used"] <= stats["token_budget"]
+   prompt = create.call_args.kwargs["messages"][1]["content"]
+   assert "- Cough: 1 entries" in prompt
+   assert f"(+{stats['medications_dropped']} more" in prompt
+
+
+def _year_summary():
+   start = datetime(2025, 1, 1)
+   daily = [{"day": (start + timedelta(days=i)).strftime("%Y-%m-%d"), "count": 2,
+             "mean_severity": 2.0 + (i % 3), "max_severity": 3 + (i % 3)} for i in range(365)]
+   daily[100] = {"day": daily[100]["day"], "count": 4, "mean_severity": 8.5, "max_severity": 10}
+   daily[200] = {"day": daily[200]["day"], "count": 3, "mean_severity": 7.0, "max_severity": 9}
+   symptoms = [{"name": f"Symptom {i}", "count": 100 - i, "mean_severity": 3.0, "max_severity": 10,
+                "trend_per_week": 0.1, "trend": "stable", "first_seen": start, "last_seen": start + timedelta(days=364)}
+               for i in range(8)]
+   return {"total": sum(d["count"] for d in daily), "symptoms": symptoms, "daily": daily}
+
+
+def test_prompt_builder_collapses_identical_days():
+   print("\n[TEST] Prompt Builder - Identical Days Become Counted Runs")
+   daily = [{"day": f"2026-01-0{i}", "count": 1, "mean_severity": 2.0, "max_severity": 2} for i in range(1, 6)]
+   summary = {"total": 5, "symptoms": [], "daily": daily}
+   text, stats = build_symptom_section(summary)
+   assert "- 2026-01-01..2026-01-05 (5 days): 5, 2.0, 2" in text
+   assert stats["days_merged"] == 4 and stats["days_dropped"] == 0
+
+
+def test_prompt_builder_fits_budget_and_keeps_peaks():
+   print("\n[TEST] Prompt Builder - Year Of Data Fits Budget, Peaks Kept")
+   summary = _year_summary()
+   unbounded, _ = build_symptom_section(summary)
+   assert estimate_tokens(unbounded) > 1000
+
+   for budget in (1000, 400, 250):
+      text, stats = build_symptom_section(summary, budget)
+      assert stats["tokens_used"] == estimate_tokens(text) <= budget
+      assert stats["days_merged"] + stats["days_dropped"] > 0
+      # The two severe days always survive
+      assert f"- {summary['daily'][100]['day']}: 4, 8.5, 10" in text
+      assert f"- {summary['daily'][200]['day']}: 3, 7.0, 9" in text
+      assert "Symptom 0" in text
+
+   text, stats = build_symptom_section(summary, 250)
+   assert stats["symptoms_dropped"][0] == "Symptom 7"
+   assert "less frequent symptoms omitted" in text
+
+
+def _wait_for_job(job_id, timeout=5):
+   deadline = time.monotonic() + timeout
+   while time.monotonic() < deadline:
+      job = client.get(f"/api/reports/jobs/{job_id}").json()
+      if job["status"] in ("done", "failed"):
+         return job
+      time.sleep(0.05)
+   raise AssertionError(f"Report job {job_id} did not finish")
+
+
+@patch("llm.AsyncGroq")
+def test_report_job_lifecycle(mock_groq):
+   print("\n[TEST] Report Job - Queue, Poll, Result and PDF")
+   async def slow_completion(**kwargs):
+      await asyncio.sleep(0.2)
+      return _completion("Queued health report.")
+   mock_groq.return_value.chat.completions.create = AsyncMock(side_effect=slow_completion)
+
+   user_id = client.post("/api/users/", json={
+       "username": "job_user",
+       "email": "job_user@example.com",
+       "unique_id_from_auth": "job_user_001"
+   }).json()["_id"]
+   client.post(f"/api/symptoms/?user_id={user_id}", json={"name": "Cough", "details": "Dry", "severity": 3})
+
+   first = client.post(f"/api/reports/jobs?user_id={user_id}", json={"report_format": "summary"})
+   assert first.status_code == 202
+   assert first.json()["status"] in ("queued", "running")
+   # An equivalent request while the first is pending joins it
+   second = client.post(f"/api/reports/jobs?user_id={user_id}", json={"report_format": "summary"})
+   assert second.json()["_id"] == first.json()["_id"]
+   job_id = first.json()["_id"]
+
+   assert _wait_for_job(job_id)["status"] == "done"
+   result = client.get(f"/api/reports/jobs/{job_id}/result")
+   assert result.status_code == 200
+   assert result.json()["generated_report"] == "Queued health report."
+   assert result.json()["data_summary"]["symptoms_count"] == 1
+
+   pdf = client.get(f"/api/reports/jobs/{job_id}/pdf")
+   assert pdf.status_code == 200
+   assert pdf.headers["content-type"] == "application/pdf"
+   assert mock_groq.return_value.chat.completions.create.await_count == 1
+
+   # Once finished, a new request gets a new job
+   third = client.post(f"/api/reports/jobs?user_id={user_id}", json={"report_format": "summary"})
+   assert third.json()["_id"] != job_id
+
+
+def test_report_job_failure_recorded():
+   print("\n[TEST] Report Job - No Data Fails With 404")
+   response = client.post("/api/reports/jobs?user_id=507f1f77bcf86cd799439011")
+   assert response.status_code == 202
+   job = _wait_for_job(response.json()["_id"])
+   assert job["status"] == "failed"
+   assert job["error"]["status_code"] == 404
+
+   result = client.get(f"/api/reports/jobs/{job['_id']}/result")
+   assert result.status_code == 404
+   assert result.json()["detail"] == "No data found for the specified user and date range"
+
+
+def test_report_job_invalid_ids():
+   print("\n[TEST] Report Job - Invalid and Unknown IDs")
+   assert client.post("/api/reports/jobs?user_id=bad").status_code == 400
+   assert client.get("/api/reports/jobs/bad").status_code == 400
+   assert client.get("/api/reports/jobs/507f1f77bcf86cd799439011").status_code == 404
+   assert client.get("/api/reports/jobs/507f1f77bcf86cd799439011/result").status_code == 404
+
+
+def test_report_job_recovered_after_restart():
+   print("\n[TEST] Report Job - Queued and Expired Jobs Resume")
+   stale = datetime.utcnow() - timedelta(hours=1)
+   base = {"user_id": "507f1f77bcf86cd799439011", "start_date": None, "end_date": None,
+           "report_format": "summary", "pending": True, "created_at": stale, "error": None}
+   jobs = app.repositories.report_jobs
+   queued_id = client.portal.call(jobs.insert, {**base, "dedupe_key": "a", "status": "queued", "started_at": None})
+   running_id = client.portal.call(jobs.insert, {**base, "dedupe_key": "b", "status": "running", "started_at": stale})
+
+   async def fake_report(repositories, user_id, start_date, end_date, report_format):
+      return {"user_id": user_id, "generated_report": "recovered"}
+
+   async def run_queue():
+      queue = ReportJobQueue(app.repositories, fake_report, workers=1, lease_seconds=60)
+      queue.start()
+      for _ in range(100):
+         statuses = [(await jobs.get(job_id))["status"] for job_id in (queued_id, running_id)]
+         if statuses == ["done", "done"]:
+            break
+         await asyncio.sleep(0.02)
+      await queue.stop()
+
+   client.portal.call(run_queue)
+   for job_id in (queued_id, running_id):
+      job = client.portal.call(jobs.get, job_id, True)
+      assert job["status"] == "done"
+      assert job["result"]["generated_report"] == "recovered"
+      assert "pending" not in job
+
+
+def test_report_job_submit_survives_queue_filling_up():
+   print("\n[TEST] Report Job - Queue Filling Up During The Insert Leaves The Job For Recovery")
+   jobs = app.repositories.report_jobs
+   queue = ReportJobQueue(app.repositories, None, workers=1, max_queued=1)
+   insert = jobs.insert
+
+   async def insert_while_another_submit_fills_the_queue(job):
+      job_id = await insert(job)
+      queue._queue.put_nowait(ObjectId())
+      return job_id
+
+   with patch.object(jobs, "insert", side_effect=insert_while_another_submit_fills_the_queue):
+      job = client.portal.call(queue.submit, "507f1f77bcf86cd799439023")
+   assert job["status"] == "queued"
+   stored = client.portal.call(jobs.get, job["_id"])
+   assert stored["status"] == "queued"
+   assert job["_id"] in client.portal.call(jobs.queued_ids)
+
+
+def test_report_job_lease_renewed_while_running():
+   print("\n[TEST] Report Job - Long Runs Keep Their Lease, Stale Runs Cannot Finish")
+   jobs = app.repositories.report_jobs
+   calls = []
+
+   async def slow_report(repositories, user_id, start_date, end_date, report_format):
+      calls.append(user_id)
+      await asyncio.sleep(1)
+      return {"user_id": user_id, "generated_report": "slow"}
+
+   async def run_queue():
+      # Recovery sweeps every 0.3 s and would re-queue a run whose lease is not renewed
+      queue = ReportJobQueue(app.repositories, slow_report, workers=2, lease_seconds=0.3)
+      queue.start()
+      job = await queue.submit("507f1f77bcf86cd799439021")
+      for _ in range(100):
+         if (await jobs.get(job["_id"]))["status"] == "done":
+            break
+         await asyncio.sleep(0.05)
+      await queue.stop()
+      return job["_id"]
+
+   job_id = client.portal.call(run_queue)
+   assert client.portal.call(jobs.get, job_id)["status"] == "done"
+   assert len(calls) == 1
+
+   # A worker whose lease expired (and whose job was re-queued) cannot record an outcome
+   async def stale_finish():
+      stale = datetime.utcnow() - timedelta(hours=1)
+      job_id = await jobs.insert({"user_id": "507f1f77bcf86cd799439021", "start_date": None, "end_date": None,
+                                  "report_format": "summary", "dedupe_key": "lease", "pending": True,
+                                  "status": "queued", "created_at": stale, "started_at": None, "error": None})
+      claimed = await jobs.claim(job_id, stale)
+      await jobs.requeue_expired(datetime.utcnow(), datetime.utcnow())
+      reclaimed = await jobs.claim(job_id, datetime.utcnow())
+      assert not await jobs.renew(job_id, claimed["started_at"], datetime.utcnow())
+      assert not await jobs.finish(job_id, claimed["started_at"], {"status": "done"})
+      assert await jobs.finish(job_id, reclaimed["started_at"], {"status": "failed"})
+      return await jobs.get(job_id)
+
+   job = client.portal.call(stale_finish)
+   assert job["status"] == "failed" and "pending" not in job
+
+
+def test_memory_repositories_match_app_backend():
+   print("\n[TEST] Repositories - In-Memory Backend Matches The App's")
+   memory = MemoryRepositories()
+   user_id = "507f1f77bcf86cd799439016"
+   base = datetime(2026, 3, 1, 10, 0, 0, 123456)
+   # Two entries share a timestamp so the _id tie-break is exercised
+   offsets = [0, 5, 5, 9, 12, 30]
+
+   async def run(repositories):
+      for i, minutes in enumerate(offsets):
+         await repositories.symptoms.create({
+            "_id": ObjectId(f"65f000000000000000000{i:03d}"), "user_id": user_id, "name": "Cough",
+            "details": str(i), "severity": i + 1, "timestamp": base + timedelta(minutes=minutes),
+         })
+      pages, cursor = [], None
+      while True:
+         page, cursor = await repositories.symptoms.list(user_id, base, base + timedelta(minutes=20), limit=2, cursor=cursor)
+         # modified_at is the server clock at write time
+         pages.append([{k: v for k, v in symptom.items() if k != "modified_at"} for symptom in page])
+         if not cursor:
+            break
+      stats = await repositories.symptoms.range_stats(user_id, base, base + timedelta(hours=1))
+      cells = await repositories.symptoms.daily_cells(user_id, base, base + timedelta(hours=1), use_rollups=False)
+
+      await repositories.users.create({"username": "same", "email": None})
+      try:
+         await repositories.users.create({"username": "same", "email": "x@example.com"})
+      except DuplicateKeyError as e:
+         duplicate = e.details["keyPattern"]
+      return pages, stats, {key: {k: cell[k] for k in ("count", "sum", "max")} for key, cell in cells.items()}, duplicate
+
+   assert client.portal.call(run, memory) == client.portal.call(run, app.repositories)
+
+
+def test_bulk_symptoms_per_item_status():
+   print("\n[TEST] Bulk Symptoms - Per-Item Status, Client Timestamps, Idempotent Retry")
+   user_id = "507f1f77bcf86cd799439017"
+   batch = [
+      {"name": "Cough", "details": "morning", "severity": 4, "timestamp": "2026-03-01T06:30:00Z", "client_id": "a"},
+      {"name": "Cough", "details": "no severity"},
+      {"name": "Fever", "details": "evening", "severity": 7, "timestamp": "2026-03-01T20:00:00-02:00", "client_id": "b"},
+      {"name": "Cough", "details": "same client_id", "severity": 2, "client_id": "a"},
+      {"name": "Rash", "details": "from the future", "severity": 1, "timestamp": "2999-01-01T00:00:00Z"},
+      {"name": "Nausea", "details": "server time", "severity": 3},
+   ]
+   response = client.post(f"/api/symptoms/bulk?user_id={user_id}", json=batch)
+   assert response.status_code == 200
+   data = response.json()
+   assert data["created"] == 3
+   assert [r["status"] for r in data["results"]] == ["created", "invalid", "created", "duplicate", "invalid", "created"]
+   assert "severity" in data["results"][1]["error"]
+
+   # Stored in the same UTC+4 convention as single creates
+   symptoms = client.get(f"/api/symptoms/{user_id}").json()
+   by_name = {s["name"]: s for s in symptoms}
+   assert by_name["Cough"]["timestamp"].startswith("2026-03-01T10:30:00")
+   assert by_name["Fever"]["timestamp"].startswith("2026-03-02T02:00:00")
+
+   # Resending the batch stores nothing new
+   retry = client.post(f"/api/symptoms/bulk?user_id={user_id}", json=batch[:1] + batch[2:3]).json()
+   assert retry["created"] == 0
+   assert [r["status"] for r in retry["results"]] == ["duplicate", "duplicate"]
+   assert len(client.get(f"/api/symptoms/{user_id}").json()) == 3
+
+   if DATABASE_BACKEND != "memory":
+      rollups = {(r["day"], r["name"]): r["count"] for r in test_db["symptom_daily_rollups"].find({"user_id": user_id})}
+      assert rollups[("2026-03-01", "Cough")] == 1
+      assert rollups[("2026-03-02", "Fever")] == 1
+
+
+def test_list_medications_etag():
+   print("\n[TEST] List Medications - ETag And 304 Without Running The Query")
+   user_id = "507f1f77bcf86cd799439019"
+   medication_id = client.post(f"/api/medications/?user_id={user_id}", json={"name": "Ibuprofen", "frequency": 1, "times": ["08:00"]}).json()["_id"]
+
+   first = client.get(f"/api/medications/{user_id}")
+   etag = first.headers["ETag"]
+   assert first.status_code == 200 and first.headers["Cache-Control"] == "private, no-cache"
+
+   with patch.object(app.repositories.medications, "list", side_effect=AssertionError("query ran")):
+      cached = client.get(f"/api/medications/{user_id}", headers={"If-None-Match": etag})
+   assert cached.status_code == 304
+   assert cached.headers["ETag"] == etag and cached.content == b""
+   # The tag of a compressed copy of the same body matches too
+   assert client.get(f"/api/medications/{user_id}", headers={"If-None-Match": etag[:-1] + '-gzip"'}).status_code == 304
+
+   # Other query parameters are another representation
+   assert client.get(f"/api/medications/{user_id}?limit=1").headers["ETag"] != etag
+   # Other users' writes leave it alone, this user's writes change it
+   client.post("/api/symptoms/?user_id=507f1f77bcf86cd79943901a", json={"name": "Cough", "details": "x", "severity": 1})
+   assert client.get(f"/api/medications/{user_id}", headers={"If-None-Match": etag}).status_code == 304
+   client.post(f"/api/medications/increment-adherence?medication_id={medication_id}&user_id={user_id}")
+   changed = client.get(f"/api/medications/{user_id}", headers={"If-None-Match": etag})
+   assert changed.status_code == 200 and changed.headers["ETag"] != etag
+   assert changed.json()[0]["adherence"] == 1
+   # "*" is not a wildcard here: the list exists for any user id
+   assert client.get(f"/api/medications/{user_id}", headers={"If-None-Match": "*"}).status_code == 200
+
+
+def test_get_user_etag_needs_an_existing_user():
+   print("\n[TEST] Get User - 304 Only For A User That Exists")
+   user_id = client.post("/api/users/", json={"username": "etag_user", "email": "etag_user@example.com",
+                                              "unique_id_from_auth": "etag_auth"}).json()["_id"]
+   etag = client.get(f"/api/users/{user_id}").headers["ETag"]
+   assert client.get(f"/api/users/{user_id}", headers={"If-None-Match": etag}).status_code == 304
+
+   missing_id = str(ObjectId())
+   guessed = client.get(f"/api/users/{missing_id}").headers.get("ETag")
+   assert guessed is None
+   for header in ("*", etag):
+      assert client.get(f"/api/users/{missing_id}", headers={"If-None-Match": header}).status_code == 404
+
+
+@patch("llm.AsyncGroq")
+def test_report_etag_skips_generation(mock_groq):
+   print("\n[TEST] Generate Report - If-None-Match Skips Generation Until Data Changes")
+   create = mock_groq.return_value.chat.completions.create = AsyncMock(return_value=_completion("Report."))
+   user_id = "507f1f77bcf86cd79943901b"
+   client.post(f"/api/symptoms/?user_id={user_id}", json={"name": "Cough", "details": "x", "severity": 3})
+
+   first = client.get(f"/api/reports/{user_id}")
+   assert first.status_code == 200
+   etag = first.headers["ETag"]
+   assert client.get(f"/api/reports/{user_id}", headers={"If-None-Match": etag}).status_code == 304
+   assert client.get(f"/api/symptoms/{user_id}", headers={"If-None-Match": etag}).status_code == 200
+   assert create.await_count == 1
+
+   client.post(f"/api/symptoms/?user_id={user_id}", json={"name": "Cough", "details": "y", "severity": 4})
+   again = client.get(f"/api/reports/{user_id}", headers={"If-None-Match": etag})
+   assert again.status_code == 200 and again.headers["ETag"] != etag
+   assert create.await_count == 2
+
+
+def test_bson_json_matches_jsonable_encoder():
+   print("\n[TEST] BSON JSON - Same Output As FastAPI's Encoder")
+   document = {"_id": ObjectId(), "name": "Cough", "severity": 3, "nested": {"ids": [ObjectId()]},
+               "timestamp": datetime(2026, 3, 1, 10, 30, 0, 123000), "created_at": datetime(2026, 3, 1),
+               "aware": datetime(2026, 3, 1, tzinfo=timezone.utc), "missing": None}
+   expected = jsonable_encoder(document, custom_encoder={ObjectId: str})
+   assert json.loads(bson_json_dumps(document)) == expected
+
+
+def test_compression_middleware():
+   print("\n[TEST] Compression - Large Bodies Compressed, ETag Tagged, Small Ones Left Alone")
+   inner = FastAPI()
+
+   @inner.get("/big")
+   async def big():
+      return Response(b"[" + b'{"name":"Cough"},' * 200 + b"{}]", media_type="application/json", headers={"ETag": '"7-abc"'})
+
+   @inner.get("/small")
+   async def small():
+      return {"ok": True}
+
+   @inner.get("/streamed")
+   async def streamed():
+      async def chunks():
+         yield b"["
+         for _ in range(200):
+            yield b'{"name":"Cough"},'
+         yield b"{}]"
+      return StreamingResponse(chunks(), media_type="application/json")
+
+   @inner.get("/events")
+   async def events():
+      return StreamingResponse(iter([b"data: x\n\n" * 100]), media_type="text/event-stream")
+
+   with TestClient(CompressionMiddleware(inner, encoding="br", minimum_size=500)) as compressed:
+      response = compressed.get("/big", headers={"Accept-Encoding": "gzip"})
+      assert response.headers["Content-Encoding"] == "gzip"
+      assert response.headers["ETag"] == '"7-abc-gzip"'
+      assert response.headers["Vary"] == "Accept-Encoding"
+      assert response.headers["Content-Length"] == str(response.num_bytes_downloaded)
+      assert len(response.json()) == 201
+      response = compressed.get("/streamed", headers={"Accept-Encoding": "gzip"})
+      assert response.headers["Content-Encoding"] == "gzip" and "Content-Length" not in response.headers
+      assert len(response.json()) == 201
+      assert "Content-Encoding" not in compressed.get("/events", headers={"Accept-Encoding": "gzip"}).headers
+      assert "Content-Encoding" not in compressed.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+      assert "Content-Encoding" not in compressed.get("/big", headers={"Accept-Encoding": "identity"}).headers
+      # Codings are matched by name, and q=0 refuses one
+      assert "Content-Encoding" not in compressed.get("/big", headers={"Accept-Encoding": "gzip;q=0, x-gzipped"}).headers
+      assert compressed.get("/big", headers={"Accept-Encoding": "br;q=0, gzip"}).headers["Content-Encoding"] == "gzip"
+      assert compressed.get("/big", headers={"Accept-Encoding": "br;q=0.5, gzip;q=0.8"}).headers["Content-Encoding"] == "gzip"
+
+
+@pytest.mark.skipif(brotli is None, reason="the optional brotli package is not installed")
+def test_compression_middleware_brotli():
+   print("\n[TEST] Compression - Brotli Preferred When Accepted, ETag Tagged")
+   inner = FastAPI()
+
+   @inner.get("/big")
+   async def big():
+      return Response(b"[" + b'{"name":"Cough"},' * 200 + b"{}]", media_type="application/json", headers={"ETag": '"7-abc"'})
+
+   with TestClient(CompressionMiddleware(inner, encoding="br", minimum_size=500)) as compressed:
+      for accepted in ("gzip, br", "br;q=1.0", "*"):
+         response = compressed.get("/big", headers={"Accept-Encoding": accepted})
+         assert response.headers["Content-Encoding"] == "br"
+         assert response.headers["ETag"] == '"7-abc-br"'
+         # httpx decodes br with the same package
+         assert len(response.json()) == 201
+
+
+def _sync(user_id, token=None, limit=500):
+   """Follow has_more to the end; (merged changes, first page's reset flag, final token)"""
+   merged = {"symptoms": [], "medications": [], "deleted": []}
+   reset = None
+   while True:
+      params = {"limit": limit, **({"since": token} if token else {})}
+      response = client.get(f"/api/sync/{user_id}", params=params)
+      assert response.status_code == 200
+      page = response.json()
+      reset = page["reset"] if reset is None else reset
+      merged["symptoms"] += [s["name"] for s in page["symptoms"]]
+      merged["medications"] += [m["name"] for m in page["medications"]]
+      merged["deleted"] += page["deleted"]["medications"]
+      token = page["sync_token"]
+      if not page["has_more"]:
+         return merged, reset, token
+
+
+@patch("routes.sync.SETTLE_SECONDS", 0)
+def test_sync_snapshot_then_deltas():
+   print("\n[TEST] Sync - Snapshot, Then Only Changes And Tombstones")
+   user_id = "507f1f77bcf86cd799439018"
+   for name in ("Cough", "Fever", "Rash"):
+      client.post(f"/api/symptoms/?user_id={user_id}", json={"name": name, "details": "x", "severity": 3})
+   med_ids = [
+      client.post(f"/api/medications/?user_id={user_id}", json={"name": name, "frequency": 1, "times": ["08:00"]}).json()["_id"]
+      for name in ("Ibuprofen", "Cetirizine")
+   ]
+   time.sleep(0.01)
+
+   # First sync pages through everything
+   changes, reset, token = _sync(user_id, limit=2)
+   assert reset is True
+   assert sorted(changes["symptoms"]) == ["Cough", "Fever", "Rash"]
+   assert changes["medications"] == ["Ibuprofen", "Cetirizine"]
+
+   # Nothing changed: nothing sent
+   changes, reset, token = _sync(user_id, token)
+   assert reset is False
+   assert changes == {"symptoms": [], "medications": [], "deleted": []}
+
+   time.sleep(0.01)
+   client.put(f"/api/medications/{med_ids[0]}?user_id={user_id}", json={"frequency": 2})
+   client.delete(f"/api/medications/{med_ids[1]}?user_id={user_id}")
+   client.post(f"/api/symptoms/?user_id={user_id}", json={"name": "Nausea", "details": "x", "severity": 2})
+   time.sleep(0.01)
+
+   changes, reset, token = _sync(user_id, token, limit=1)
+   assert reset is False
+   assert changes == {"symptoms": ["Nausea"], "medications": ["Ibuprofen"], "deleted": [med_ids[1]]}
+
+   # A token older than the tombstone retention starts over
+   with patch("sync_tokens.TOMBSTONE_TTL_SECONDS", 0):
+      time.sleep(0.01)
+      changes, reset, _ = _sync(user_id, token)
+   assert reset is True
+   assert sorted(changes["symptoms"]) == ["Cough", "Fever", "Nausea", "Rash"]
+   assert changes["medications"] == ["Ibuprofen"]
+
+   assert client.get(f"/api/sync/{user_id}", params={"since": "not-a-token"}).status_code == 400
+   assert client.get("/api/sync/bad").status_code == 400
+
+
+def test_search_symptoms():
+   print("\n[TEST] Search Symptoms - Ranked, Date Filtered, Keyset Paginated")
+   user_id = "507f1f77bcf86cd79943901d"
+   batch = [
+      {"name": "Headache", "details": "behind the eyes", "severity": 6, "timestamp": "2026-01-05T09:00:00Z"},
+      {"name": "Nausea", "details": "after a headache in the morning", "severity": 3, "timestamp": "2026-01-06T09:00:00Z"},
+      {"name": "Headache", "details": "mild", "severity": 2, "timestamp": "2026-02-10T09:00:00Z"},
+      {"name": "Cough", "details": "dry", "severity": 4, "timestamp": "2026-02-11T09:00:00Z"},
+   ]
+   client.post(f"/api/symptoms/bulk?user_id={user_id}", json=batch)
+   # Another user's matching entry stays out of the results
+   client.post("/api/symptoms/?user_id=507f1f77bcf86cd79943901e", json={"name": "Headache", "details": "x", "severity": 1})
+
+   response = client.get(f"/api/symptoms/{user_id}/search", params={"q": "headaches"})
+   assert response.status_code == 200
+   results = response.json()
+   assert [r["name"] for r in results] == ["Headache", "Headache", "Nausea"]
+   assert results[0]["score"] >= results[1]["score"] > results[2]["score"]
+
+   pages, cursor = [], None
+   while True:
+      page = client.get(f"/api/symptoms/{user_id}/search", params={"q": "headache", "limit": 1, **({"cursor": cursor} if cursor else {})})
+      pages += [r["_id"] for r in page.json()]
+      cursor = page.headers.get("X-Next-Cursor")
+      if not cursor:
+         break
+   assert pages == [r["_id"] for r in results]
+
+   january = client.get(f"/api/symptoms/{user_id}/search", params={"q": "headache", "end_date": "2026-01-31T00:00:00"}).json()
+   assert sorted(r["name"] for r in january) == ["Headache", "Nausea"]
+   assert client.get(f"/api/symptoms/{user_id}/search", params={"q": "fever"}).json() == []
+   assert client.get(f"/api/symptoms/{user_id}/search", params={"q": " "}).status_code == 400
+
+
+def test_bulk_symptoms_rejects_oversized_batch():
+   print("\n[TEST] Bulk Symptoms - Oversized Batch And Invalid User")
+   user_id = "507f1f77bcf86cd799439017"
+   with patch("routes.symptoms.BULK_MAX_ITEMS", 2):
+      response = client.post(f"/api/symptoms/bulk?user_id={user_id}", json=[{"name": "x", "details": "y", "severity": 1}] * 3)
+   assert response.status_code == 413
+   assert response.json()["detail"] == "At most 2 symptoms per request"
+   assert client.post("/api/symptoms/bulk?user_id=bad", json=[]).status_code == 400
+
+
 def test_list_users():
    print("\n[TEST] List Users")
    client.post("/api/users/", json={
@@ -417,6 +1403,38 @@ def test_increment_medication_adherence():
    data = response.json()
    assert data["adherence"] == 2
 
+def test_medication_wrong_owner():
+   print("\n[TEST] Medication - Wrong Owner")
+   user_res = client.post("/api/users/", json={
+       "username": "owner_user",
+       "email": "owner_user@example.com",
+       "unique_id_from_auth": "owner_user_auth"
+   })
+   user_id = user_res.json()["_id"]
+   other_user_id = "507f1f77bcf86cd799439011"
+
+   med_res = client.post(f"/api/medications/?user_id={user_id}", json={
+       "name": "Owned Medication",
+       "frequency": 1,
+       "times": ["09:00"]
+   })
+   med_id = med_res.json()["_id"]
+
+   # Another user can neither update, increment nor delete it
+   response = client.put(f"/api/medications/{med_id}?user_id={other_user_id}", json={"frequency": 3})
+   assert response.status_code == 404
+   response = client.post(f"/api/medications/increment-adherence?medication_id={med_id}&user_id={other_user_id}")
+   assert response.status_code == 404
+   response = client.delete(f"/api/medications/{med_id}?user_id={other_user_id}")
+   assert response.status_code == 404
+   assert response.json()["detail"] == "Medication not found or does not belong to user"
+
+   # And the owner's copy is untouched
+   medication = client.get(f"/api/medications/{user_id}").json()[0]
+   assert medication["frequency"] == 1
+   assert medication["adherence"] == 0
+   assert medication == med_res.json()
+
 def test_medication_invalid_user_id():
    print("\n[TEST] Medication - Invalid User ID")
    response = client.post("/api/medications/?user_id=invalid_id", json={
@@ -445,11 +1463,12 @@ def test_medication_not_found():
    assert response.status_code == 404
    assert response.json()["detail"] == "Medication not found or does not belong to user"
 
-@patch("routes.reports.Groq")
+@patch("llm.AsyncGroq")
 def test_generate_pdf_report(mock_groq):
    print("\n[TEST] Generate PDF Report (Mocked)")
    # Setup fake Groq response
    mock_client = mock_groq.return_value
+   mock_client.chat.completions.create = AsyncMock()
    mock_client.chat.completions.create.return_value.choices = [
        type("Choice", (object,), {
            "message": type("Message", (object,), {
@@ -479,7 +1498,7 @@ def test_generate_pdf_report(mock_groq):
    assert response.headers["Content-Type"] == "application/pdf"
 
 
-@patch("routes.reports.Groq")
+@patch("llm.AsyncGroq")
 def test_generate_report_no_data(mock_groq):
    print("\n[TEST] Generate Report - No Data (Expect 404)")
    user_res = client.post("/api/users/", json={
@@ -552,6 +1571,22 @@ def test_register_duplicate_username():
     assert response.status_code == 400
     assert response.json()["detail"] == "Username already registered"
 
+def test_register_duplicate_email():
+    print("\n[TEST] Register - Duplicate Email")
+    client.post("/api/auth/register", json={
+        "username": "duplicate_email_1",
+        "email": "duplicate_email@example.com",
+        "hashed_password": "testpassword123"
+    })
+    
+    response = client.post("/api/auth/register", json={
+        "username": "duplicate_email_2",
+        "email": "duplicate_email@example.com",
+        "hashed_password": "testpassword123"
+    })
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Email already registered"
+
 def test_login_success():
     print("\n[TEST] Login - Success")
     # First register a user
@@ -571,6 +1606,42 @@ def test_login_success():
     assert "access_token" in data
     assert data["token_type"] == "bearer"
 
+def test_login_upgrades_outdated_hash():
+    print("\n[TEST] Login - Hash With An Outdated bcrypt Cost Is Upgraded")
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("oldpassword")
+    client.portal.call(app.repositories.users.create, {"username": "old_hash_user", "email": None, "hashed_password": old_hash})
+
+    response = client.post("/api/auth/login", data={"username": "old_hash_user", "password": "oldpassword"})
+    assert response.status_code == 200
+    stored = client.portal.call(app.repositories.users.get_by_username, "old_hash_user")["hashed_password"]
+    assert stored != old_hash
+    assert not password_hasher.context.needs_update(stored)
+    assert client.post("/api/auth/login", data={"username": "old_hash_user", "password": "oldpassword"}).status_code == 200
+
+def test_password_hashing_leaves_event_loop_responsive():
+    print("\n[TEST] Passwords - bcrypt Runs Off The Event Loop")
+    async def longest_stall_while_hashing():
+        longest, last = 0.0, time.perf_counter()
+        task = asyncio.ensure_future(asyncio.gather(*(password_hasher.hash("burst") for _ in range(4))))
+        while not task.done():
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            longest, last = max(longest, now - last), now
+        await task
+        return longest
+
+    # Four hashes take well over 100 ms of CPU; the loop never stalls that long
+    assert client.portal.call(longest_stall_while_hashing) < 0.1
+
+    busy_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("busypassword")
+    client.portal.call(app.repositories.users.create, {"username": "busy_login_user", "email": None, "hashed_password": busy_hash})
+    with patch.object(password_hasher, "max_pending", 0):
+        response = client.post("/api/auth/login", data={"username": "busy_login_user", "password": "busypassword"})
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    with patch.object(password_hasher, "max_pending", 0):
+        response = client.post("/api/auth/register", json={"username": "busy_user", "email": "busy@example.com", "hashed_password": "x"})
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+
 def test_login_invalid_credentials():
     print("\n[TEST] Login - Invalid Credentials")
     response = client.post("/api/auth/login", data={
@@ -635,6 +1706,60 @@ def test_get_current_user_expired_token():
     assert response.status_code == 401
     assert response.json()["detail"] == "Could not validate credentials"
 
+def test_get_current_user_cached():
+    print("\n[TEST] Get Current User - Token And User Served From Cache")
+    client.post("/api/auth/register", json={"username": "cached_user", "email": "cached_user@example.com", "hashed_password": "testpassword123"})
+    token = client.post("/api/auth/login", data={"username": "cached_user", "password": "testpassword123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    before = client.get("/health/auth-cache").json()
+
+    users = app.repositories.users
+    with patch.object(users, "get_by_username", AsyncMock(wraps=users.get_by_username)) as lookup, \
+         patch("routes.auth.jwt.decode", wraps=jwt.decode) as decode:
+        responses = [client.get("/api/auth/me", headers=headers) for _ in range(3)]
+    assert all(response.status_code == 200 for response in responses)
+    assert responses[0].json() == responses[2].json()
+    assert lookup.await_count == 1
+    assert decode.call_count == 1
+
+    after = client.get("/health/auth-cache").json()
+    assert after["users"]["hits"] - before["users"]["hits"] == 2
+    assert after["token_claims"]["misses"] - before["token_claims"]["misses"] == 1
+
+def test_user_update_invalidates_auth_cache():
+    print("\n[TEST] Update User - Disabling Or Changing A User Reaches Cached Sessions")
+    client.post("/api/auth/register", json={"username": "disable_me", "email": "disable_me@example.com", "hashed_password": "testpassword123"})
+    token = client.post("/api/auth/login", data={"username": "disable_me", "password": "testpassword123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    user_id = client.get("/api/auth/me", headers=headers).json()["_id"]
+
+    response = client.patch(f"/api/users/{user_id}", json={"email": "changed@example.com"}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["email"] == "changed@example.com"
+    assert client.get("/api/auth/me", headers=headers).json()["email"] == "changed@example.com"
+    assert client.patch(f"/api/users/{user_id}", json={}, headers=headers).status_code == 400
+
+    assert client.patch(f"/api/users/{user_id}", json={"disabled": True}, headers=headers).status_code == 200
+    response = client.get("/api/auth/me", headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Inactive user"
+    # A disabled account cannot sign itself back in
+    assert client.patch(f"/api/users/{user_id}", json={"disabled": False}, headers=headers).status_code == 400
+
+def test_user_update_requires_the_user_themselves():
+    print("\n[TEST] Update User - Only The Signed-In User Can Change Their Account")
+    client.post("/api/auth/register", json={"username": "patch_owner", "email": "patch_owner@example.com", "hashed_password": "testpassword123"})
+    client.post("/api/auth/register", json={"username": "patch_other", "email": "patch_other@example.com", "hashed_password": "testpassword123"})
+    owner_token = client.post("/api/auth/login", data={"username": "patch_owner", "password": "testpassword123"}).json()["access_token"]
+    other_token = client.post("/api/auth/login", data={"username": "patch_other", "password": "testpassword123"}).json()["access_token"]
+    owner_id = client.get("/api/auth/me", headers={"Authorization": f"Bearer {owner_token}"}).json()["_id"]
+
+    assert client.patch(f"/api/users/{owner_id}", json={"disabled": True}).status_code == 401
+    response = client.patch(f"/api/users/{owner_id}", json={"disabled": True}, headers={"Authorization": f"Bearer {other_token}"})
+    assert response.status_code == 403
+    assert client.patch(f"/api/users/{ObjectId()}", json={"disabled": True}, headers={"Authorization": f"Bearer {owner_token}"}).status_code == 403
+    assert client.get("/api/auth/me", headers={"Authorization": f"Bearer {owner_token}"}).status_code == 200
+
 def test_update_medication_no_fields():
     print("\n[TEST] Update Medication - No Fields")
     user_res = client.post("/api/users/", json={
@@ -710,7 +1835,7 @@ def test_increment_adherence_not_found():
     assert response.status_code == 404
     assert response.json()["detail"] == "Medication not found or does not belong to user"
 
-@patch("routes.reports.Groq")
+@patch("llm.AsyncGroq")
 def test_generate_report_invalid_date_format(mock_groq):
     print("\n[TEST] Generate Report - Invalid Date Format")
     user_res = client.post("/api/users/", json={
@@ -723,10 +1848,11 @@ def test_generate_report_invalid_date_format(mock_groq):
     response = client.get(f"/api/reports/{user_id}?start_date=invalid_date&end_date=invalid_date")
     assert response.status_code == 422
 
-@patch("routes.reports.Groq")
+@patch("llm.AsyncGroq")
 def test_generate_report_groq_error(mock_groq):
     print("\n[TEST] Generate Report - Groq API Error")
     mock_client = mock_groq.return_value
+    mock_client.chat.completions.create = AsyncMock()
     mock_client.chat.completions.create.side_effect = Exception("Groq API Error")
     
     user_res = client.post("/api/users/", json={
@@ -749,10 +1875,11 @@ def test_generate_report_groq_error(mock_groq):
     assert response.status_code == 500
     assert "Error generating report" in response.json()["detail"]
 
-@patch("routes.reports.Groq")
+@patch("llm.AsyncGroq")
 def test_generate_pdf_report_fpdf_error(mock_groq):
     print("\n[TEST] Generate PDF Report - FPDF Error")
     mock_client = mock_groq.return_value
+    mock_client.chat.completions.create = AsyncMock()
     mock_client.chat.completions.create.return_value.choices = [
         type("Choice", (object,), {
             "message": type("Message", (object,), {
@@ -778,36 +1905,341 @@ def test_generate_pdf_report_fpdf_error(mock_groq):
     start_date = (datetime.now() - timedelta(days=30)).isoformat()
     end_date = datetime.now().isoformat()
     
-    # Mock the FPDF import
-    with patch("fpdf.FPDF") as mock_fpdf:
+    # Mock the FPDF import; the patch only reaches a render in this process,
+    # and no cached copy of the same PDF may answer instead
+    app.pdf_renderer.cache.clear()
+    with patch.object(app.pdf_renderer, "processes", 0), patch("fpdf.FPDF") as mock_fpdf:
         mock_fpdf.side_effect = Exception("FPDF Error")
         
         response = client.get(f"/api/reports/{user_id}/pdf?start_date={start_date}&end_date={end_date}")
         assert response.status_code == 500
         assert "Error generating PDF" in response.json()["detail"]
 
-@patch('main.MongoClient')
-def test_startup_db_connection_success(mock_mongo_client):
+@patch("llm.AsyncGroq")
+def test_pdf_rendered_in_process_pool_and_cached(mock_groq):
+    print("\n[TEST] Generate PDF Report - Process Pool, Cached, Shared Between Concurrent Requests")
+    mock_groq.return_value.chat.completions.create = AsyncMock(return_value=_completion("Pooled PDF report."))
+    user_id = "507f1f77bcf86cd79943901c"
+    client.post(f"/api/symptoms/?user_id={user_id}", json={"name": "Cough", "details": "x", "severity": 3})
+    app.pdf_renderer.cache.clear()
+    renders = app.pdf_renderer.renders
+
+    first = client.get(f"/api/reports/{user_id}/pdf")
+    assert first.status_code == 200
+    assert first.content.startswith(b"%PDF")
+    assert first.headers["Content-Length"] == str(len(first.content))
+    assert app.pdf_renderer.pool is not None
+    # Same text and period: served from the cache
+    assert client.get(f"/api/reports/{user_id}/pdf").content == first.content
+    assert app.pdf_renderer.renders == renders + 1
+
+    report = {"user_id": user_id, "report_period": {"start_date": "a", "end_date": "b"}, "generated_report": "Concurrent."}
+    async def render_twice():
+        return await asyncio.gather(app.pdf_renderer.render(report), app.pdf_renderer.render(dict(report)))
+    one, two = client.portal.call(render_twice)
+    assert one == two and app.pdf_renderer.renders == renders + 2
+
+    with patch.object(app.pdf_renderer, "max_pending", 0):
+        app.pdf_renderer.cache.clear()
+        busy = client.get(f"/api/reports/{user_id}/pdf")
+    assert busy.status_code == 503 and busy.headers["Retry-After"] == "5"
+
+class _ControlledExecutor(Executor):
+    """Executor whose single task finishes when the test says so"""
+    def __init__(self):
+        self.future = Future()
+        self.shut_down = False
+
+    def submit(self, fn, *args, **kwargs):
+        return self.future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.shut_down = True
+
+def test_pdf_renderer_recovers_from_broken_pool():
+    print("\n[TEST] Generate PDF Report - A Dead Worker Only Costs The Renders In Flight")
+    renderer = PDFRenderer(processes=1)
+    report = {"user_id": "x", "report_period": {"start_date": "a", "end_date": "b"}, "generated_report": "After a crash."}
+
+    async def crash_then_render():
+        broken = renderer._get_pool()
+        # A worker dying mid-task breaks the whole executor
+        with pytest.raises(BrokenProcessPool):
+            await asyncio.wrap_future(broken.submit(os._exit, 1))
+        with pytest.raises(BrokenProcessPool):
+            await renderer.render(report)
+        assert renderer.pool is None
+        return await renderer.render(report)
+
+    try:
+        assert client.portal.call(crash_then_render).startswith(b"%PDF")
+        assert renderer.renders == 1
+    finally:
+        renderer.close()
+
+    # A render failing late on an old pool leaves the pool built since alone
+    stale, fresh = _ControlledExecutor(), _ControlledExecutor()
+    renderer.pool = stale
+    async def late_failure():
+        task = asyncio.ensure_future(renderer._render("late", report))
+        await asyncio.sleep(0)
+        renderer.pool = fresh
+        stale.future.set_exception(BrokenProcessPool())
+        with pytest.raises(BrokenProcessPool):
+            await task
+    client.portal.call(late_failure)
+    assert renderer.pool is fresh and stale.shut_down and not fresh.shut_down
+
+def test_client_pool_options_from_env(monkeypatch):
+    print("\n[TEST] MongoDB Pool Options From Env")
+    monkeypatch.setenv("MONGODB_MAX_POOL_SIZE", "25")
+    monkeypatch.setenv("MONGODB_MIN_POOL_SIZE", "5")
+    monkeypatch.setenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "2000")
+    monkeypatch.setenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "3000")
+
+    options = get_client_options()
+    assert options["maxPoolSize"] == 25
+    assert options["minPoolSize"] == 5
+    assert options["waitQueueTimeoutMS"] == 2000
+    assert options["serverSelectionTimeoutMS"] == 3000
+
+
+def test_db_pool_stats_endpoint():
+    print("\n[TEST] MongoDB Pool Stats Endpoint")
+    response = client.get("/health/db-pool")
+    assert response.status_code == 200
+    data = response.json()
+    for key in ["open_connections", "checked_out", "wait_queue_length", "checkouts", "checkout_latency_ms", "max_pool_size"]:
+        assert key in data
+
+
+@requires_mongo
+def test_indexes_created_on_startup():
+    print("\n[TEST] Indexes Created On Startup")
+    assert "user_id_timestamp_id" in test_db["symptoms"].index_information()
+    assert "user_id_id" in test_db["medications"].index_information()
+    user_indexes = test_db["users"].index_information()
+    assert user_indexes["username_unique"]["unique"] is True
+    assert user_indexes["email_unique"]["unique"] is True
+
+
+def test_create_user_duplicate_username():
+    print("\n[TEST] Create User - Duplicate Username")
+    client.post("/api/users/", json={
+        "username": "dup_name_user",
+        "email": "dup_name_1@example.com",
+        "unique_id_from_auth": "dup_name_auth_1"
+    })
+    response = client.post("/api/users/", json={
+        "username": "dup_name_user",
+        "email": "dup_name_2@example.com",
+        "unique_id_from_auth": "dup_name_auth_2"
+    })
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Username already registered"
+
+
+def test_create_user_duplicate_email():
+    print("\n[TEST] Create User - Duplicate Email")
+    client.post("/api/users/", json={
+        "username": "dup_email_user_1",
+        "email": "dup_email@example.com",
+        "unique_id_from_auth": "dup_email_auth_1"
+    })
+    response = client.post("/api/users/", json={
+        "username": "dup_email_user_2",
+        "email": "dup_email@example.com",
+        "unique_id_from_auth": "dup_email_auth_2"
+    })
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Email already registered"
+
+
+def test_ensure_indexes_logs_failures_as_errors():
+   print("\n[TEST] Ensure Indexes - Failures Logged At Error Level")
+   from indexes import ensure_indexes
+   from pymongo.errors import OperationFailure
+   database = MagicMock()
+   database.get_collection.return_value.create_indexes = AsyncMock(side_effect=OperationFailure("E11000 duplicate key error"))
+   with patch("indexes.log_event") as log:
+      client.portal.call(ensure_indexes, database)
+   users_call = next(c for c in log.call_args_list if c.kwargs["collection"] == "users")
+   assert users_call.args[1:] == ("index_creation_failed", logging.ERROR)
+   assert users_call.kwargs["indexes"] == ["username_unique", "email_unique"]
+
+def _sample(name, **labels):
+   return REGISTRY.get_sample_value(name, labels) or 0
+
+@patch("llm.AsyncGroq")
+def test_metrics_endpoint(mock_groq):
+   print("\n[TEST] Metrics - Route, LLM And PDF Render Latencies In Prometheus Format")
+   completion = _completion("Measured report.")
+   completion.usage = SimpleNamespace(prompt_tokens=120, completion_tokens=30)
+   mock_groq.return_value.chat.completions.create = AsyncMock(return_value=completion)
+   user_id = "507f1f77bcf86cd79943901d"
+   route = {"method": "GET", "route": "/api/reports/{user_id}", "status": "200"}
+   requests_before = _sample("http_request_duration_seconds_count", **route)
+   prompt_before = _sample("llm_tokens_total", model="llama-3.3-70b-versatile", kind="prompt")
+   renders_before = sum(_sample("pdf_render_duration_seconds_count", executor=executor) for executor in ("process", "thread"))
+
+   client.post(f"/api/symptoms/?user_id={user_id}", json={"name": "Cough", "details": "x", "severity": 3})
+   assert client.get(f"/api/reports/{user_id}").status_code == 200
+   app.pdf_renderer.cache.clear()
+   assert client.get(f"/api/reports/{user_id}/pdf").status_code == 200
+   assert client.get("/api/no-such-route").status_code == 404
+
+   response = client.get("/metrics")
+   assert response.status_code == 200
+   assert response.headers["content-type"].startswith("text/plain")
+   assert 'http_request_duration_seconds_bucket{le="0.1",method="GET",route="/api/reports/{user_id}",status="200"}' in response.text
+   assert 'route="unmatched",status="404"' in response.text
+   assert "/api/no-such-route" not in response.text
+   assert _sample("http_request_duration_seconds_count", **route) == requests_before + 1
+   assert _sample("llm_tokens_total", model="llama-3.3-70b-versatile", kind="prompt") >= prompt_before + 120
+   assert _sample("llm_request_duration_seconds_count", model="llama-3.3-70b-versatile", call="complete", outcome="ok") >= 1
+   assert sum(_sample("pdf_render_duration_seconds_count", executor=executor) for executor in ("process", "thread")) == renders_before + 1
+
+def test_mongodb_command_metrics():
+   print("\n[TEST] Metrics - MongoDB Command Latency Per Collection And Command")
+   listener = CommandMetrics()
+   labels = {"collection": "symptoms", "command": "find", "outcome": "succeeded"}
+   before = _sample("mongodb_command_duration_seconds_count", **labels)
+   started = SimpleNamespace(command_name="find", command={"find": "symptoms", "filter": {}}, request_id=7, connection_id=("db", 27017))
+   listener.started(started)
+   listener.succeeded(SimpleNamespace(command_name="find", request_id=7, connection_id=("db", 27017), duration_micros=2500))
+   assert _sample("mongodb_command_duration_seconds_count", **labels) == before + 1
+   # Database commands have no collection
+   listener.started(SimpleNamespace(command_name="aggregate", command={"aggregate": 1}, request_id=8, connection_id=("db", 27017)))
+   listener.failed(SimpleNamespace(command_name="aggregate", request_id=8, connection_id=("db", 27017), duration_micros=100))
+   assert _sample("mongodb_command_duration_seconds_count", collection="", command="aggregate", outcome="failed") >= 1
+   assert listener._collections == {}
+
+def test_structured_sampled_logging():
+   print("\n[TEST] Logging - JSON Lines, Hot-Path Events Sampled")
+   def record(level, sampled, **fields):
+      entry = logging.LogRecord("medbud.test", level, __file__, 1, "symptom_created", None, None)
+      entry.sampled, entry.fields = sampled, fields
+      return entry
+
+   never = SamplingFilter(rate=0.0)
+   assert not never.filter(record(logging.INFO, True))
+   assert never.filter(record(logging.INFO, False))
+   assert never.filter(record(logging.WARNING, True))
+   assert SamplingFilter(rate=1.0).filter(record(logging.INFO, True))
+
+   line = json.loads(JSONFormatter().format(record(logging.INFO, True, user_id="u1", symptom_id=ObjectId("507f1f77bcf86cd799439011"))))
+   assert line["event"] == "symptom_created" and line["level"] == "info" and line["logger"] == "medbud.test"
+   assert line["user_id"] == "u1" and line["symptom_id"] == "507f1f77bcf86cd799439011"
+
+def test_seed_generator_is_deterministic():
+   print("\n[TEST] Seeding - Same Seed, Same Documents In API Shapes")
+   end = datetime(2026, 6, 1)
+   first = generate_user(7, 42, 120, end, "hash")
+   assert generate_user(7, 42, 120, end, "hash") == first
+   assert generate_user(8, 42, 120, end, "hash") != first
+
+   user, symptoms, medications, rollups = first
+   assert user["username"] == "seed7_user42"
+   assert all(symptom["user_id"] == str(user["_id"]) for symptom in symptoms + medications)
+   for symptom in symptoms:
+      SymptomCreate(**{key: symptom[key] for key in ("name", "details", "severity")})
+      # Stored UTC+4 like create_symptom's, within the requested history
+      assert end - timedelta(days=120) < symptom["timestamp"] - timedelta(hours=4) < end
+   for medication in medications:
+      MedicationCreate(**{key: medication[key] for key in ("name", "frequency", "times")})
+      assert len(medication["times"]) == medication["frequency"]
+   assert sum(rollup["count"] for rollup in rollups) == len(symptoms)
+   assert sum(rollup["sum"] for rollup in rollups) == sum(symptom["severity"] for symptom in symptoms)
+
+@requires_mongo
+def test_seeded_users_readable_through_api():
+   print("\n[TEST] Seeding - Batched Inserts Are Served By The API")
+   hashed = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("seed-password")
+   writer = BatchWriter(test_db, batch_size=50)
+   seeded = [generate_user(1, number, 60, datetime.utcnow(), hashed) for number in range(3)]
+   for user, symptoms, medications, rollups in seeded:
+      writer.add("users", [user])
+      writer.add("symptoms", symptoms)
+      writer.add("medications", medications)
+      writer.add("symptom_daily_rollups", rollups)
+   writer.flush()
+   assert writer.written["users"] == 3
+   assert writer.written["symptoms"] == sum(len(symptoms) for _, symptoms, _, _ in seeded)
+
+   user, symptoms, medications, _ = seeded[0]
+   listed = client.get(f"/api/symptoms/{user['_id']}", params={"limit": 100}).json()
+   assert len(listed) == min(100, len(symptoms))
+   assert len(client.get(f"/api/medications/{user['_id']}").json()) == len(medications)
+   assert client.post("/api/auth/login", data={"username": user["username"], "password": "seed-password"}).status_code == 200
+
+@contextmanager
+def _fails_if_loop_blocked(threshold=0.1):
+   """Fail the test if anything stalls the app's event loop for `threshold` seconds or more"""
+   monitor = client.portal.call(LoopMonitor(threshold).start)
+   try:
+      yield monitor
+   finally:
+      client.portal.call(monitor.stop)
+   stalls = "\n".join(f"{stall['lag_ms']} ms in {stall['route']}:\n{stall['stack']}" for stall in monitor.stalls)
+   assert not monitor.stalls, f"Event loop blocked:\n{stalls}"
+
+def test_async_routes_do_not_block_event_loop():
+   print("\n[TEST] Event Loop - Auth, Symptom And Medication Routes Do Not Block It")
+   with _fails_if_loop_blocked():
+      client.post("/api/auth/register", json={"username": "loop_user", "email": "loop_user@example.com", "hashed_password": "testpassword123"})
+      token = client.post("/api/auth/login", data={"username": "loop_user", "password": "testpassword123"}).json()["access_token"]
+      user_id = client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"}).json()["_id"]
+      assert client.post(f"/api/symptoms?user_id={user_id}", json={"name": "Headache", "details": "Mild", "severity": 3}).status_code == 200
+      assert client.get(f"/api/symptoms/{user_id}").status_code == 200
+      assert client.get(f"/api/medications/{user_id}").status_code == 200
+
+def test_loop_monitor_reports_blocking_route():
+   print("\n[TEST] Event Loop - A Blocking Async Route Is Reported With Its Route And Stack")
+   async def blocking_route():
+      time.sleep(0.3)
+      return {}
+   app.add_api_route("/api/loop-monitor-test/{item_id}", blocking_route)
+   try:
+      with pytest.raises(AssertionError) as failure:
+         with _fails_if_loop_blocked():
+            assert client.get("/api/loop-monitor-test/1").status_code == 200
+   finally:
+      app.router.routes.pop()
+   message = str(failure.value)
+   assert "GET /api/loop-monitor-test/{item_id}" in message
+   assert "time.sleep(0.3)" in message
+
+   assert client.get("/health/event-loop").json()["enabled"] == (app.loop_monitor is not None)
+
+@requires_mongo
+@patch('main.ensure_indexes', new_callable=AsyncMock)
+@patch('database.AsyncMongoClient')
+def test_startup_db_connection_success(mock_mongo_client, mock_ensure_indexes):
     print("\n[TEST] Startup DB Connection - Success")
-    # Configure the mock MongoClient to return a mock client instance
+    # Configure the mock AsyncMongoClient to return a mock client instance
     mock_client_instance = MagicMock()
+    mock_client_instance.close = AsyncMock()
     mock_mongo_client.return_value = mock_client_instance
     
     # Use TestClient in a 'with' block to trigger startup and shutdown events
     with TestClient(app):
-        # Check that MongoClient was called with the correct URI
+        # Check that AsyncMongoClient was called with the correct URI
         expected_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-        mock_mongo_client.assert_called_once_with(expected_uri)
+        mock_mongo_client.assert_called_once_with(expected_uri, event_listeners=ANY, **get_client_options())
         
         # Check that the database was accessed
         expected_db_name = os.getenv("DATABASE_NAME", "medbud_db")
         mock_client_instance.__getitem__.assert_called_once_with(expected_db_name)
 
+        # Check that the index registry was applied to that database
+        mock_ensure_indexes.assert_awaited_once()
 
-@patch('main.MongoClient')
+
+@requires_mongo
+@patch('database.AsyncMongoClient')
 def test_startup_db_connection_failure(mock_mongo_client):
     print("\n[TEST] Startup DB Connection - Failure")
-    # Configure the mock MongoClient to raise an exception on instantiation
+    # Configure the mock AsyncMongoClient to raise an exception on instantiation
     mock_mongo_client.side_effect = Exception("Simulated DB Connection Error")
     
     # Using TestClient in a 'with' block should raise the startup exception
@@ -820,14 +2252,17 @@ def test_startup_db_connection_failure(mock_mongo_client):
     
     # Ensure the mock was called attempting to connect
     expected_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-    mock_mongo_client.assert_called_once_with(expected_uri)
+    mock_mongo_client.assert_called_once_with(expected_uri, event_listeners=ANY, **get_client_options())
 
 
-@patch('main.MongoClient')
-def test_shutdown_db_connection(mock_mongo_client):
+@requires_mongo
+@patch('main.ensure_indexes', new_callable=AsyncMock)
+@patch('database.AsyncMongoClient')
+def test_shutdown_db_connection(mock_mongo_client, mock_ensure_indexes):
     print("\n[TEST] Shutdown DB Connection")
-    # Configure the mock MongoClient to return a mock client instance
+    # Configure the mock AsyncMongoClient to return a mock client instance
     mock_client_instance = MagicMock()
+    mock_client_instance.close = AsyncMock()
     mock_mongo_client.return_value = mock_client_instance
     
     # Use TestClient in a 'with' block. Startup is called on entry,
@@ -841,6 +2276,3 @@ def test_shutdown_db_connection(mock_mongo_client):
     # After the 'with' block exits, the shutdown event should have been triggered
     # Verify that the close method on the mock client instance was called
     mock_client_instance.close.assert_called_once()
-
-
-
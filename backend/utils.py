@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from bson import ObjectId
 
 def parse_date_range(start_date=None, end_date=None):
@@ -18,3 +18,9 @@ def validate_object_id(id_str: str):
     if not ObjectId.is_valid(id_str):
         return False
     return True
+
+def bson_datetime(value: datetime):
+    """Datetime as MongoDB stores and returns it: naive UTC, millisecond precision"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
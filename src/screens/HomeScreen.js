@@ -40,7 +40,6 @@ function HomeScreen({ navigation }) {
   const [recentSymptoms, setRecentSymptoms] = useState([]);
   const [medications, setMedications] = useState([]);
   const [searchQuery, setSearchQuery] = useState('');
-  const [allSymptoms, setAllSymptoms] = useState([]);
   const [filteredSymptoms, setFilteredSymptoms] = useState([]);
   const [isLoading, setIsLoading] = useState(false);
   const [isRefreshing, setIsRefreshing] = useState(false);
@@ -70,14 +69,13 @@ function HomeScreen({ navigation }) {
       
       // Load both symptoms and medications in parallel
       const [symptomsData, medicationsData] = await Promise.all([
-        api.getSymptoms(userId, 0, 100),  // Get last 100 symptoms for search
+        api.getSymptoms(userId, 0, 5),  // Only the most recent are shown; search runs on the server
         api.getMedications(userId)
       ]);
 
       // Ensure symptomsData is an array
       const validSymptoms = Array.isArray(symptomsData) ? symptomsData : [];
       
-      setAllSymptoms(validSymptoms);
       // Sort symptoms by timestamp and get the 5 most recent
       const sortedSymptoms = [...validSymptoms].sort((a, b) => 
         new Date(b.timestamp) - new Date(a.timestamp)
@@ -87,7 +85,6 @@ function HomeScreen({ navigation }) {
     } catch (error) {
       console.error('Error loading dashboard data:', error);
       setError('Failed to load dashboard data. Pull down to refresh.');
-      setAllSymptoms([]);
       setRecentSymptoms([]);
       setMedications([]);
     } finally {
@@ -109,48 +106,32 @@ function HomeScreen({ navigation }) {
       setSearchError(null);
       setIsLoading(true);
       
-      // Filter symptoms based on search criteria
-      let filtered = [...allSymptoms];
+      const userId = getUserIdSafe();
       
-      // Filter by search query (name or details)
-      if (searchQuery.trim()) {
-        const query = searchQuery.trim().toLowerCase();
-        filtered = filtered.filter(symptom => {
-          const nameMatch = symptom.name && symptom.name.toLowerCase().includes(query);
-          const detailsMatch = symptom.details && symptom.details.toLowerCase().includes(query);
-          return nameMatch || detailsMatch;
-        });
+      // Date bounds: start of the start day to the end of the end day
+      let rangeStart = null;
+      let rangeEnd = null;
+      if (startDate) {
+        rangeStart = new Date(startDate);
+        rangeStart.setHours(0, 0, 0, 0);
       }
-      
-      // Filter by date range
-      if (startDate || endDate) {
-        filtered = filtered.filter(symptom => {
-          if (!symptom.timestamp) return false;
-          
-          const symptomDate = new Date(symptom.timestamp);
-          
-          if (startDate && endDate) {
-            const start = new Date(startDate);
-            const end = new Date(endDate);
-            // Set end date to end of day
-            end.setHours(23, 59, 59, 999);
-            return symptomDate >= start && symptomDate <= end;
-          } else if (startDate) {
-            const start = new Date(startDate);
-            return symptomDate >= start;
-          } else if (endDate) {
-            const end = new Date(endDate);
-            // Set end date to end of day
-            end.setHours(23, 59, 59, 999);
-            return symptomDate <= end;
-          }
-          
-          return true;
-        });
+      if (endDate) {
+        rangeEnd = new Date(endDate);
+        rangeEnd.setHours(23, 59, 59, 999);
       }
+      const range = {
+        startDate: rangeStart ? rangeStart.toISOString() : null,
+        endDate: rangeEnd ? rangeEnd.toISOString() : null,
+      };
       
-      // Sort results by timestamp (newest first)
-      filtered.sort((a, b) => new Date(b.timestamp) - new Date(a.timestamp));
+      // Searched on the server, so the whole history is covered
+      let filtered;
+      if (searchQuery.trim()) {
+        const { results } = await api.searchSymptoms(userId, searchQuery.trim(), { ...range, limit: 50 });
+        filtered = results;
+      } else {
+        filtered = await api.getSymptoms(userId, 0, 100, range);
+      }
       
       setFilteredSymptoms(filtered);
       setSearchPerformed(true);
@@ -1,5 +1,29 @@
 const BASE_URL = 'https://medbud.onrender.com';
 
+// Last ETag and body per URL; a 304 reuses the body instead of downloading it again
+const etagCache = new Map();
+
+async function getWithETag(url) {
+  const cached = etagCache.get(url);
+  const response = await fetch(url, cached ? { headers: { 'If-None-Match': cached.etag } } : undefined);
+
+  if (response.status === 304 && cached) {
+    return cached.data;
+  }
+
+  const data = await response.json();
+
+  if (!response.ok) {
+    throw new Error(data.message || `HTTP error! status: ${response.status}`);
+  }
+
+  const etag = response.headers.get('ETag');
+  if (etag) {
+    etagCache.set(url, { etag, data });
+  }
+  return data;
+}
+
 export const api = {
   // Symptoms
   async createSymptom(symptomData, user_id) {
@@ -20,13 +44,27 @@ export const api = {
     return data;
   },
 
-  async getSymptoms(userId, skip = 0, limit = 100) {
+  async getSymptoms(userId, skip = 0, limit = 100, { startDate = null, endDate = null } = {}) {
     if (!userId) {
       console.error('Missing userId in getSymptoms call');
       return []; // Return empty array if no userId
     }
     
-    const response = await fetch(`${BASE_URL}/api/symptoms/${userId}?skip=${skip}&limit=${limit}`);
+    const params = new URLSearchParams({ skip: String(skip), limit: String(limit) });
+    if (startDate) params.append('start_date', startDate);
+    if (endDate) params.append('end_date', endDate);
+    
+    return getWithETag(`${BASE_URL}/api/symptoms/${userId}?${params.toString()}`);
+  },
+
+  // Full-text search, best match first; pass the previous page's nextCursor to continue
+  async searchSymptoms(userId, query, { startDate = null, endDate = null, limit = 20, cursor = null } = {}) {
+    const params = new URLSearchParams({ q: query, limit: String(limit) });
+    if (startDate) params.append('start_date', startDate);
+    if (endDate) params.append('end_date', endDate);
+    if (cursor) params.append('cursor', cursor);
+    
+    const response = await fetch(`${BASE_URL}/api/symptoms/${userId}/search?${params.toString()}`);
     
     const data = await response.json();
     
@@ -34,7 +72,7 @@ export const api = {
       throw new Error(data.message || `HTTP error! status: ${response.status}`);
     }
     
-    return data;
+    return { results: data, nextCursor: response.headers.get('X-Next-Cursor') };
   },
 
   // Medications
@@ -62,15 +100,7 @@ export const api = {
       return []; // Return empty array if no userId
     }
     
-    const response = await fetch(`${BASE_URL}/api/medications/${userId}`);
-    
-    const data = await response.json();
-    
-    if (!response.ok) {
-      throw new Error(data.message || `HTTP error! status: ${response.status}`);
-    }
-    
-    return data;
+    return getWithETag(`${BASE_URL}/api/medications/${userId}`);
   },
 
   async updateMedication(medicationId, medicationData, userId) {
@@ -104,6 +134,22 @@ export const api = {
     return true;
   },
 
+  // Delta sync: pass the previous response's sync_token as `since`
+  async sync(userId, since = null, limit = 500) {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (since) params.append('since', since);
+
+    const response = await fetch(`${BASE_URL}/api/sync/${userId}?${params.toString()}`);
+
+    const data = await response.json();
+
+    if (!response.ok) {
+      throw new Error(data.message || `HTTP error! status: ${response.status}`);
+    }
+
+    return data;
+  },
+
   // Reports
   async generateReport(userId, startDate = null, endDate = null, format = 'summary') {
     let url = `${BASE_URL}/api/reports/${userId}`;